@@ -0,0 +1,89 @@
+import hmac
+import json
+import os
+from typing import Dict, Any
+
+from db import get_connection, release_connection
+from partitions import partition_status, run_maintenance
+from timing import dumps, timed
+
+MAINTENANCE_TIME_BUDGET = float(os.environ.get('MAINTENANCE_TIME_BUDGET', '20'))
+
+@timed('db-maintenance')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Monthly partition upkeep for chat_messages and ai_tools_usage
+    Args: event with httpMethod (GET, POST, OPTIONS); POST ?action=maintain pre-creates upcoming
+          partitions and archives/drops expired ones (for a scheduled trigger), requires
+          X-Maintenance-Token header matching MAINTENANCE_TOKEN
+    Returns: JSON with partitions per table, or the maintenance report
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Maintenance-Token',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Database not configured'})
+        }
+    
+    params = event.get('queryStringParameters', {}) or {}
+    
+    if method == 'GET':
+        conn = get_connection(dsn)
+        try:
+            result = partition_status(conn)
+        finally:
+            release_connection(dsn, conn)
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': dumps(result)
+        }
+    
+    if method == 'POST' and params.get('action') == 'maintain':
+        # Удаление секций необратимо: без настроенного и совпавшего токена не запускаем
+        token = os.environ.get('MAINTENANCE_TOKEN')
+        headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+        provided = headers.get('x-maintenance-token') or ''
+        if not token or not hmac.compare_digest(provided.encode('utf-8'), token.encode('utf-8')):
+            return {
+                'statusCode': 403,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps({'error': 'Forbidden'})
+            }
+        
+        conn = get_connection(dsn)
+        try:
+            result = run_maintenance(conn, MAINTENANCE_TIME_BUDGET)
+        finally:
+            release_connection(dsn, conn)
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': dumps(result)
+        }
+    
+    return {
+        'statusCode': 405,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Method not allowed'})
+    }
@@ -0,0 +1,199 @@
+import gzip
+import os
+import re
+import time
+from datetime import date
+from typing import Dict, Any, List, Optional, Tuple
+
+import boto3
+import psycopg2
+
+# Срок хранения в месяцах по таблицам; 0 — хранить всегда
+PARTITION_RETENTION_MONTHS = {
+    'chat_messages': int(os.environ.get('CHAT_MESSAGES_RETENTION_MONTHS', '12')),
+    'ai_tools_usage': int(os.environ.get('AI_TOOLS_USAGE_RETENTION_MONTHS', '6')),
+}
+PARTITION_PRECREATE_MONTHS = int(os.environ.get('PARTITION_PRECREATE_MONTHS', '3'))
+# archive — выгрузить секцию в S3 перед удалением, drop — удалить без выгрузки
+# (только явным RETENTION_ACTION=drop)
+RETENTION_ACTION = os.environ.get('RETENTION_ACTION', 'archive')
+# Локальный каталог только промежуточный: /tmp функции не переживает инстанс
+ARCHIVE_DIR = os.environ.get('ARCHIVE_DIR', '/tmp/archive')
+ARCHIVE_S3_BUCKET = os.environ.get('ARCHIVE_S3_BUCKET')
+ARCHIVE_S3_PREFIX = os.environ.get('ARCHIVE_S3_PREFIX', 'db-archive/')
+ARCHIVE_S3_ENDPOINT = os.environ.get('ARCHIVE_S3_ENDPOINT', 'https://storage.yandexcloud.net')
+
+PARTITION_NAME_RE = re.compile(r'_p(\d{4})_(\d{2})$')
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(parent: str, month: date) -> str:
+    return f'{parent}_p{month:%Y_%m}'
+
+def partition_month(name: str) -> Optional[date]:
+    match = PARTITION_NAME_RE.search(name)
+    return date(int(match.group(1)), int(match.group(2)), 1) if match else None
+
+def list_partitions(conn: Any, parent: str) -> List[Dict[str, Any]]:
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT c.relname, c.reltuples::BIGINT, pg_total_relation_size(c.oid)
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = %s
+            ORDER BY c.relname
+            """,
+            (parent,)
+        )
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    return [
+        {'name': name, 'month': partition_month(name), 'estimated_rows': max(rows_estimate, 0), 'bytes': size}
+        for name, rows_estimate, size in rows
+    ]
+
+def create_partition(conn: Any, parent: str, month: date) -> None:
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS {partition_name(parent, month)}
+            PARTITION OF {parent} FOR VALUES FROM (%s) TO (%s)
+            """,
+            (month.isoformat(), add_months(month, 1).isoformat())
+        )
+        conn.commit()
+    finally:
+        cur.close()
+
+def rolled_up(conn: Any, name: str) -> bool:
+    # Секцию ai_tools_usage удаляем только после того, как её строки вошли в сводки
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            SELECT COALESCE((SELECT max(id) FROM {name}), 0)
+                   <= COALESCE((SELECT last_id FROM usage_rollup_state WHERE source = 'ai_tools_usage'), 0)
+            """
+        )
+        return bool(cur.fetchone()[0])
+    finally:
+        cur.close()
+
+def archive_partition(conn: Any, name: str) -> str:
+    '''
+    Export a partition as gzip-compressed CSV via COPY, staged in
+    ARCHIVE_DIR and uploaded to ARCHIVE_S3_BUCKET. Returns the archive
+    location.
+    '''
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    path = os.path.join(ARCHIVE_DIR, f'{name}.csv.gz')
+    cur = conn.cursor()
+    try:
+        with gzip.open(path, 'wt', encoding='utf-8') as archive:
+            cur.copy_expert(f'COPY {name} TO STDOUT WITH (FORMAT csv, HEADER)', archive)
+        conn.commit()
+    finally:
+        cur.close()
+    
+    key = f'{ARCHIVE_S3_PREFIX}{name}.csv.gz'
+    try:
+        s3 = boto3.client('s3', endpoint_url=ARCHIVE_S3_ENDPOINT)
+        s3.upload_file(path, ARCHIVE_S3_BUCKET, key)
+    finally:
+        os.remove(path)
+    return f's3://{ARCHIVE_S3_BUCKET}/{key}'
+
+def retention_blocker() -> Optional[str]:
+    # Причина не удалять устаревшие секции: удаление необратимо, поэтому
+    # без надёжного места для выгрузки или явного drop секции остаются
+    if RETENTION_ACTION == 'drop':
+        return None
+    if RETENTION_ACTION != 'archive':
+        return 'unknown_retention_action'
+    if not ARCHIVE_S3_BUCKET:
+        return 'no_archive_target'
+    return None
+
+def drop_partition(conn: Any, parent: str, name: str) -> None:
+    cur = conn.cursor()
+    try:
+        cur.execute(f'ALTER TABLE {parent} DETACH PARTITION {name}')
+        cur.execute(f'DROP TABLE {name}')
+        conn.commit()
+    finally:
+        cur.close()
+
+def maintain_table(conn: Any, parent: str, today: date, deadline: float) -> Dict[str, Any]:
+    report: Dict[str, Any] = {'created': [], 'archived': [], 'dropped': [], 'skipped': [], 'errors': []}
+    existing = {partition['name'] for partition in list_partitions(conn, parent)}
+    
+    current = today.replace(day=1)
+    for offset in range(PARTITION_PRECREATE_MONTHS + 1):
+        month = add_months(current, offset)
+        name = partition_name(parent, month)
+        if name in existing:
+            continue
+        try:
+            create_partition(conn, parent, month)
+            report['created'].append(name)
+        except psycopg2.Error as e:
+            # Обычно это строки этого месяца в DEFAULT-секции — нужен ручной перенос
+            conn.rollback()
+            report['errors'].append({'partition': name, 'error': str(e).strip()})
+    
+    retention = PARTITION_RETENTION_MONTHS[parent]
+    if not retention:
+        return report
+    cutoff = add_months(current, -retention)
+    expired: List[Tuple[date, str]] = []
+    for name in existing:
+        month = partition_month(name)
+        if month is not None and month < cutoff:
+            expired.append((month, name))
+    expired.sort()
+    
+    blocker = retention_blocker()
+    for _, name in expired:
+        if blocker:
+            report['skipped'].append({'partition': name, 'reason': blocker})
+            continue
+        if time.monotonic() > deadline:
+            report['skipped'].append({'partition': name, 'reason': 'time_budget'})
+            continue
+        try:
+            if parent == 'ai_tools_usage' and not rolled_up(conn, name):
+                report['skipped'].append({'partition': name, 'reason': 'not_rolled_up'})
+                continue
+            if RETENTION_ACTION == 'archive':
+                report['archived'].append({'partition': name, 'location': archive_partition(conn, name)})
+            drop_partition(conn, parent, name)
+            report['dropped'].append(name)
+        except Exception as e:
+            # Выгрузка не удалась — секция остаётся на месте до следующего запуска
+            conn.rollback()
+            report['errors'].append({'partition': name, 'error': str(e).strip()})
+    return report
+
+def run_maintenance(conn: Any, time_budget: float, today: Optional[date] = None) -> Dict[str, Any]:
+    deadline = time.monotonic() + time_budget
+    today = today or date.today()
+    return {parent: maintain_table(conn, parent, today, deadline) for parent in PARTITION_RETENTION_MONTHS}
+
+def partition_status(conn: Any) -> Dict[str, Any]:
+    return {
+        parent: {
+            'retention_months': retention,
+            'partitions': [
+                {**partition, 'month': partition['month'].isoformat() if partition['month'] else None}
+                for partition in list_partitions(conn, parent)
+            ]
+        }
+        for parent, retention in PARTITION_RETENTION_MONTHS.items()
+    }
@@ -1,69 +1,23 @@
 import json
 import os
-import urllib.request
-import urllib.error
-import psycopg2
-import base64
-import ssl
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 
-def get_system_prompt(dsn: str) -> str:
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            "SELECT prompt_text FROM system_prompts WHERE ai_model = 'gigachat' AND is_active = true ORDER BY created_at DESC LIMIT 1"
-        )
-        row = cur.fetchone()
-        return row[0] if row else "Ты - полезный ассистент."
-    finally:
-        cur.close()
-        conn.close()
-
-def get_knowledge_base(dsn: str) -> str:
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT file_name, content FROM knowledge_base ORDER BY created_at DESC LIMIT 10")
-        rows = cur.fetchall()
-        if not rows:
-            return ""
-        
-        kb_text = "\n\nБаза знаний:\n"
-        for title, content in rows:
-            kb_text += f"\n## {title}\n{content}\n"
-        return kb_text
-    finally:
-        cur.close()
-        conn.close()
-
-def get_gigachat_token(api_key: str) -> str:
-    auth_data = base64.b64encode(api_key.encode()).decode()
-    
-    ctx = ssl.create_default_context()
-    ctx.check_hostname = False
-    ctx.verify_mode = ssl.CERT_NONE
-    
-    req = urllib.request.Request(
-        'https://ngw.devices.sberbank.ru:9443/api/v2/oauth',
-        data=b'scope=GIGACHAT_API_PERS',
-        headers={
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'Accept': 'application/json',
-            'RqUID': 'request-id-123',
-            'Authorization': f'Basic {auth_data}'
-        },
-        method='POST'
-    )
-    
-    response = urllib.request.urlopen(req, context=ctx)
-    data = json.loads(response.read().decode('utf-8'))
-    return data['access_token']
+from chat_history import collect_text, get_history, put_turns, valid_session_id
+from kb_search import estimate_tokens
+from llm_context import get_llm_contexts, last_user_text
+from llm_providers import Provider, failover_chain, gigachat_response, gigachat_text, with_failover
+from prompt_budget import assemble_prompt
+from provider_client import ProviderError
+from response_cache import cache_headers, cacheable_question, get_cache_version, get_cached_response, put_cached_response
+from streaming import STREAM_FORMATS, stream_response
+from timing import dumps, timed
+from usage_log import log_usage
 
+@timed('gigachat')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: GigaChat API with system prompts and knowledge base
-    Args: event with httpMethod (POST, OPTIONS), body with messages array
+    Args: event with httpMethod (POST, OPTIONS), body with messages array, optional session_id (then only new messages), stream/stream_format
     Returns: GigaChat response with assistant message
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -102,56 +56,128 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     body_data = json.loads(event.get('body', '{}'))
     user_messages = body_data.get('messages', [])
+    stream = bool(body_data.get('stream'))
+    stream_format = body_data.get('stream_format', 'sse')
+    
+    if stream and stream_format not in STREAM_FORMATS:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Unsupported stream_format'})
+        }
+    
+    session_id = body_data.get('session_id')
+    if session_id is not None and not valid_session_id(session_id):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Invalid session_id'})
+        }
+    
+    # С session_id клиент присылает только новое сообщение, историю читаем из БД
+    new_messages = user_messages
+    persist = bool(session_id and dsn)
+    if persist:
+        user_messages = get_history(dsn, session_id) + new_messages
+    
+    # Первый вопрос диалога ищем в кеше ответов; body.cache = false отключает кеш
+    question = cacheable_question(user_messages) if dsn and body_data.get('cache', True) else None
+    # Недоступная версия контекста (сбой БД) — отвечаем мимо кеша
+    context_version = get_cache_version(dsn, 'gigachat') if question else None
+    if context_version is None:
+        question = None
+    cache_status = 'MISS' if question else 'BYPASS'
+    if question:
+        cached = get_cached_response(dsn, 'gigachat', context_version, question)
+        if cached:
+            response_data, match = cached
+            if persist:
+                put_turns(dsn, session_id, 'gigachat', new_messages, gigachat_text(response_data))
+            log_usage(dsn, 'gigachat', session_id, last_user_text(user_messages), gigachat_text(response_data),
+                      {'requested': 'gigachat', 'stream': stream, 'cache': 'HIT'})
+            if stream:
+                response = stream_response([gigachat_text(response_data)], stream_format, {'cache': 'HIT'})
+            else:
+                response = {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': dumps(response_data)
+                }
+            response['headers'].update(cache_headers('HIT', match))
+            return response
     
-    system_prompt = get_system_prompt(dsn) if dsn else "Ты - полезный ассистент."
-    knowledge_base = get_knowledge_base(dsn) if dsn else ""
+    query = last_user_text(user_messages)
+    # Если gigachat недоступен (5xx, таймаут, открытый автомат), отвечает запасной провайдер
+    chain = failover_chain('gigachat')
     
-    messages = [
-        {'role': 'system', 'content': system_prompt + knowledge_base}
-    ]
+    def prepare(provider: Provider) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        system_prompt, history, token_budget = assemble_prompt(provider.name, contexts[provider.name], user_messages)
+        return provider.payload(system_prompt, history, token_budget['max_tokens'], stream), token_budget
     
-    for msg in user_messages:
-        messages.append({
-            'role': msg['role'],
-            'content': msg.get('text', msg.get('content', ''))
-        })
+    def open_stream(provider: Provider) -> Tuple[Any, Dict[str, int]]:
+        request_payload, token_budget = prepare(provider)
+        return provider.open_stream(request_payload, provider.api_key()), token_budget
+    
+    def complete(provider: Provider) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        request_payload, token_budget = prepare(provider)
+        return provider.complete(request_payload, provider.api_key()), token_budget
     
     try:
-        access_token = get_gigachat_token(api_key)
-        
-        request_payload = {
-            'model': 'GigaChat',
-            'messages': messages,
-            'temperature': 0.7,
-            'max_tokens': 2000
-        }
+        # Контекст всей цепочки читается один раз до попыток: сбой БД не повод
+        # переключаться на запасного провайдера
+        contexts = get_llm_contexts(dsn, [provider.name for provider in chain], query)
+        if stream:
+            provider, (lines, token_budget) = with_failover(chain, open_stream)
+            parts: List[str] = []
+            response = stream_response(
+                collect_text(provider.deltas(lines), parts), stream_format,
+                {'token_budget': token_budget, 'provider': provider.name}
+            )
+            if persist:
+                put_turns(dsn, session_id, provider.name, new_messages, ''.join(parts))
+            log_usage(dsn, provider.name, session_id, query, ''.join(parts), {
+                'requested': 'gigachat', 'stream': True, 'cache': cache_status, 'token_budget': token_budget
+            }, token_budget['prompt_tokens'], estimate_tokens(''.join(parts)))
+            response['headers'].update(cache_headers(cache_status))
+            return response
         
-        ctx = ssl.create_default_context()
-        ctx.check_hostname = False
-        ctx.verify_mode = ssl.CERT_NONE
+        provider, (response_data, token_budget) = with_failover(chain, complete)
+        answer = provider.text(response_data)
+        if provider.name != 'gigachat':
+            # Ответ запасного провайдера приводим к привычному клиенту формату и не кешируем
+            response_data = gigachat_response(answer)
+        elif question:
+            put_cached_response(dsn, 'gigachat', context_version, question, response_data)
+        if persist:
+            put_turns(dsn, session_id, provider.name, new_messages, answer)
+        log_usage(dsn, provider.name, session_id, query, answer, {
+            'requested': 'gigachat', 'stream': False, 'cache': cache_status, 'token_budget': token_budget
+        }, token_budget['prompt_tokens'], estimate_tokens(answer))
+        response_data['token_budget'] = token_budget
+        response_data['provider'] = provider.name
         
-        req = urllib.request.Request(
-            'https://gigachat.devices.sberbank.ru/api/v1/chat/completions',
-            data=json.dumps(request_payload).encode('utf-8'),
-            headers={
+        return {
+            'statusCode': 200,
+            'headers': {
                 'Content-Type': 'application/json',
-                'Accept': 'application/json',
-                'Authorization': f'Bearer {access_token}'
+                'Access-Control-Allow-Origin': '*',
+                **cache_headers(cache_status)
             },
-            method='POST'
-        )
-        
-        response = urllib.request.urlopen(req, context=ctx)
-        response_data = json.loads(response.read().decode('utf-8'))
-        
+            'isBase64Encoded': False,
+            'body': dumps(response_data)
+        }
+    except ProviderError as e:
         return {
-            'statusCode': 200,
+            'statusCode': e.status_code,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
             },
             'isBase64Encoded': False,
-            'body': json.dumps(response_data)
+            'body': json.dumps({'error': e.body})
         }
     except Exception as e:
         return {
@@ -0,0 +1,183 @@
+import atexit
+import json
+import os
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from typing import Dict, Any, Deque, List, Optional, Tuple
+
+from psycopg2.extras import execute_values
+
+from db import get_connection, release_connection
+from timing import current_timer
+
+USAGE_BATCH_SIZE = int(os.environ.get('USAGE_BATCH_SIZE', '100'))
+USAGE_FLUSH_INTERVAL = float(os.environ.get('USAGE_FLUSH_INTERVAL', '2'))
+USAGE_MAX_BUFFER = int(os.environ.get('USAGE_MAX_BUFFER', '2000'))
+USAGE_TEXT_LIMIT = int(os.environ.get('USAGE_TEXT_LIMIT', '4000'))
+USAGE_SPILL_PATH = os.environ.get('USAGE_SPILL_PATH', '/tmp/ai_tools_usage.spill.jsonl')
+USAGE_SPILL_MAX_BYTES = int(os.environ.get('USAGE_SPILL_MAX_BYTES', str(10 * 1024 * 1024)))
+
+USAGE_COLUMNS = (
+    'tool_name', 'session_id', 'input_text', 'output_text', 'parameters',
+    'latency_ms', 'input_tokens', 'output_tokens', 'created_at'
+)
+UsageRow = Tuple[Any, ...]
+
+def _clip(text: Optional[str]) -> Optional[str]:
+    return text[:USAGE_TEXT_LIMIT] if text else text
+
+def insert_usage_rows(conn: Any, rows: List[UsageRow]) -> None:
+    cur = conn.cursor()
+    try:
+        execute_values(
+            cur,
+            f"""
+            INSERT INTO ai_tools_usage ({', '.join(USAGE_COLUMNS)})
+            VALUES %s
+            """,
+            rows,
+            template='(%s, %s, %s, %s, %s::jsonb, %s, %s, %s, %s::timestamp)',
+            page_size=USAGE_BATCH_SIZE
+        )
+        conn.commit()
+    finally:
+        cur.close()
+
+class UsageLogger:
+    '''
+    Write-behind buffer for ai_tools_usage. log() only appends to memory;
+    a background thread writes everything buffered every
+    USAGE_FLUSH_INTERVAL seconds, or as soon as a full batch has
+    accumulated, with multi-row INSERTs. When Postgres is unavailable batches are
+    spilled to a local file (bounded) and replayed after the next
+    successful write; when the buffer is full new events are dropped.
+    '''
+    
+    def __init__(self) -> None:
+        self.buffer: Deque[Tuple[str, UsageRow]] = deque()
+        self.lock = threading.Lock()
+        self.wake = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.stats: Dict[str, int] = {'logged': 0, 'written': 0, 'batches': 0, 'dropped': 0, 'spilled': 0, 'replayed': 0}
+    
+    def log(self, dsn: str, row: UsageRow) -> None:
+        with self.lock:
+            if len(self.buffer) >= USAGE_MAX_BUFFER:
+                self.stats['dropped'] += 1
+                return
+            self.buffer.append((dsn, row))
+            self.stats['logged'] += 1
+            full = len(self.buffer) >= USAGE_BATCH_SIZE
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='usage-log', daemon=True)
+                self.thread.start()
+        # Досрочно будим писателя только под полную пачку, иначе каждое
+        # событие уходило бы отдельным INSERT; остальное забирает таймер
+        if full:
+            self.wake.set()
+    
+    def run(self) -> None:
+        while True:
+            self.wake.wait(USAGE_FLUSH_INTERVAL)
+            self.wake.clear()
+            self.flush()
+    
+    def take(self) -> Dict[str, List[UsageRow]]:
+        # Всё накопленное за время предыдущей записи уходит одной пачкой
+        batches: Dict[str, List[UsageRow]] = {}
+        with self.lock:
+            while self.buffer:
+                dsn, row = self.buffer.popleft()
+                batches.setdefault(dsn, []).append(row)
+        return batches
+    
+    def flush(self) -> None:
+        for dsn, rows in self.take().items():
+            if self.write(dsn, rows):
+                self.replay(dsn)
+            else:
+                self.spill(rows)
+    
+    def write(self, dsn: str, rows: List[UsageRow]) -> bool:
+        # Любая ошибка записи — повод сбросить пачку на диск, а не уронить фоновый поток
+        try:
+            conn = get_connection(dsn)
+        except Exception:
+            return False
+        try:
+            insert_usage_rows(conn, rows)
+        except Exception:
+            return False
+        finally:
+            release_connection(dsn, conn)
+        self.stats['written'] += len(rows)
+        self.stats['batches'] += 1
+        return True
+    
+    def spill(self, rows: List[UsageRow]) -> None:
+        # DSN с паролем на диск не пишем: при повторе берётся DSN функции
+        try:
+            size = os.path.getsize(USAGE_SPILL_PATH) if os.path.exists(USAGE_SPILL_PATH) else 0
+            if size >= USAGE_SPILL_MAX_BYTES:
+                self.stats['dropped'] += len(rows)
+                return
+            with open(USAGE_SPILL_PATH, 'a', encoding='utf-8') as f:
+                for row in rows:
+                    f.write(json.dumps(row, ensure_ascii=False) + '\n')
+            self.stats['spilled'] += len(rows)
+        except OSError:
+            self.stats['dropped'] += len(rows)
+    
+    def replay(self, dsn: str) -> None:
+        if not os.path.exists(USAGE_SPILL_PATH):
+            return
+        # Файл переименовываем, чтобы новые сбросы на диск не смешались с повтором
+        replay_path = f'{USAGE_SPILL_PATH}.replay'
+        try:
+            os.replace(USAGE_SPILL_PATH, replay_path)
+            with open(replay_path, encoding='utf-8') as f:
+                entries = [json.loads(line) for line in f if line.strip()]
+            os.remove(replay_path)
+        except (OSError, ValueError):
+            return
+        
+        # Строки другого формата (сброшены до смены колонок) повторно не пишем
+        rows = [tuple(entry) for entry in entries if len(entry) == len(USAGE_COLUMNS)]
+        self.stats['dropped'] += len(entries) - len(rows)
+        if rows and self.write(dsn, rows):
+            self.stats['replayed'] += len(rows)
+        elif rows:
+            self.spill(rows)
+
+_logger = UsageLogger()
+
+def log_usage(dsn: Optional[str], tool_name: str, session_id: Optional[str] = None,
+              input_text: Optional[str] = None, output_text: Optional[str] = None,
+              parameters: Optional[Dict[str, Any]] = None, input_tokens: Optional[int] = None,
+              output_tokens: Optional[int] = None) -> None:
+    if not dsn:
+        return
+    # Задержка — время вызова функции до момента записи события
+    timer = current_timer()
+    _logger.log(dsn, (
+        tool_name,
+        session_id,
+        _clip(input_text),
+        _clip(output_text),
+        json.dumps(parameters or {}, ensure_ascii=False, default=str),
+        round(timer.elapsed_ms()) if timer else None,
+        input_tokens,
+        output_tokens,
+        # Время события в UTC: строка может попасть в БД позже, после повтора с диска
+        datetime.now(timezone.utc).replace(tzinfo=None).isoformat()
+    ))
+
+def get_usage_stats() -> Dict[str, Any]:
+    return {**_logger.stats, 'buffered': len(_logger.buffer)}
+
+def flush_usage() -> None:
+    _logger.flush()
+
+# При остановке экземпляра дописываем то, что осталось в буфере
+atexit.register(flush_usage)
@@ -1,13 +1,38 @@
 import json
 import os
-import psycopg2
 import hashlib
-from typing import Dict, Any
+import base64
+from datetime import datetime
+from typing import Dict, Any, List, Tuple
+
+import psycopg2
+
+from db import get_connection, release_connection
+from kb_index import index_document, remove_document, reindex_all
+from timing import dumps, timed
+
+SEARCH_LIMIT_DEFAULT = 20
+SEARCH_LIMIT_MAX = 100
+LIST_LIMIT_DEFAULT = 50
+LIST_LIMIT_MAX = 200
+
+LIST_FIELDS = {
+    'id': 'id',
+    'title': 'file_name',
+    'category': 'category',
+    'preview': 'left(content, 200)',
+    'content': 'content',
+    'created_at': 'created_at',
+    'updated_at': 'updated_at'
+}
+LIST_FIELDS_DEFAULT = ['id', 'title', 'category', 'preview', 'created_at', 'updated_at']
 
+@timed('knowledge-base')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: API for knowledge base and admin auth (auth_action query param)
-    Args: event with httpMethod, body with document/auth data
+    Args: event with httpMethod, body with document/auth data, q for full-text search,
+          cursor/limit/fields for paginated listing
     Returns: JSON with documents or auth result
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -34,7 +59,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Database not configured'})
         }
     
-    conn = psycopg2.connect(dsn)
+    conn = get_connection(dsn)
     cur = conn.cursor()
     
     try:
@@ -48,8 +73,20 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         
         if method == 'GET':
             doc_id = params.get('id')
+            search_query = (params.get('q') or '').strip()
             
-            if doc_id:
+            if search_query:
+                try:
+                    limit = max(1, min(int(params.get('limit', SEARCH_LIMIT_DEFAULT)), SEARCH_LIMIT_MAX))
+                except ValueError:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': 'limit must be an integer'})
+                    }
+                result = search_documents(cur, search_query, limit)
+            elif doc_id:
                 cur.execute(
                     "SELECT id, file_name, content, category, created_at, updated_at FROM knowledge_base WHERE id = %s",
                     (doc_id,)
@@ -67,27 +104,32 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 else:
                     result = None
             else:
-                cur.execute(
-                    "SELECT id, file_name, content, category, created_at, updated_at FROM knowledge_base ORDER BY created_at DESC"
-                )
-                rows = cur.fetchall()
-                result = [
-                    {
-                        'id': row[0],
-                        'title': row[1],
-                        'content': row[2],
-                        'category': row[3],
-                        'created_at': row[4].isoformat() if row[4] else None,
-                        'updated_at': row[5].isoformat() if row[5] else None
+                try:
+                    result = list_documents(cur, params)
+                except ValueError as e:
+                    return {
+                        'statusCode': 400,
+                        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                        'isBase64Encoded': False,
+                        'body': json.dumps({'error': str(e)})
                     }
-                    for row in rows
-                ]
             
             return {
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'isBase64Encoded': False,
-                'body': json.dumps(result)
+                'body': dumps(result)
+            }
+        
+        elif method == 'POST' and params.get('action') == 'reindex':
+            chunk_count = reindex_all(cur)
+            conn.commit()
+            
+            return {
+                'statusCode': 200,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps({'chunks': chunk_count, 'message': 'Index rebuilt'})
             }
         
         elif method == 'POST':
@@ -101,6 +143,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 (title, content, category)
             )
             new_id = cur.fetchone()[0]
+            index_document(cur, new_id, title, content)
             conn.commit()
             
             return {
@@ -121,6 +164,15 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 "UPDATE knowledge_base SET file_name = %s, content = %s, category = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s",
                 (title, content, category, doc_id)
             )
+            if cur.rowcount == 0:
+                conn.rollback()
+                return {
+                    'statusCode': 404,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': json.dumps({'error': 'Document not found'})
+                }
+            index_document(cur, doc_id, title, content)
             conn.commit()
             
             return {
@@ -135,6 +187,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             doc_id = params.get('id')
             
             cur.execute("DELETE FROM knowledge_base WHERE id = %s", (doc_id,))
+            remove_document(cur, doc_id)
             conn.commit()
             
             return {
@@ -152,9 +205,95 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'Method not allowed'})
             }
     
+    except psycopg2.Error as e:
+        # Сбой записи документа или индекса откатываем целиком: документ и его фрагменты согласованы
+        conn.rollback()
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e).strip()})
+        }
     finally:
         cur.close()
-        conn.close()
+        release_connection(dsn, conn)
+
+def encode_cursor(created_at: Any, doc_id: int) -> str:
+    raw = json.dumps([created_at.isoformat() if created_at else None, doc_id])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    try:
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(doc_id)
+    except (ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+def list_documents(cur, params: Dict[str, Any]) -> Dict[str, Any]:
+    # Keyset-пагинация по (created_at, id): страница читается по индексу, без OFFSET
+    fields = [f.strip() for f in params['fields'].split(',')] if params.get('fields') else LIST_FIELDS_DEFAULT
+    unknown = [f for f in fields if f not in LIST_FIELDS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    limit = max(1, min(int(params.get('limit', LIST_LIMIT_DEFAULT)), LIST_LIMIT_MAX))
+    
+    columns = ', '.join(LIST_FIELDS[f] for f in fields)
+    query = f"SELECT created_at, id, {columns} FROM knowledge_base"
+    args: List[Any] = []
+    if params.get('cursor'):
+        query += " WHERE (created_at, id) < (%s, %s)"
+        args.extend(decode_cursor(params['cursor']))
+    query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+    args.append(limit + 1)
+    
+    cur.execute(query, args)
+    rows = cur.fetchall()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    items = []
+    for row in rows:
+        item = {}
+        for name, value in zip(fields, row[2:]):
+            item[name] = value.isoformat() if isinstance(value, datetime) else value
+        items.append(item)
+    
+    return {
+        'items': items,
+        'has_more': has_more,
+        'next_cursor': encode_cursor(rows[-1][0], rows[-1][1]) if has_more else None
+    }
+
+def search_documents(cur, search_query: str, limit: int) -> List[Dict[str, Any]]:
+    # Сначала ранжируем по GIN-индексу, ts_headline считаем только для попавших в выдачу
+    cur.execute(
+        """
+        SELECT id, file_name, category, created_at, updated_at, rank,
+               ts_headline('russian', content, query, 'MaxFragments=2, MinWords=10, MaxWords=30')
+        FROM (
+            SELECT kb.id, kb.file_name, kb.category, kb.created_at, kb.updated_at, kb.content, query,
+                   ts_rank_cd(kb.search_vector, query) AS rank
+            FROM knowledge_base kb, websearch_to_tsquery('russian', %s) query
+            WHERE kb.search_vector @@ query
+            ORDER BY rank DESC
+            LIMIT %s
+        ) ranked
+        ORDER BY rank DESC
+        """,
+        (search_query, limit)
+    )
+    return [
+        {
+            'id': row[0],
+            'title': row[1],
+            'category': row[2],
+            'created_at': row[3].isoformat() if row[3] else None,
+            'updated_at': row[4].isoformat() if row[4] else None,
+            'rank': float(row[5]),
+            'snippet': row[6]
+        }
+        for row in cur.fetchall()
+    ]
 
 def handle_login(event: Dict[str, Any], conn) -> Dict[str, Any]:
     body_data = json.loads(event.get('body', '{}'))
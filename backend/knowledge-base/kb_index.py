@@ -0,0 +1,83 @@
+from typing import Any, Tuple
+
+from psycopg2.extras import execute_values
+
+from kb_search import analyze_document
+
+def unindex_document(cur: Any, doc_id: Any) -> Tuple[int, int]:
+    cur.execute("DELETE FROM kb_chunks WHERE doc_id = %s RETURNING term_count", (doc_id,))
+    rows = cur.fetchall()
+    return len(rows), sum(row[0] for row in rows)
+
+def _insert_document(cur: Any, doc_id: Any, title: str, content: str) -> Tuple[int, int]:
+    analyzed = analyze_document(title or '', content or '')
+    if not analyzed:
+        return 0, 0
+    
+    chunk_ids = execute_values(
+        cur,
+        "INSERT INTO kb_chunks (doc_id, title, chunk_text, term_count) VALUES %s RETURNING id",
+        [(doc_id, title, text, sum(terms.values())) for text, terms in analyzed],
+        fetch=True
+    )
+    postings = [
+        (term, chunk_id[0], tf)
+        for chunk_id, (_, terms) in zip(chunk_ids, analyzed)
+        for term, tf in terms.items()
+    ]
+    if postings:
+        execute_values(cur, "INSERT INTO kb_postings (term, chunk_id, tf) VALUES %s", postings)
+    return len(analyzed), sum(sum(terms.values()) for _, terms in analyzed)
+
+def _bump_index_state(cur: Any, chunk_delta: int, length_delta: int) -> None:
+    cur.execute(
+        """
+        UPDATE kb_index_state
+        SET version = version + 1, chunk_count = chunk_count + %s,
+            total_length = total_length + %s, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+        """,
+        (chunk_delta, length_delta)
+    )
+
+def _is_indexed(cur: Any) -> bool:
+    # FOR UPDATE упорядочивает конкурентные записи до первой полной переиндексации
+    cur.execute("SELECT indexed FROM kb_index_state WHERE id = 1 FOR UPDATE")
+    row = cur.fetchone()
+    return bool(row and row[0])
+
+def index_document(cur: Any, doc_id: Any, title: str, content: str) -> None:
+    # Переиндексируем только изменённый документ; вызывается в транзакции записи.
+    # Пока индекс не построен по всей базе, строим его целиком
+    if not _is_indexed(cur):
+        reindex_all(cur)
+        return
+    removed_chunks, removed_length = unindex_document(cur, doc_id)
+    added_chunks, added_length = _insert_document(cur, doc_id, title, content)
+    _bump_index_state(cur, added_chunks - removed_chunks, added_length - removed_length)
+
+def remove_document(cur: Any, doc_id: Any) -> None:
+    if not _is_indexed(cur):
+        reindex_all(cur)
+        return
+    removed_chunks, removed_length = unindex_document(cur, doc_id)
+    _bump_index_state(cur, -removed_chunks, -removed_length)
+
+def reindex_all(cur: Any) -> int:
+    cur.execute("DELETE FROM kb_chunks")
+    cur.execute("SELECT id, file_name, content FROM knowledge_base")
+    chunk_count = total_length = 0
+    for doc_id, title, content in cur.fetchall():
+        chunks, length = _insert_document(cur, doc_id, title, content)
+        chunk_count += chunks
+        total_length += length
+    cur.execute(
+        """
+        UPDATE kb_index_state
+        SET version = version + 1, chunk_count = %s, total_length = %s,
+            indexed = TRUE, updated_at = CURRENT_TIMESTAMP
+        WHERE id = 1
+        """,
+        (chunk_count, total_length)
+    )
+    return chunk_count
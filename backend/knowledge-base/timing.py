@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Any, Callable, Iterator, List, Optional
+
+TIMING_LOG = os.environ.get('TIMING_LOG', '1') not in ('0', 'false')
+
+class RequestTimer:
+    '''
+    Per-request phase durations (db_connect, query, oauth, upstream,
+    serialize, ...). Thread-safe: spans from worker pools and the
+    provider event loop land in the timer of the request that started them.
+    '''
+    
+    def __init__(self, function: str) -> None:
+        self.function = function
+        self.started = time.perf_counter()
+        self.spans: Dict[str, List[float]] = {}
+        self.lock = threading.Lock()
+    
+    def add(self, name: str, duration_ms: float) -> None:
+        with self.lock:
+            self.spans.setdefault(name, []).append(duration_ms)
+    
+    def elapsed_ms(self) -> float:
+        return (time.perf_counter() - self.started) * 1000
+    
+    def phases(self) -> Dict[str, float]:
+        with self.lock:
+            return {name: round(sum(durations), 1) for name, durations in self.spans.items()}
+    
+    def counts(self) -> Dict[str, int]:
+        with self.lock:
+            return {name: len(durations) for name, durations in self.spans.items()}
+    
+    def server_timing(self, total_ms: float) -> str:
+        entries = [f'{name};dur={duration}' for name, duration in self.phases().items()]
+        return ', '.join(entries + [f'total;dur={round(total_ms, 1)}'])
+
+_timer: ContextVar[Optional[RequestTimer]] = ContextVar('request_timer', default=None)
+_active: ContextVar[Optional[str]] = ContextVar('active_span', default=None)
+
+def current_timer() -> Optional[RequestTimer]:
+    return _timer.get()
+
+@contextmanager
+def span(name: str) -> Iterator[None]:
+    # Учитывается только внешняя фаза: HTTP-запрос за OAuth-токеном
+    # попадает в oauth и не попадает ещё раз в upstream
+    timer = _timer.get()
+    if timer is None or _active.get() is not None:
+        yield
+        return
+    token = _active.set(name)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, (time.perf_counter() - started) * 1000)
+        _active.reset(token)
+
+def record(name: str, started: float, timer: Optional[RequestTimer] = None) -> None:
+    timer = timer or _timer.get()
+    if timer is not None:
+        timer.add(name, (time.perf_counter() - started) * 1000)
+
+def dumps(data: Any) -> str:
+    with span('serialize'):
+        return json.dumps(data)
+
+def log_timing(timer: RequestTimer, event: Dict[str, Any], context: Any,
+               status: int, total_ms: float) -> None:
+    params = event.get('queryStringParameters') or {}
+    line = {
+        'type': 'timing',
+        'function': timer.function,
+        'request_id': getattr(context, 'request_id', None),
+        'method': event.get('httpMethod'),
+        'action': params.get('action'),
+        'status': status,
+        'total_ms': round(total_ms, 1),
+        'phases': timer.phases(),
+        'counts': timer.counts()
+    }
+    # Одна JSON-строка на запрос: логи платформы агрегируются в p50/p95 оффлайн
+    print(json.dumps(line), flush=True)
+
+def timed(function: str) -> Callable[[Callable[..., Dict[str, Any]]], Callable[..., Dict[str, Any]]]:
+    '''
+    Handler decorator: collects the request's phase durations, returns them
+    in the Server-Timing header and writes one JSON log line per request.
+    '''
+    def decorate(handler: Callable[..., Dict[str, Any]]) -> Callable[..., Dict[str, Any]]:
+        @wraps(handler)
+        def wrapper(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+            timer = RequestTimer(function)
+            token = _timer.set(timer)
+            status = 500
+            try:
+                response = handler(event, context)
+                status = response.get('statusCode', 200)
+                total_ms = timer.elapsed_ms()
+                response.setdefault('headers', {}).update({
+                    'Server-Timing': timer.server_timing(total_ms),
+                    'Timing-Allow-Origin': '*'
+                })
+                return response
+            finally:
+                _timer.reset(token)
+                if TIMING_LOG:
+                    log_timing(timer, event, context, status, timer.elapsed_ms())
+        return wrapper
+    return decorate
@@ -0,0 +1,182 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from llm_context import get_llm_contexts, last_user_text
+from llm_providers import PROVIDERS, Provider
+from prompt_budget import assemble_prompt
+from provider_client import run
+from timing import dumps, timed
+
+FANOUT_MODES = ('race', 'compare')
+FANOUT_DEFAULT_PROVIDERS = ['yandex-gpt', 'gigachat']
+FANOUT_TIMEOUT = float(os.environ.get('FANOUT_TIMEOUT', '60'))
+
+def _elapsed_ms(started: float) -> int:
+    return round((time.monotonic() - started) * 1000)
+
+async def complete(provider: Provider, api_key: str, request_payload: Dict[str, Any],
+                   token_budget: Dict[str, int]) -> Dict[str, Any]:
+    started = time.monotonic()
+    try:
+        response_data = await asyncio.wait_for(provider.acomplete(request_payload, api_key), FANOUT_TIMEOUT)
+    except asyncio.TimeoutError:
+        return {'provider': provider.name, 'ok': False, 'error': 'timeout', 'latency_ms': _elapsed_ms(started)}
+    except Exception as e:
+        return {
+            'provider': provider.name,
+            'ok': False,
+            'error': str(e),
+            'status': getattr(e, 'status_code', None),
+            'latency_ms': _elapsed_ms(started)
+        }
+    return {
+        'provider': provider.name,
+        'ok': True,
+        'text': provider.text(response_data),
+        'latency_ms': _elapsed_ms(started),
+        'token_budget': token_budget,
+        'response': response_data
+    }
+
+async def race(jobs: List[Any]) -> Tuple[Optional[Dict[str, Any]], List[Dict[str, Any]]]:
+    # Первый успешный ответ выигрывает, остальные запросы отменяются
+    # вместе с их HTTP-соединениями
+    tasks = [asyncio.ensure_future(job) for job in jobs]
+    finished = []
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            result = await next_done
+            finished.append(result)
+            if result['ok']:
+                return result, finished
+        return None, finished
+    finally:
+        for task in tasks:
+            task.cancel()
+
+async def compare(jobs: List[Any]) -> List[Dict[str, Any]]:
+    return list(await asyncio.gather(*jobs))
+
+@timed('llm-fanout')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Send one conversation to several LLM providers at once
+    Args: event with httpMethod (POST, OPTIONS), body with messages array, optional mode (race/compare) and providers
+    Returns: First successful answer (race) or every answer with per-provider latency (compare)
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'isBase64Encoded': False,
+            'body': ''
+        }
+    
+    if method != 'POST':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+    
+    try:
+        body_data = json.loads(event.get('body') or '{}')
+    except ValueError:
+        body_data = None
+    if not isinstance(body_data, dict):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Invalid JSON body'})
+        }
+    
+    user_messages = body_data.get('messages', [])
+    mode = body_data.get('mode', 'race')
+    names = body_data.get('providers') or FANOUT_DEFAULT_PROVIDERS
+    
+    # Строка вместо списка иначе перебиралась бы по символам
+    if (mode not in FANOUT_MODES or not isinstance(names, list)
+            or not all(isinstance(name, str) and name in PROVIDERS for name in names)):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Unsupported mode or provider'})
+        }
+    
+    names = list(dict.fromkeys(names))
+    skipped = [
+        {'provider': name, 'ok': False, 'error': 'API key not configured', 'latency_ms': 0}
+        for name in names if not PROVIDERS[name].api_key()
+    ]
+    names = [name for name in names if PROVIDERS[name].api_key()]
+    
+    if not names:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'API key not configured', 'results': skipped})
+        }
+    
+    try:
+        # Контекст (промпты и база знаний) читается один раз на все модели
+        started = time.monotonic()
+        contexts = get_llm_contexts(os.environ.get('DATABASE_URL'), names, last_user_text(user_messages))
+        
+        jobs = []
+        for name in names:
+            provider = PROVIDERS[name]
+            system_prompt, history, token_budget = assemble_prompt(name, contexts[name], user_messages)
+            request_payload = provider.payload(system_prompt, history, token_budget['max_tokens'])
+            jobs.append(complete(provider, provider.api_key(), request_payload, token_budget))
+        
+        if mode == 'race':
+            winner, finished = run(race(jobs))
+            done = {result['provider'] for result in finished}
+            response_data = {
+                'mode': mode,
+                'winner': (winner or {}).get('provider'),
+                'text': (winner or {}).get('text'),
+                'latency_ms': (winner or {}).get('latency_ms'),
+                'token_budget': (winner or {}).get('token_budget'),
+                'response': (winner or {}).get('response'),
+                'attempts': [
+                    {key: value for key, value in result.items() if key not in ('text', 'response', 'token_budget')}
+                    for result in skipped + finished
+                ],
+                'cancelled': [name for name in names if name not in done],
+                'total_ms': _elapsed_ms(started)
+            }
+            status = 200 if winner else 502
+        else:
+            results = skipped + run(compare(jobs))
+            response_data = {'mode': mode, 'results': results, 'total_ms': _elapsed_ms(started)}
+            status = 200 if any(result['ok'] for result in results) else 502
+        
+        return {
+            'statusCode': status,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': dumps(response_data)
+        }
+    except Exception as e:
+        # Сбой чтения контекста из БД или пула соединений — JSON-ответ с CORS, а не голый 500 платформы
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
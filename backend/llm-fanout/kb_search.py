@@ -0,0 +1,251 @@
+import math
+import os
+import re
+from collections import Counter
+from typing import Dict, Any, List, Optional, Tuple
+
+KB_CHUNK_TOKENS = int(os.environ.get('KB_CHUNK_TOKENS', '200'))
+KB_CONTEXT_TOKENS = int(os.environ.get('KB_CONTEXT_TOKENS', '1500'))
+KB_TOP_K = int(os.environ.get('KB_TOP_K', '5'))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+WORD_RE = re.compile(r'[а-яёa-z0-9]+')
+# Длина kb_postings.term; длинные «слова» (base64, хеши, URL) в индекс не попадают
+TERM_MAX_LENGTH = 100
+SENTENCE_RE = re.compile(r'(?<=[.!?…])\s+')
+TOKEN_PIECE_RE = re.compile(r'\w+|[^\w\s]')
+
+STOP_WORDS = frozenset(
+    'и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне '
+    'было вот от меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него '
+    'до вас нибудь опять уж вам ведь там потом себя ничего ей может они тут где есть надо ней для мы '
+    'тебя их чем была сам чтоб без будто чего раз тоже себе под будет ж тогда кто этот того потому '
+    'этого какой совсем ним здесь этом один почти мой тем чтобы нее были куда зачем всех никогда '
+    'можно при наконец два об другой хоть после над больше тот через эти нас про всего них какая '
+    'много разве три эту моя впрочем хорошо свою этой перед иногда лучше чуть том нельзя такой им '
+    'более всегда конечно всю между это'.split()
+)
+
+# Snowball-стеммер для русского языка (алгоритм Портера)
+RU_VOWELS = 'аеиоуыэюя'
+PERFECTIVE_GERUND_1 = ('вшись', 'вши', 'в')
+PERFECTIVE_GERUND_2 = ('ившись', 'ывшись', 'ивши', 'ывши', 'ив', 'ыв')
+REFLEXIVE = ('ся', 'сь')
+ADJECTIVE = (
+    'ими', 'ыми', 'его', 'ого', 'ему', 'ому', 'ее', 'ие', 'ые', 'ое', 'ей', 'ий', 'ый', 'ой',
+    'ем', 'им', 'ым', 'ом', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею'
+)
+PARTICIPLE_1 = ('ем', 'нн', 'вш', 'ющ', 'щ')
+PARTICIPLE_2 = ('ивш', 'ывш', 'ующ')
+VERB_1 = ('ете', 'йте', 'ешь', 'нно', 'ла', 'на', 'ли', 'ем', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'й', 'л', 'н')
+VERB_2 = (
+    'ейте', 'уйте', 'ила', 'ыла', 'ена', 'ите', 'или', 'ыли', 'ило', 'ыло', 'ено', 'ует', 'уют',
+    'ены', 'ить', 'ыть', 'ишь', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен', 'ят', 'ит', 'ыт', 'ую', 'ю'
+)
+NOUN = (
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ев', 'ов', 'ие', 'ье', 'еи', 'ии', 'ей',
+    'ой', 'ий', 'ям', 'ем', 'ам', 'ом', 'ах', 'ях', 'ию', 'ью', 'ия', 'ья', 'а', 'е', 'и', 'й',
+    'о', 'у', 'ы', 'ь', 'ю', 'я'
+)
+SUPERLATIVE = ('ейше', 'ейш')
+DERIVATIONAL = ('ость', 'ост')
+
+def _regions(word: str) -> Tuple[int, int]:
+    rv = len(word)
+    for i, ch in enumerate(word):
+        if ch in RU_VOWELS:
+            rv = i + 1
+            break
+    r1 = len(word)
+    for i in range(1, len(word)):
+        if word[i] not in RU_VOWELS and word[i - 1] in RU_VOWELS:
+            r1 = i + 1
+            break
+    r2 = len(word)
+    for i in range(r1 + 1, len(word)):
+        if word[i] not in RU_VOWELS and word[i - 1] in RU_VOWELS:
+            r2 = i + 1
+            break
+    return rv, r2
+
+def _strip(word: str, start: int, endings: Tuple[str, ...], after_a: bool = False) -> Optional[str]:
+    # Ищем самое длинное окончание внутри региона; для групп 1 ему должна предшествовать «а» или «я»
+    for ending in sorted(endings, key=len, reverse=True):
+        if word.endswith(ending) and len(word) - len(ending) >= start:
+            stem = word[:-len(ending)]
+            if after_a:
+                if len(stem) - 1 < start or stem[-1] not in 'ая':
+                    continue
+            return stem
+    return None
+
+def _strip_grouped(word: str, start: int, group_1: Tuple[str, ...], group_2: Tuple[str, ...]) -> Optional[str]:
+    candidates = []
+    stem = _strip(word, start, group_1, after_a=True)
+    if stem is not None:
+        candidates.append(stem)
+    stem = _strip(word, start, group_2)
+    if stem is not None:
+        candidates.append(stem)
+    return min(candidates, key=len) if candidates else None
+
+def stem_russian(word: str) -> str:
+    word = word.replace('ё', 'е')
+    rv, r2 = _regions(word)
+    
+    stem = _strip_grouped(word, rv, PERFECTIVE_GERUND_1, PERFECTIVE_GERUND_2)
+    if stem is not None:
+        word = stem
+    else:
+        word = _strip(word, rv, REFLEXIVE) or word
+        stem = _strip(word, rv, ADJECTIVE)
+        if stem is not None:
+            word = _strip_grouped(stem, rv, PARTICIPLE_1, PARTICIPLE_2) or stem
+        else:
+            stem = _strip_grouped(word, rv, VERB_1, VERB_2)
+            if stem is None:
+                stem = _strip(word, rv, NOUN)
+            if stem is not None:
+                word = stem
+    
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+    
+    word = _strip(word, r2, DERIVATIONAL) or word
+    
+    if word.endswith('нн') and len(word) - 1 >= rv:
+        word = word[:-1]
+    else:
+        stem = _strip(word, rv, SUPERLATIVE)
+        if stem is not None:
+            word = stem[:-1] if stem.endswith('нн') else stem
+        elif word.endswith('ь') and len(word) - 1 >= rv:
+            word = word[:-1]
+    return word
+
+def tokenize(text: str, stop_words: frozenset = STOP_WORDS) -> List[str]:
+    terms = []
+    for word in WORD_RE.findall(text.lower()):
+        if word in stop_words or len(word) > TERM_MAX_LENGTH:
+            continue
+        if 'а' <= word[0] <= 'я' or word[0] == 'ё':
+            word = stem_russian(word)
+        if word:
+            terms.append(word)
+    return terms
+
+def estimate_tokens(text: str) -> int:
+    # Приближение BPE-токенизаторов YandexGPT/GigaChat: кириллическое слово
+    # даёт примерно токен на 3 буквы, латиница — на 4, знак препинания — токен
+    tokens = 0
+    for piece in TOKEN_PIECE_RE.findall(text):
+        if piece[0].isalnum():
+            per_token = 3 if 'а' <= piece[0].lower() <= 'я' or piece[0] in 'ёЁ' else 4
+            tokens += -(-len(piece) // per_token)
+        else:
+            tokens += 1
+    return max(1, tokens)
+
+def chunk_document(content: str, max_tokens: int = KB_CHUNK_TOKENS) -> List[str]:
+    pieces: List[str] = []
+    for paragraph in re.split(r'\n\s*\n', content or ''):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(s.strip() for s in SENTENCE_RE.split(paragraph) if s.strip())
+    
+    chunks: List[str] = []
+    current: List[str] = []
+    current_tokens = 0
+    for piece in pieces:
+        piece_tokens = estimate_tokens(piece)
+        if current and current_tokens + piece_tokens > max_tokens:
+            chunks.append('\n\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+def analyze_document(title: str, content: str) -> List[Tuple[str, Counter]]:
+    return [(text, Counter(tokenize(f'{title}\n{text}'))) for text in chunk_document(content)]
+
+class KnowledgeIndex:
+    '''
+    In-memory inverted index over knowledge_base chunks with BM25 ranking.
+    '''
+    
+    def __init__(self) -> None:
+        self.chunks: Dict[int, Dict[str, Any]] = {}
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.total_length = 0
+        self.next_chunk_id = 0
+    
+    def add_chunk(self, chunk_id: int, doc_id: Any, title: str, text: str, length: int) -> None:
+        self.chunks[chunk_id] = {'doc_id': doc_id, 'title': title, 'text': text, 'length': length}
+        self.total_length += length
+        self.next_chunk_id = max(self.next_chunk_id, chunk_id + 1)
+    
+    def add_posting(self, term: str, chunk_id: int, tf: int) -> None:
+        self.postings.setdefault(term, {})[chunk_id] = tf
+    
+    def add_document(self, doc_id: Any, title: str, content: str) -> None:
+        for text, terms in analyze_document(title, content):
+            chunk_id = self.next_chunk_id
+            self.add_chunk(chunk_id, doc_id, title, text, sum(terms.values()))
+            for term, tf in terms.items():
+                self.add_posting(term, chunk_id, tf)
+    
+    def search(self, query: str, top_k: int = KB_TOP_K) -> List[Tuple[float, Dict[str, Any]]]:
+        if not self.chunks:
+            return []
+        
+        n = len(self.chunks)
+        avg_length = self.total_length / n or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for chunk_id, tf in postings.items():
+                length = self.chunks[chunk_id]['length']
+                norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / norm
+        
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(score, self.chunks[chunk_id]) for chunk_id, score in ranked]
+    
+    def select_context(self, query: str, token_budget: int = KB_CONTEXT_TOKENS,
+                       top_k: int = KB_TOP_K) -> List[Dict[str, Any]]:
+        selected = []
+        used = 0
+        for _, chunk in self.search(query, top_k):
+            tokens = estimate_tokens(chunk['text'])
+            if used + tokens > token_budget:
+                continue
+            selected.append(chunk)
+            used += tokens
+        return selected
+
+def build_index(documents: List[Tuple[Any, str, str]]) -> KnowledgeIndex:
+    index = KnowledgeIndex()
+    for doc_id, title, content in documents:
+        index.add_document(doc_id, title, content)
+    return index
+
+def load_index(chunk_rows: List[Tuple[int, Any, str, str, int]],
+               posting_rows: List[Tuple[str, int, int]]) -> KnowledgeIndex:
+    index = KnowledgeIndex()
+    for chunk_id, doc_id, title, text, length in chunk_rows:
+        index.add_chunk(chunk_id, doc_id, title, text, length)
+    for term, chunk_id, tf in posting_rows:
+        if chunk_id in index.chunks:
+            index.add_posting(term, chunk_id, tf)
+    return index
@@ -0,0 +1,134 @@
+import asyncio
+import os
+import queue
+import threading
+import time
+from typing import Dict, Any, Iterator, Optional
+
+import httpx
+
+from timing import current_timer, record, span
+
+PROVIDER_CONNECT_TIMEOUT = float(os.environ.get('PROVIDER_CONNECT_TIMEOUT', '5'))
+PROVIDER_READ_TIMEOUT = float(os.environ.get('PROVIDER_READ_TIMEOUT', '60'))
+PROVIDER_MAX_CONNECTIONS = int(os.environ.get('PROVIDER_MAX_CONNECTIONS', '20'))
+PROVIDER_KEEPALIVE_EXPIRY = float(os.environ.get('PROVIDER_KEEPALIVE_EXPIRY', '90'))
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+_clients: Dict[bool, httpx.AsyncClient] = {}
+_STREAM_END = object()
+
+class ProviderError(Exception):
+    def __init__(self, status_code: int, body: str):
+        super().__init__(f'HTTP {status_code}: {body}')
+        self.status_code = status_code
+        self.body = body
+
+def transport_error(error: httpx.TransportError) -> ProviderError:
+    # Сетевой сбой до ответа провайдера отдаём как шлюзовую ошибку, а не 500
+    status_code = 504 if isinstance(error, httpx.TimeoutException) else 502
+    return ProviderError(status_code, f'{type(error).__name__}: {error}'.rstrip(': '))
+
+def default_timeout(read: Optional[float] = None) -> httpx.Timeout:
+    return httpx.Timeout(
+        connect=PROVIDER_CONNECT_TIMEOUT,
+        read=read or PROVIDER_READ_TIMEOUT,
+        write=PROVIDER_READ_TIMEOUT,
+        pool=PROVIDER_CONNECT_TIMEOUT
+    )
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    # Отдельный поток с вечным event loop: клиенты и их keep-alive соединения
+    # привязаны к нему и переживают тёплые вызовы функции
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='provider-client', daemon=True).start()
+                _loop = loop
+    return _loop
+
+def get_client(verify: bool = True) -> httpx.AsyncClient:
+    client = _clients.get(verify)
+    if client is None:
+        client = httpx.AsyncClient(
+            verify=verify,
+            timeout=default_timeout(),
+            limits=httpx.Limits(
+                max_connections=PROVIDER_MAX_CONNECTIONS,
+                max_keepalive_connections=PROVIDER_MAX_CONNECTIONS,
+                keepalive_expiry=PROVIDER_KEEPALIVE_EXPIRY
+            )
+        )
+        _clients[verify] = client
+    return client
+
+async def arequest(method: str, url: str, verify: bool = True,
+                   timeout: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+    client = get_client(verify)
+    if timeout is not None:
+        kwargs['timeout'] = default_timeout(timeout)
+    with span('upstream'):
+        try:
+            return await client.request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            raise transport_error(e) from e
+
+def run(coro: Any) -> Any:
+    return asyncio.run_coroutine_threadsafe(coro, get_loop()).result()
+
+def request(method: str, url: str, **kwargs: Any) -> httpx.Response:
+    return run(arequest(method, url, **kwargs))
+
+def stream_lines(method: str, url: str, verify: bool = True,
+                 timeout: Optional[float] = None, **kwargs: Any) -> Iterator[str]:
+    '''
+    Issue a streaming request on the shared loop and hand non-empty response
+    lines to the synchronous caller as they arrive. Waits for the first line,
+    so a non-2xx status raises ProviderError here rather than mid-iteration.
+    '''
+    lines: 'queue.Queue[Any]' = queue.Queue()
+    started = time.perf_counter()
+    timer = current_timer()
+    if timeout is not None:
+        kwargs['timeout'] = default_timeout(timeout)
+    
+    async def pump() -> None:
+        try:
+            async with get_client(verify).stream(method, url, **kwargs) as response:
+                if response.status_code >= 400:
+                    body = (await response.aread()).decode('utf-8', 'replace')
+                    lines.put(ProviderError(response.status_code, body))
+                    return
+                async for line in response.aiter_lines():
+                    if line.strip():
+                        lines.put(line.strip())
+        except httpx.TransportError as e:
+            lines.put(transport_error(e))
+        except Exception as e:
+            lines.put(e)
+        finally:
+            lines.put(_STREAM_END)
+    
+    future = asyncio.run_coroutine_threadsafe(pump(), get_loop())
+    first = lines.get()
+    if isinstance(first, Exception):
+        record('upstream', started, timer)
+        raise first
+    
+    def drain() -> Iterator[str]:
+        item = first
+        try:
+            while item is not _STREAM_END:
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+                item = lines.get()
+        finally:
+            future.cancel()
+            # Время ответа считаем до конца потока, а не до первой строки
+            record('upstream', started, timer)
+    
+    return drain()
@@ -1,8 +1,11 @@
 import json
 import os
-import psycopg2
 from typing import Dict, Any
 
+from db import get_connection, release_connection
+from timing import dumps, timed
+
+@timed('prompts')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: API for managing AI system prompts
@@ -31,7 +34,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Database not configured'})
         }
     
-    conn = psycopg2.connect(dsn)
+    conn = get_connection(dsn)
     cur = conn.cursor()
     
     try:
@@ -77,7 +80,7 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'statusCode': 200,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
                 'isBase64Encoded': False,
-                'body': json.dumps(result)
+                'body': dumps(result)
             }
         
         elif method == 'POST':
@@ -129,4 +132,4 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     finally:
         cur.close()
-        conn.close()
+        release_connection(dsn, conn)
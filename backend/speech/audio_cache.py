@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+import psycopg2
+
+from db import get_connection, release_connection
+
+TTS_LOCAL_CACHE_BYTES = int(os.environ.get('TTS_LOCAL_CACHE_BYTES', str(20 * 1024 * 1024)))
+TTS_CACHE_MAX_BYTES = int(os.environ.get('TTS_CACHE_MAX_BYTES', str(500 * 1024 * 1024)))
+TTS_CACHE_EVICT_INTERVAL = float(os.environ.get('TTS_CACHE_EVICT_INTERVAL', '300'))
+
+_cache_stats: Dict[str, int] = {'local_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0}
+# Счётчики увеличиваются из потоков пула синтеза
+_cache_stats_lock = threading.Lock()
+_last_eviction = 0.0
+
+def _count(event: str) -> None:
+    with _cache_stats_lock:
+        _cache_stats[event] += 1
+
+def audio_cache_key(provider: str, voice: str, audio_format: str, text: str) -> str:
+    # Пробелы схлопываем: синтез «Добрый  день» и «Добрый день» звучит одинаково
+    payload = json.dumps([provider, voice, audio_format, ' '.join(text.split())], ensure_ascii=False)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+class LocalAudioCache:
+    '''
+    In-process LRU of synthesized audio bounded by total size in bytes.
+    Lives as long as the warm function instance.
+    '''
+    
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.entries: 'OrderedDict[str, bytes]' = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[bytes]:
+        with self.lock:
+            audio = self.entries.get(key)
+            if audio is not None:
+                self.entries.move_to_end(key)
+            return audio
+    
+    def put(self, key: str, audio: bytes) -> None:
+        if len(audio) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = audio
+            self.size += len(audio)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+_local_cache = LocalAudioCache(TTS_LOCAL_CACHE_BYTES)
+
+def _load_audio(conn: Any, key: str) -> Optional[bytes]:
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            UPDATE tts_audio_cache SET hit_count = hit_count + 1, last_hit_at = CURRENT_TIMESTAMP
+            WHERE cache_key = %s
+            RETURNING audio
+            """,
+            (key,)
+        )
+        row = cur.fetchone()
+        conn.commit()
+        return bytes(row[0]) if row else None
+    finally:
+        cur.close()
+
+def _eviction_due() -> bool:
+    # Оконная сумма по всей таблице дорогая: инстанс запускает вытеснение
+    # при первой записи и дальше не чаще раза в TTS_CACHE_EVICT_INTERVAL
+    global _last_eviction
+    now = time.monotonic()
+    if _last_eviction and now - _last_eviction < TTS_CACHE_EVICT_INTERVAL:
+        return False
+    _last_eviction = now
+    return True
+
+def _store_audio(conn: Any, key: str, provider: str, voice: str, audio_format: str, audio: bytes) -> None:
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT INTO tts_audio_cache (cache_key, provider, voice, audio_format, audio, size_bytes)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (cache_key) DO UPDATE SET last_hit_at = CURRENT_TIMESTAMP
+            """,
+            (key, provider, voice, audio_format, psycopg2.Binary(audio), len(audio))
+        )
+        # LRU по суммарному размеру: удаляем давно не востребованное сверх лимита
+        if _eviction_due():
+            cur.execute(
+                """
+                DELETE FROM tts_audio_cache WHERE cache_key IN (
+                    SELECT cache_key FROM (
+                        SELECT cache_key, sum(size_bytes) OVER (ORDER BY last_hit_at DESC, cache_key) AS running
+                        FROM tts_audio_cache
+                    ) ranked
+                    WHERE running > %s
+                )
+                """,
+                (TTS_CACHE_MAX_BYTES,)
+            )
+        conn.commit()
+    finally:
+        cur.close()
+
+def get_cached_audio(dsn: Optional[str], key: str) -> Optional[bytes]:
+    audio = _local_cache.get(key)
+    if audio is not None:
+        _count('local_hits')
+        return audio
+    
+    if dsn:
+        # Ошибка БД не должна ломать синтез: считаем её промахом
+        conn = None
+        try:
+            conn = get_connection(dsn)
+            audio = _load_audio(conn, key)
+        except psycopg2.Error:
+            audio = None
+        finally:
+            if conn is not None:
+                release_connection(dsn, conn)
+        if audio is not None:
+            _count('db_hits')
+            _local_cache.put(key, audio)
+            return audio
+    
+    _count('misses')
+    return None
+
+def put_cached_audio(dsn: Optional[str], key: str, provider: str, voice: str,
+                     audio_format: str, audio: bytes) -> None:
+    _local_cache.put(key, audio)
+    _count('stores')
+    if not dsn:
+        return
+    
+    conn = None
+    try:
+        conn = get_connection(dsn)
+        _store_audio(conn, key, provider, voice, audio_format, audio)
+    except psycopg2.Error:
+        pass
+    finally:
+        if conn is not None:
+            release_connection(dsn, conn)
+
+def get_audio_cache_stats() -> Dict[str, Any]:
+    with _cache_stats_lock:
+        stats = dict(_cache_stats)
+    with _local_cache.lock:
+        entries, size = len(_local_cache.entries), _local_cache.size
+    return {**stats, 'local_entries': entries, 'local_bytes': size}
@@ -1,32 +1,390 @@
 import json
 import os
 import base64
-import requests
-from typing import Dict, Any
+import contextvars
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, as_completed, wait
+from typing import Dict, Any, Callable, Iterator, List, Optional, Tuple
 
-def get_sber_oauth_token(client_id: str, client_secret: str) -> str:
+import httpx
+
+from audio_cache import audio_cache_key, get_audio_cache_stats, get_cached_audio, put_cached_audio
+from provider_client import ProviderError, request
+from provider_health import get_health_snapshot, guarded, should_fail_over
+from ogg_opus import concat_ogg_opus, is_ogg, ogg_duration, split_ogg_opus
+from streaming import STREAM_FORMATS, encode_event
+from tts_chunks import split_tts_text
+from timing import dumps, span, timed
+from usage_log import get_usage_stats, log_usage
+
+SBER_OAUTH_URL = os.environ.get('SBER_OAUTH_URL', 'https://ngw.devices.sberbank.ru:9443/api/v2/oauth')
+SBER_SPEECH_URL = os.environ.get('SBER_SPEECH_URL', 'https://smartspeech.sber.ru/rest/v1')
+YANDEX_STT_URL = os.environ.get('YANDEX_STT_URL', 'https://stt.api.cloud.yandex.net/speech/v1/stt:recognize')
+YANDEX_TTS_URL = os.environ.get('YANDEX_TTS_URL', 'https://tts.api.cloud.yandex.net/speech/v1/tts:synthesize')
+
+YANDEX_FOLDER_ID = 'b1gfkd2baaso5298c7lt'
+YANDEX_TTS_VOICE = 'alena'
+YANDEX_TTS_FORMAT = 'oggopus'
+SBER_TTS_VOICE = 'Nec_24000'
+SBER_TTS_FORMAT = 'opus'
+TTS_VOICES = {'yandex': (YANDEX_TTS_VOICE, YANDEX_TTS_FORMAT), 'sber': (SBER_TTS_VOICE, SBER_TTS_FORMAT)}
+
+BINARY_AUDIO_TYPES = ('audio/', 'application/octet-stream')
+
+SBER_SCOPE = 'SALUTE_SPEECH_PERS'
+TOKEN_REFRESH_MARGIN = 60
+TOKEN_DEFAULT_TTL = 1800
+
+TTS_MAX_WORKERS = int(os.environ.get('TTS_MAX_WORKERS', '4'))
+STT_MAX_WORKERS = int(os.environ.get('STT_MAX_WORKERS', '4'))
+STT_MAX_INFLIGHT = STT_MAX_WORKERS * 2
+# Синхронное распознавание Yandex принимает до 30 секунд и 1 МБ
+STT_SEGMENT_SECONDS = float(os.environ.get('STT_SEGMENT_SECONDS', '25'))
+STT_SEGMENT_BYTES = int(os.environ.get('STT_SEGMENT_BYTES', str(900 * 1024)))
+
+_token_lock = threading.Lock()
+_token_store: Dict[Tuple[str, str], Tuple[str, float]] = {}
+_token_stats: Dict[str, int] = {'hits': 0, 'misses': 0, 'refreshes': 0, 'invalidations': 0}
+# Счётчики под своим замком: _token_lock держится на время запроса токена
+_token_stats_lock = threading.Lock()
+
+_tts_pool = ThreadPoolExecutor(max_workers=TTS_MAX_WORKERS, thread_name_prefix='tts')
+_stt_pool = ThreadPoolExecutor(max_workers=STT_MAX_WORKERS, thread_name_prefix='stt')
+_inflight_lock = threading.Lock()
+# Синтезируемые фрагменты: future и число запросов, которые его ждут
+_inflight: Dict[str, List[Any]] = {}
+
+# Вызов провайдера: (аудио или текст, таймаут) -> текст или аудио
+SpeechCall = Callable[[Any, Optional[float]], Any]
+
+def fetch_sber_oauth_token(client_id: str, client_secret: str, scope: str) -> Tuple[str, float]:
     auth_string = f"{client_id}:{client_secret}"
     auth_base64 = base64.b64encode(auth_string.encode('utf-8')).decode('utf-8')
     
-    response = requests.post(
-        'https://ngw.devices.sberbank.ru:9443/api/v2/oauth',
-        headers={
-            'Authorization': f'Basic {auth_base64}',
-            'Content-Type': 'application/x-www-form-urlencoded',
-            'RqUID': 'salute-speech-request'
-        },
-        data={'scope': 'SALUTE_SPEECH_PERS'},
-        verify=False
-    )
+    with span('oauth'):
+        response = request(
+            'POST',
+            SBER_OAUTH_URL,
+            headers={
+                'Authorization': f'Basic {auth_base64}',
+                'Content-Type': 'application/x-www-form-urlencoded',
+                'RqUID': str(uuid.uuid4())
+            },
+            data={'scope': scope},
+            verify=False
+        )
     
+    if response.status_code != 200:
+        raise ProviderError(response.status_code, response.text)
     data = response.json()
-    return data['access_token']
+    
+    # expires_at приходит в миллисекундах с начала эпохи
+    expires_at = data.get('expires_at')
+    if expires_at:
+        expires_at = expires_at / 1000 if expires_at > 10 ** 11 else float(expires_at)
+    else:
+        expires_at = time.time() + TOKEN_DEFAULT_TTL
+    return data['access_token'], expires_at
+
+def _cached_sber_token(key: Tuple[str, str]) -> Optional[str]:
+    entry = _token_store.get(key)
+    if not entry or entry[1] - TOKEN_REFRESH_MARGIN <= time.time():
+        return None
+    return entry[0]
+
+def _count_token(event: str) -> None:
+    with _token_stats_lock:
+        _token_stats[event] += 1
+
+def get_sber_oauth_token(client_id: str, client_secret: str, scope: str = SBER_SCOPE) -> str:
+    key = (client_id, scope)
+    token = _cached_sber_token(key)
+    if token:
+        _count_token('hits')
+        return token
+    
+    # Один поток обновляет токен, остальные ждут и берут результат из хранилища
+    with _token_lock:
+        token = _cached_sber_token(key)
+        if token:
+            _count_token('hits')
+            return token
+        
+        _count_token('misses')
+        token, expires_at = fetch_sber_oauth_token(client_id, client_secret, scope)
+        _token_store[key] = (token, expires_at)
+        _count_token('refreshes')
+        return token
+
+def invalidate_sber_oauth_token(client_id: str, token: str, scope: str = SBER_SCOPE) -> None:
+    with _token_lock:
+        entry = _token_store.get((client_id, scope))
+        if entry and entry[0] == token:
+            del _token_store[(client_id, scope)]
+            _count_token('invalidations')
+
+def get_token_stats() -> Dict[str, Any]:
+    with _token_stats_lock:
+        stats = dict(_token_stats)
+    return {**stats, 'cached_tokens': len(_token_store)}
+
+def sber_post(client_id: str, client_secret: str, oauth_token: str, url: str,
+              headers: Dict[str, str], **kwargs: Any) -> httpx.Response:
+    response = request(
+        'POST',
+        url,
+        headers={**headers, 'Authorization': f'Bearer {oauth_token}'},
+        verify=False,
+        **kwargs
+    )
+    
+    # Токен отозван или истёк раньше срока: сбрасываем и повторяем один раз
+    if response.status_code == 401:
+        invalidate_sber_oauth_token(client_id, oauth_token)
+        oauth_token = get_sber_oauth_token(client_id, client_secret)
+        response = request(
+            'POST',
+            url,
+            headers={**headers, 'Authorization': f'Bearer {oauth_token}'},
+            verify=False,
+            **kwargs
+        )
+    return response
+
+def read_audio_body(event: Dict[str, Any]) -> bytes:
+    body = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        return base64.b64decode(body)
+    return body.encode('latin-1') if isinstance(body, str) else body
+
+def tts_audio_response(audio: bytes, cache_status: str, meta: Dict[str, Any],
+                       binary: bool = False) -> Dict[str, Any]:
+    headers = {
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'X-Cache, X-TTS-Chunks, X-TTS-Next-Chunk-Offset, X-TTS-Provider',
+        'X-Cache': cache_status
+    }
+    if not binary:
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', **headers},
+            'isBase64Encoded': False,
+            'body': dumps({'audio': base64.b64encode(audio).decode('utf-8'), **meta})
+        }
+    
+    # Бинарный ответ: шлюз сам декодирует base64, клиент получает голый audio/ogg
+    headers['X-TTS-Chunks'] = str(meta['chunks'])
+    headers['X-TTS-Provider'] = meta['provider']
+    if meta['next_chunk_offset'] is not None:
+        headers['X-TTS-Next-Chunk-Offset'] = str(meta['next_chunk_offset'])
+    with span('serialize'):
+        body = base64.b64encode(audio).decode('ascii')
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'audio/ogg', **headers},
+        'isBase64Encoded': True,
+        'body': body
+    }
+
+def _synthesize_cached(dsn: Optional[str], cache_key: str, provider: str, voice: str, audio_format: str,
+                       synthesize: Callable[[str], bytes], text: str) -> Tuple[bytes, bool]:
+    audio = get_cached_audio(dsn, cache_key)
+    if audio is not None:
+        return audio, True
+    audio = synthesize(text)
+    put_cached_audio(dsn, cache_key, provider, voice, audio_format, audio)
+    return audio, False
 
+def _submit_chunk(dsn: Optional[str], provider: str, voice: str, audio_format: str,
+                  synthesize: Callable[[str], bytes], text: str) -> Tuple[str, 'Future[Tuple[bytes, bool]]']:
+    # Фрагмент, который уже синтезируется параллельным запросом, не отправляем
+    # повторно — ждём тот же future. Контекст копируем, чтобы замеры из пула
+    # попали в Server-Timing текущего запроса
+    cache_key = audio_cache_key(provider, voice, audio_format, text)
+    with _inflight_lock:
+        entry = _inflight.get(cache_key)
+        if entry is None:
+            future = _tts_pool.submit(
+                contextvars.copy_context().run,
+                _synthesize_cached, dsn, cache_key, provider, voice, audio_format, synthesize, text
+            )
+            entry = _inflight[cache_key] = [future, 0]
+            future.add_done_callback(lambda _: _inflight.pop(cache_key, None))
+        entry[1] += 1
+    return cache_key, entry[0]
+
+def _release_chunk(cache_key: str, future: 'Future[Tuple[bytes, bool]]') -> None:
+    # Фрагмент, который больше никто не ждёт, снимаем с пула, пока синтез не начался:
+    # после ответа инстанс может быть заморожен, и фоновая работа оборвётся
+    with _inflight_lock:
+        entry = _inflight.get(cache_key)
+        if entry is None or entry[0] is not future:
+            return
+        entry[1] -= 1
+        if entry[1] == 0:
+            future.cancel()
+
+def synthesize_text(provider: str, voice: str, audio_format: str, synthesize: Callable[[str], bytes],
+                    text: str, first_chunk: bool = False, chunk_offset: int = 0,
+                    binary: bool = False) -> Dict[str, Any]:
+    '''
+    Synthesize long text as sentence-aligned chunks on a bounded pool and
+    stitch the Ogg/Opus results in order. With first_chunk only the first
+    chunk is awaited: chunks already being synthesized finish into the audio
+    cache, queued ones are cancelled, and a follow-up request with
+    chunk_offset fetches the rest.
+    '''
+    dsn = os.environ.get('DATABASE_URL')
+    chunks = split_tts_text(text)
+    if not chunks:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'No text provided'})
+        }
+    if not 0 <= chunk_offset < len(chunks):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'chunk_offset out of range'})
+        }
+    
+    submitted = [
+        _submit_chunk(dsn, provider, voice, audio_format, synthesize, chunk)
+        for chunk in chunks[chunk_offset:]
+    ]
+    awaited = submitted[:1] if first_chunk else submitted
+    
+    try:
+        results = [future.result() for _, future in awaited]
+    except ProviderError as e:
+        return {
+            'statusCode': e.status_code,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': e.body})
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
+    finally:
+        for cache_key, future in submitted:
+            _release_chunk(cache_key, future)
+    
+    audio = concat_ogg_opus([chunk_audio for chunk_audio, _ in results])
+    cache_status = 'HIT' if all(hit for _, hit in results) else 'MISS'
+    next_offset = chunk_offset + len(results)
+    return tts_audio_response(audio, cache_status, {
+        'provider': provider,
+        'chunks': len(chunks),
+        'chunk_offset': chunk_offset,
+        'returned_chunks': len(results),
+        'complete': next_offset == len(chunks),
+        'next_chunk_offset': next_offset if next_offset < len(chunks) else None
+    }, binary)
+
+def wants_long_recognition(audio_bytes: bytes, long_audio: bool) -> bool:
+    # Резать по страницам можно только Ogg/Opus; остальное распознаём целиком
+    if not is_ogg(audio_bytes):
+        return False
+    if long_audio or len(audio_bytes) > STT_SEGMENT_BYTES:
+        return True
+    return (ogg_duration(audio_bytes) or 0) > STT_SEGMENT_SECONDS
+
+def iter_segment_results(recognize: Callable[[bytes], Tuple[str, str]],
+                         audio_bytes: bytes) -> Iterator[Dict[str, Any]]:
+    '''
+    Recognize Ogg/Opus segments concurrently and yield transcripts in
+    completion order. At most STT_MAX_INFLIGHT segments exist at once, so
+    memory stays bounded however long the recording is.
+    '''
+    pending: Dict['Future[Tuple[str, str]]', Tuple[int, float, float]] = {}
+    
+    def segment_event(future: 'Future[Tuple[str, str]]') -> Dict[str, Any]:
+        index, start, end = pending.pop(future)
+        provider, text = future.result()
+        return {'segment': index, 'start': round(start, 2), 'end': round(end, 2), 'text': text, 'provider': provider}
+    
+    try:
+        segments = split_ogg_opus(audio_bytes, STT_SEGMENT_SECONDS, STT_SEGMENT_BYTES)
+        for index, (start, end, segment) in enumerate(segments):
+            while len(pending) >= STT_MAX_INFLIGHT:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield segment_event(future)
+            pending[_stt_pool.submit(contextvars.copy_context().run, recognize, segment)] = (index, start, end)
+        
+        for future in as_completed(list(pending)):
+            yield segment_event(future)
+    finally:
+        for future in pending:
+            future.cancel()
+
+def recognize_long(recognize: Callable[[bytes], Tuple[str, str]], audio_bytes: bytes,
+                   stream_format: Optional[str], session_id: Optional[str] = None) -> Dict[str, Any]:
+    try:
+        events = list(iter_segment_results(recognize, audio_bytes))
+    except ProviderError as e:
+        return {
+            'statusCode': e.status_code,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': e.body})
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
+    
+    ordered = sorted(events, key=lambda event: event['segment'])
+    result = ' '.join(event['text'] for event in ordered if event['text'])
+    log_usage(os.environ.get('DATABASE_URL'), 'speech-stt', session_id, None, result, {
+        'long': True,
+        'segments': len(events),
+        'providers': sorted({event['provider'] for event in events}),
+        'audio_bytes': len(audio_bytes)
+    })
+    
+    if not stream_format:
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': dumps({'result': result, 'segments': ordered})
+        }
+    
+    # Частичные результаты идут в порядке готовности, итог — последним событием
+    body = ''.join(encode_event(event, stream_format) for event in events)
+    body += encode_event({'done': True, 'result': result, 'segments': len(events)}, stream_format)
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': STREAM_FORMATS[stream_format],
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': body
+    }
+
+@timed('speech')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: Universal speech service (STT/TTS for Yandex and Sber)
-    Args: event with httpMethod (POST, OPTIONS), body with action, provider, text/audio
-    Returns: Recognized text or synthesized audio
+    Args: event with httpMethod (POST, OPTIONS), JSON body with action, provider, text/audio
+          or raw audio/* body with action and provider in the query string
+    Returns: Recognized text, synthesized audio as JSON or raw audio/ogg when binary
     '''
     method: str = event.get('httpMethod', 'GET')
     
@@ -50,13 +408,33 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'body': json.dumps({'error': 'Method not allowed'})
         }
     
-    body_data = json.loads(event.get('body', '{}'))
-    action = body_data.get('action')
-    provider = body_data.get('provider', 'yandex')
+    params = event.get('queryStringParameters') or {}
+    headers = {key.lower(): value for key, value in (event.get('headers') or {}).items()}
+    
+    # Бинарный режим: сырое аудио в теле без base64 и JSON-обёртки
+    binary_request = headers.get('content-type', '').startswith(BINARY_AUDIO_TYPES)
+    body_data = {} if binary_request else json.loads(event.get('body') or '{}')
+    action = body_data.get('action') or params.get('action') or ('stt' if binary_request else None)
+    provider = body_data.get('provider') or params.get('provider', 'yandex')
+    binary = bool(body_data.get('binary')) or params.get('binary') in ('1', 'true') or 'audio/' in headers.get('accept', '')
+    session_id = body_data.get('session_id') or params.get('session_id')
+    
+    if action == 'stats':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({
+                'token_cache': get_token_stats(),
+                'audio_cache': get_audio_cache_stats(),
+                'providers': get_health_snapshot(),
+                'usage_log': get_usage_stats()
+            })
+        }
     
     if action == 'stt':
-        audio_base64 = body_data.get('audio', '')
-        if not audio_base64:
+        audio_bytes = read_audio_body(event) if binary_request else base64.b64decode(body_data.get('audio', ''))
+        if not audio_bytes:
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -64,14 +442,23 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'No audio data provided'})
             }
         
-        if provider == 'yandex':
-            return yandex_stt(audio_base64)
-        elif provider == 'sber':
-            return sber_stt(audio_base64)
+        long_audio = bool(body_data.get('long')) or params.get('long') in ('1', 'true')
+        stream = bool(body_data.get('stream')) or params.get('stream') in ('1', 'true')
+        stream_format = (body_data.get('stream_format') or params.get('stream_format') or 'ndjson') if stream else None
+        if stream_format and stream_format not in STREAM_FORMATS:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps({'error': 'Unsupported stream_format'})
+            }
+        
+        if provider in SPEECH_PROVIDERS:
+            return speech_to_text(provider, audio_bytes, long_audio, stream_format, session_id)
     
     elif action == 'tts':
-        text = body_data.get('text', '')
-        if not text:
+        text = body_data.get('text') or ''
+        if not isinstance(text, str) or not text.strip():
             return {
                 'statusCode': 400,
                 'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -79,10 +466,19 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
                 'body': json.dumps({'error': 'No text provided'})
             }
         
-        if provider == 'yandex':
-            return yandex_tts(text)
-        elif provider == 'sber':
-            return sber_tts(text)
+        first_chunk = bool(body_data.get('first_chunk'))
+        try:
+            chunk_offset = int(body_data.get('chunk_offset', 0))
+        except (TypeError, ValueError):
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'isBase64Encoded': False,
+                'body': json.dumps({'error': 'chunk_offset must be an integer'})
+            }
+        
+        if provider in SPEECH_PROVIDERS:
+            return text_to_speech(provider, text, first_chunk, chunk_offset, binary, session_id)
     
     return {
         'statusCode': 400,
@@ -91,146 +487,139 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
         'body': json.dumps({'error': 'Invalid action or provider'})
     }
 
-def yandex_stt(audio_base64: str) -> Dict[str, Any]:
-    api_key = os.environ.get('YANDEX_SPEECH_API_KEY')
-    folder_id = 'b1gfkd2baaso5298c7lt'
-    
-    if not api_key:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Yandex API key not configured'})
-        }
-    
-    audio_bytes = base64.b64decode(audio_base64)
-    
-    try:
-        response = requests.post(
-            f'https://stt.api.cloud.yandex.net/speech/v1/stt:recognize?folderId={folder_id}&lang=ru-RU',
-            headers={'Authorization': f'Api-Key {api_key}'},
-            data=audio_bytes
-        )
-        
-        if response.status_code != 200:
-            return {
-                'statusCode': response.status_code,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': response.text})
-            }
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps(response.json())
-        }
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': str(e)})
+def yandex_recognize(audio_bytes: bytes, api_key: str, timeout: Optional[float] = None) -> str:
+    response = request(
+        'POST',
+        f'{YANDEX_STT_URL}?folderId={YANDEX_FOLDER_ID}&lang=ru-RU',
+        timeout=timeout,
+        headers={'Authorization': f'Api-Key {api_key}'},
+        content=audio_bytes
+    )
+    if response.status_code != 200:
+        raise ProviderError(response.status_code, response.text)
+    return response.json().get('result', '')
+
+def yandex_synthesize(text: str, api_key: str, timeout: Optional[float] = None) -> bytes:
+    response = request(
+        'POST',
+        YANDEX_TTS_URL,
+        timeout=timeout,
+        headers={'Authorization': f'Api-Key {api_key}'},
+        data={
+            'text': text,
+            'lang': 'ru-RU',
+            'voice': YANDEX_TTS_VOICE,
+            'folderId': YANDEX_FOLDER_ID,
+            'format': YANDEX_TTS_FORMAT
         }
+    )
+    if response.status_code != 200:
+        raise ProviderError(response.status_code, response.text)
+    return response.content
+
+def sber_recognize(audio_bytes: bytes, client_id: str, client_secret: str,
+                   timeout: Optional[float] = None) -> str:
+    oauth_token = get_sber_oauth_token(client_id, client_secret)
+    response = sber_post(
+        client_id, client_secret, oauth_token,
+        f'{SBER_SPEECH_URL}/speech:recognize',
+        headers={'Content-Type': 'audio/opus'},
+        timeout=timeout,
+        content=audio_bytes
+    )
+    if response.status_code != 200:
+        raise ProviderError(response.status_code, response.text)
+    result = response.json().get('result', '')
+    return ' '.join(result) if isinstance(result, list) else result
+
+def sber_synthesize(text: str, client_id: str, client_secret: str,
+                    timeout: Optional[float] = None) -> bytes:
+    oauth_token = get_sber_oauth_token(client_id, client_secret)
+    response = sber_post(
+        client_id, client_secret, oauth_token,
+        f'{SBER_SPEECH_URL}/text:synthesize?format={SBER_TTS_FORMAT}&voice={SBER_TTS_VOICE}',
+        headers={'Content-Type': 'application/json'},
+        timeout=timeout,
+        json={'text': text}
+    )
+    if response.status_code != 200:
+        raise ProviderError(response.status_code, response.text)
+    return response.content
 
-def yandex_tts(text: str) -> Dict[str, Any]:
+def yandex_speech(operation: str) -> Optional[SpeechCall]:
     api_key = os.environ.get('YANDEX_SPEECH_API_KEY')
-    folder_id = 'b1gfkd2baaso5298c7lt'
-    
     if not api_key:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Yandex API key not configured'})
-        }
-    
-    try:
-        response = requests.post(
-            'https://tts.api.cloud.yandex.net/speech/v1/tts:synthesize',
-            headers={'Authorization': f'Api-Key {api_key}'},
-            data={
-                'text': text,
-                'lang': 'ru-RU',
-                'voice': 'alena',
-                'folderId': folder_id,
-                'format': 'oggopus'
-            }
-        )
-        
-        if response.status_code != 200:
-            return {
-                'statusCode': response.status_code,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': response.text})
-            }
-        
-        audio_base64 = base64.b64encode(response.content).decode('utf-8')
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'audio': audio_base64})
-        }
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': str(e)})
-        }
+        return None
+    if operation == 'stt':
+        return lambda audio_bytes, timeout: yandex_recognize(audio_bytes, api_key, timeout)
+    return lambda text, timeout: yandex_synthesize(text, api_key, timeout)
 
-def sber_stt(audio_base64: str) -> Dict[str, Any]:
+def sber_speech(operation: str) -> Optional[SpeechCall]:
     client_id = os.environ.get('SBER_CLIENT_ID')
     client_secret = os.environ.get('SBER_CLIENT_SECRET')
-    
     if not client_id or not client_secret:
+        return None
+    # OAuth-токен запрашивается только для фрагментов, которых нет в кеше
+    if operation == 'stt':
+        return lambda audio_bytes, timeout: sber_recognize(audio_bytes, client_id, client_secret, timeout)
+    return lambda text, timeout: sber_synthesize(text, client_id, client_secret, timeout)
+
+SPEECH_PROVIDERS: Dict[str, Callable[[str], Optional[SpeechCall]]] = {'yandex': yandex_speech, 'sber': sber_speech}
+SPEECH_FAILOVER = {'yandex': 'sber', 'sber': 'yandex'}
+SPEECH_CREDENTIALS_ERRORS = {'yandex': 'Yandex API key not configured', 'sber': 'Sber credentials not configured'}
+
+def _with_breaker(breaker: str, call: SpeechCall) -> Callable[[Any], Any]:
+    return lambda data: guarded(breaker, lambda timeout: call(data, timeout))
+
+def speech_chain(provider: str, operation: str) -> List[Tuple[str, Callable[[Any], Any]]]:
+    '''
+    Build the provider chain for one operation: the requested provider,
+    then the other one if it is configured. Every call goes through the
+    provider's circuit breaker with its adaptive timeout.
+    '''
+    chain: List[Tuple[str, Callable[[Any], Any]]] = []
+    for name in (provider, SPEECH_FAILOVER[provider]):
+        call = SPEECH_PROVIDERS[name](operation)
+        if call is None:
+            if name == provider:
+                return []
+            continue
+        chain.append((name, _with_breaker(f'{name}-{operation}', call)))
+    return chain
+
+def recognize_with_failover(chain: List[Tuple[str, Callable[[bytes], str]]], audio_bytes: bytes) -> Tuple[str, str]:
+    for index, (name, recognize) in enumerate(chain):
+        try:
+            return name, recognize(audio_bytes)
+        except Exception as e:
+            if index == len(chain) - 1 or not should_fail_over(e):
+                raise
+    raise ValueError('Empty provider chain')
+
+def speech_to_text(provider: str, audio_bytes: bytes, long_audio: bool = False,
+                   stream_format: Optional[str] = None, session_id: Optional[str] = None) -> Dict[str, Any]:
+    chain = speech_chain(provider, 'stt')
+    if not chain:
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Sber credentials not configured'})
-        }
-    
-    try:
-        oauth_token = get_sber_oauth_token(client_id, client_secret)
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': f'Failed to get OAuth token: {str(e)}'})
+            'body': json.dumps({'error': SPEECH_CREDENTIALS_ERRORS[provider]})
         }
     
-    audio_bytes = base64.b64decode(audio_base64)
+    # При длинной записи каждый сегмент сам переключается на запасного провайдера
+    recognize = lambda segment: recognize_with_failover(chain, segment)
+    if wants_long_recognition(audio_bytes, long_audio):
+        return recognize_long(recognize, audio_bytes, stream_format, session_id)
     
     try:
-        response = requests.post(
-            'https://smartspeech.sber.ru/rest/v1/speech:recognize',
-            headers={
-                'Authorization': f'Bearer {oauth_token}',
-                'Content-Type': 'audio/opus'
-            },
-            data=audio_bytes,
-            verify=False
-        )
-        
-        if response.status_code != 200:
-            return {
-                'statusCode': response.status_code,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': response.text})
-            }
-        
+        served_by, result = recognize(audio_bytes)
+    except ProviderError as e:
         return {
-            'statusCode': 200,
+            'statusCode': e.status_code,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps(response.json())
+            'body': json.dumps({'error': e.body})
         }
     except Exception as e:
         return {
@@ -239,60 +628,45 @@ def sber_stt(audio_base64: str) -> Dict[str, Any]:
             'isBase64Encoded': False,
             'body': json.dumps({'error': str(e)})
         }
-
-def sber_tts(text: str) -> Dict[str, Any]:
-    client_id = os.environ.get('SBER_CLIENT_ID')
-    client_secret = os.environ.get('SBER_CLIENT_SECRET')
     
-    if not client_id or not client_secret:
+    log_usage(os.environ.get('DATABASE_URL'), 'speech-stt', session_id, None, result, {
+        'requested': provider,
+        'provider': served_by,
+        'audio_bytes': len(audio_bytes)
+    })
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': json.dumps({'result': result, 'provider': served_by})
+    }
+
+def text_to_speech(provider: str, text: str, first_chunk: bool = False, chunk_offset: int = 0,
+                   binary: bool = False, session_id: Optional[str] = None) -> Dict[str, Any]:
+    chain = speech_chain(provider, 'tts')
+    if not chain:
         return {
             'statusCode': 500,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
             'isBase64Encoded': False,
-            'body': json.dumps({'error': 'Sber credentials not configured'})
+            'body': json.dumps({'error': SPEECH_CREDENTIALS_ERRORS[provider]})
         }
     
-    try:
-        oauth_token = get_sber_oauth_token(client_id, client_secret)
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': f'Failed to get OAuth token: {str(e)}'})
-        }
+    # Голоса у провайдеров разные, поэтому переключаемся целиком, а не пофрагментно
+    for index, (name, synthesize) in enumerate(chain):
+        voice, audio_format = TTS_VOICES[name]
+        response = synthesize_text(name, voice, audio_format, synthesize, text, first_chunk, chunk_offset, binary)
+        status = response['statusCode']
+        if index == len(chain) - 1 or not (status >= 500 or status == 429):
+            break
     
-    try:
-        response = requests.post(
-            'https://smartspeech.sber.ru/rest/v1/text:synthesize?format=opus&voice=Nec_24000',
-            headers={
-                'Authorization': f'Bearer {oauth_token}',
-                'Content-Type': 'application/json'
-            },
-            json={'text': text},
-            verify=False
-        )
-        
-        if response.status_code != 200:
-            return {
-                'statusCode': response.status_code,
-                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-                'isBase64Encoded': False,
-                'body': json.dumps({'error': response.text})
-            }
-        
-        audio_base64 = base64.b64encode(response.content).decode('utf-8')
-        
-        return {
-            'statusCode': 200,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'audio': audio_base64})
-        }
-    except Exception as e:
-        return {
-            'statusCode': 500,
-            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'isBase64Encoded': False,
-            'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+    if status == 200:
+        log_usage(os.environ.get('DATABASE_URL'), 'speech-tts', session_id, text, None, {
+            'requested': provider,
+            'provider': name,
+            'voice': voice,
+            'chunk_offset': chunk_offset,
+            'first_chunk': first_chunk,
+            'cache': response['headers']['X-Cache']
+        })
+    return response
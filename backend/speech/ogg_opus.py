@@ -0,0 +1,163 @@
+import struct
+import zlib
+from typing import Iterator, List, Optional, Tuple
+
+OGG_HEADER = struct.Struct('<4sBBqIIIB')
+OGG_BOS = 0x02
+OGG_EOS = 0x04
+OPUS_SAMPLE_RATE = 48000
+
+# flags, granule, serial, seq, crc, сегменты, тело
+OggPage = Tuple[int, int, int, int, int, bytes, bytes]
+
+# CRC Ogg — CRC-32 с полиномом 0x04C11DB7 без отражения битов, начальным значением 0
+# и без финального XOR. Побайтовый цикл на Python тратил около секунды на запись в 5 МБ, поэтому
+# считаем через zlib.crc32 (отражённый вариант того же полинома): биты каждого байта
+# входа и 32 бита результата разворачиваются, а начальное и финальное значения
+# компенсируются XOR-ом с 0xFFFFFFFF
+BIT_REVERSE = bytes(int(f'{i:08b}'[::-1], 2) for i in range(256))
+
+def _ogg_crc(*parts: bytes) -> int:
+    crc = 0xFFFFFFFF
+    for part in parts:
+        crc = zlib.crc32(part.translate(BIT_REVERSE), crc)
+    return int.from_bytes((crc ^ 0xFFFFFFFF).to_bytes(4, 'big').translate(BIT_REVERSE), 'little')
+
+def is_ogg(data: bytes) -> bool:
+    return data[:4] == b'OggS'
+
+def iter_ogg_pages(data: bytes) -> Iterator[OggPage]:
+    # Страницы разбираются лениво: в памяти одновременно только текущая
+    pos = 0
+    while pos < len(data):
+        if len(data) - pos < OGG_HEADER.size:
+            raise ValueError('Truncated Ogg page')
+        capture, version, flags, granule, serial, seq, crc, nsegs = OGG_HEADER.unpack_from(data, pos)
+        if capture != b'OggS' or version != 0:
+            raise ValueError('Not an Ogg stream')
+        segments = data[pos + OGG_HEADER.size:pos + OGG_HEADER.size + nsegs]
+        body_start = pos + OGG_HEADER.size + nsegs
+        body_end = body_start + sum(segments)
+        if len(segments) != nsegs or body_end > len(data):
+            raise ValueError('Truncated Ogg page')
+        yield flags, granule, serial, seq, crc, segments, data[body_start:body_end]
+        pos = body_end
+
+def parse_ogg_pages(data: bytes) -> List[OggPage]:
+    return list(iter_ogg_pages(data))
+
+def build_page(flags: int, granule: int, serial: int, seq: int, segments: bytes, body: bytes,
+               crc: Optional[int] = None) -> bytes:
+    if crc is None:
+        header = OGG_HEADER.pack(b'OggS', 0, flags, granule, serial, seq, 0, len(segments)) + segments
+        crc = _ogg_crc(header, body)
+    return OGG_HEADER.pack(b'OggS', 0, flags, granule, serial, seq, crc, len(segments)) + segments + body
+
+def _rewrite_page(page: OggPage, flags: int, granule: int, serial: int, seq: int) -> bytes:
+    # Страница без изменений в заголовке копируется со своей CRC, пересчёт только для изменённых
+    old_flags, old_granule, old_serial, old_seq, crc, segments, body = page
+    if (flags, granule, serial, seq) != (old_flags, old_granule, old_serial, old_seq):
+        crc = None
+    return build_page(flags, granule, serial, seq, segments, body, crc)
+
+def ogg_duration(data: bytes) -> Optional[float]:
+    # Гранула последней страницы — число сэмплов от начала потока
+    pos = data.rfind(b'OggS')
+    if pos < 0 or len(data) - pos < OGG_HEADER.size:
+        return None
+    granule = OGG_HEADER.unpack_from(data, pos)[3]
+    return granule / OPUS_SAMPLE_RATE if granule > 0 else None
+
+def concat_ogg_opus(streams: List[bytes]) -> bytes:
+    '''
+    Stitch several Ogg/Opus files into one logical stream: headers of the
+    later files are dropped, pages get one serial number, continuous
+    sequence numbers and granule positions, and only the last page keeps EOS.
+    '''
+    if len(streams) == 1:
+        return streams[0]
+    try:
+        parsed = [parse_ogg_pages(data) for data in streams]
+    except ValueError:
+        # Не Ogg — отдаём склейку как есть, плееры понимают цепочки потоков
+        return b''.join(streams)
+    
+    serial = parsed[0][0][2]
+    out: List[bytes] = []
+    seq = 0
+    granule_offset = 0
+    for index, pages in enumerate(parsed):
+        last_granule = 0
+        for page in pages:
+            flags, granule = page[0], page[1]
+            # Страницы заголовков OpusHead/OpusTags имеют нулевую гранулу
+            if index > 0 and granule == 0:
+                continue
+            if index > 0:
+                flags &= ~OGG_BOS
+            if index < len(parsed) - 1:
+                flags &= ~OGG_EOS
+            if granule != -1:
+                last_granule = granule
+                granule += granule_offset
+            out.append(_rewrite_page(page, flags, granule, serial, seq))
+            seq += 1
+        granule_offset += last_granule
+    return b''.join(out)
+
+def _segment_file(header_pages: List[OggPage], audio_pages: List[OggPage], base_granule: int) -> bytes:
+    out = []
+    seq = 0
+    for page in header_pages:
+        out.append(_rewrite_page(page, page[0], page[1], page[2], seq))
+        seq += 1
+    for index, page in enumerate(audio_pages):
+        flags, granule, serial = page[0], page[1], page[2]
+        flags &= ~(OGG_BOS | OGG_EOS)
+        if index == len(audio_pages) - 1:
+            flags |= OGG_EOS
+        if granule != -1:
+            granule -= base_granule
+        out.append(_rewrite_page(page, flags, granule, serial, seq))
+        seq += 1
+    return b''.join(out)
+
+def split_ogg_opus(data: bytes, max_seconds: float, max_bytes: int) -> Iterator[Tuple[float, float, bytes]]:
+    '''
+    Cut an Ogg/Opus recording into standalone Ogg/Opus files of at most
+    max_seconds / max_bytes each, splitting only on packet boundaries.
+    Segments are produced lazily as (start_seconds, end_seconds, bytes).
+    '''
+    max_samples = int(max_seconds * OPUS_SAMPLE_RATE)
+    header_pages: List[OggPage] = []
+    audio_pages: List[OggPage] = []
+    size = 0
+    base_granule = 0
+    end_granule = 0
+    splittable = True
+    
+    for page in iter_ogg_pages(data):
+        flags, granule, _, _, _, segments, body = page
+        if not audio_pages and granule == 0 and not end_granule:
+            header_pages.append(page)
+            continue
+        
+        page_size = OGG_HEADER.size + len(segments) + len(body)
+        over_limit = (
+            granule != -1 and granule - base_granule > max_samples
+        ) or size + page_size > max_bytes
+        if audio_pages and over_limit and splittable:
+            yield (base_granule / OPUS_SAMPLE_RATE, end_granule / OPUS_SAMPLE_RATE,
+                   _segment_file(header_pages, audio_pages, base_granule))
+            audio_pages, size, base_granule = [], 0, end_granule
+        
+        audio_pages.append(page)
+        size += page_size
+        if granule != -1:
+            end_granule = granule
+        # Резать можно только после страницы, на которой пакет закончился
+        splittable = bool(segments) and segments[-1] < 255
+    
+    if audio_pages:
+        yield (base_granule / OPUS_SAMPLE_RATE, end_granule / OPUS_SAMPLE_RATE,
+               _segment_file(header_pages, audio_pages, base_granule))
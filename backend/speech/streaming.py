@@ -0,0 +1,52 @@
+import json
+import time
+from typing import Dict, Any, Iterable, Iterator
+
+STREAM_FORMATS = {
+    'sse': 'text/event-stream',
+    'ndjson': 'application/x-ndjson',
+}
+
+def encode_event(payload: Dict[str, Any], stream_format: str) -> str:
+    data = json.dumps(payload, ensure_ascii=False)
+    if stream_format == 'sse':
+        return f'data: {data}\n\n'
+    return data + '\n'
+
+def iter_stream_events(deltas: Iterable[str], stream_format: str, meta: Dict[str, Any]) -> Iterator[str]:
+    '''
+    Re-encode provider deltas as SSE or NDJSON events. The last event carries
+    the full text, time to first token and the caller's metadata.
+    '''
+    started = time.monotonic()
+    first_token_ms = None
+    parts = []
+    for delta in deltas:
+        if first_token_ms is None:
+            first_token_ms = round((time.monotonic() - started) * 1000)
+        parts.append(delta)
+        yield encode_event({'delta': delta}, stream_format)
+    
+    yield encode_event({
+        'done': True,
+        'text': ''.join(parts),
+        'ttft_ms': first_token_ms,
+        'total_ms': round((time.monotonic() - started) * 1000),
+        **meta
+    }, stream_format)
+    if stream_format == 'sse':
+        yield 'data: [DONE]\n\n'
+
+def stream_response(deltas: Iterable[str], stream_format: str, meta: Dict[str, Any]) -> Dict[str, Any]:
+    # Среда выполнения функций отдаёт ответ целиком, поэтому события собираются
+    # в одно тело; там, где ответ можно писать по частям, используйте iter_stream_events
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': STREAM_FORMATS[stream_format],
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*'
+        },
+        'isBase64Encoded': False,
+        'body': ''.join(iter_stream_events(deltas, stream_format, meta))
+    }
@@ -0,0 +1,45 @@
+import os
+import re
+from typing import List
+
+TTS_CHUNK_CHARS = int(os.environ.get('TTS_CHUNK_CHARS', '1000'))
+TTS_FIRST_CHUNK_CHARS = int(os.environ.get('TTS_FIRST_CHUNK_CHARS', '250'))
+
+SENTENCE_RE = re.compile(r'(?<=[.!?…])\s+')
+CLAUSE_RE = re.compile(r'(?<=[,;:—])\s+')
+
+def _split_long(sentence: str, max_chars: int) -> List[str]:
+    # Предложение длиннее лимита режем по запятым, а в крайнем случае по словам
+    parts: List[str] = []
+    for piece in CLAUSE_RE.split(sentence):
+        while len(piece) > max_chars:
+            cut = piece.rfind(' ', 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            parts.append(piece[:cut].strip())
+            piece = piece[cut:].strip()
+        if piece:
+            parts.append(piece)
+    return parts
+
+def split_tts_text(text: str, max_chars: int = TTS_CHUNK_CHARS,
+                   first_chars: int = TTS_FIRST_CHUNK_CHARS) -> List[str]:
+    '''
+    Split text into chunks on sentence boundaries. The first chunk is kept
+    short so its audio comes back quickly; the rest are packed up to max_chars.
+    '''
+    sentences: List[str] = []
+    for sentence in SENTENCE_RE.split(' '.join(text.split())):
+        sentences.extend(_split_long(sentence, first_chars if not sentences else max_chars))
+    
+    chunks: List[str] = []
+    current = ''
+    for sentence in sentences:
+        limit = first_chars if not chunks else max_chars
+        if current and len(current) + 1 + len(sentence) > limit:
+            chunks.append(current)
+            current = sentence
+        else:
+            current = f'{current} {sentence}' if current else sentence
+    if current:
+        chunks.append(current)
+    return chunks
@@ -0,0 +1,148 @@
+import json
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any
+
+from db import get_connection, release_connection
+from timing import dumps, timed
+from usage_rollup import LATENCY_BUCKETS_MS, ROLLUP_TABLES, get_watermark, read_rollups, run_rollup
+
+ROLLUP_MAX_AGE = float(os.environ.get('ROLLUP_MAX_AGE', '60'))
+ROLLUP_READ_BATCH_ROWS = int(os.environ.get('ROLLUP_READ_BATCH_ROWS', '10000'))
+ROLLUP_TIME_BUDGET = float(os.environ.get('ROLLUP_TIME_BUDGET', '20'))
+
+DEFAULT_WINDOW = {'hour': timedelta(hours=24), 'day': timedelta(days=30)}
+MAX_WINDOW = {'hour': timedelta(days=31), 'day': timedelta(days=366)}
+
+def parse_timestamp(value: str) -> datetime:
+    # Сводки хранят наивное время UTC: метку со смещением (…Z, …+03:00) переводим в UTC
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def watermark_json(watermark: Dict[str, Any]) -> Dict[str, Any]:
+    updated_at = watermark['updated_at']
+    return {
+        'last_id': watermark['last_id'],
+        'updated_at': updated_at.isoformat() if updated_at else None,
+        'age_seconds': round(watermark['age_seconds'], 1) if watermark['age_seconds'] is not None else None
+    }
+
+@timed('usage-stats')
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Usage analytics per model from hourly/daily rollups of ai_tools_usage
+    Args: event with httpMethod (GET, POST, OPTIONS); GET query period (hour|day), from, to, tool;
+          POST ?action=rollup folds new usage rows into the rollups (for a scheduled trigger)
+    Returns: JSON with per-bucket requests, tokens and latency histograms, or rollup progress
+    '''
+    method: str = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type',
+                'Access-Control-Max-Age': '86400'
+            },
+            'body': ''
+        }
+    
+    dsn = os.environ.get('DATABASE_URL')
+    if not dsn:
+        return {
+            'statusCode': 500,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Database not configured'})
+        }
+    
+    params = event.get('queryStringParameters', {}) or {}
+    
+    if method == 'POST' and params.get('action') == 'rollup':
+        conn = get_connection(dsn)
+        try:
+            # Догоняем водяной знак пачками, пока хватает бюджета времени вызова
+            started = time.monotonic()
+            batches = []
+            while time.monotonic() - started < ROLLUP_TIME_BUDGET:
+                result = run_rollup(conn)
+                batches.append(result)
+                if result['skipped'] or result['caught_up']:
+                    break
+            watermark = get_watermark(conn)
+        finally:
+            release_connection(dsn, conn)
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': dumps({'batches': batches, 'watermark': watermark_json(watermark)})
+        }
+    
+    if method != 'GET':
+        return {
+            'statusCode': 405,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Method not allowed'})
+        }
+    
+    period = params.get('period', 'hour')
+    if period not in ROLLUP_TABLES:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'period must be hour or day'})
+        }
+    
+    try:
+        until = parse_timestamp(params['to']) if params.get('to') else utc_now()
+        since = parse_timestamp(params['from']) if params.get('from') else until - DEFAULT_WINDOW[period]
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'from and to must be ISO 8601 timestamps'})
+        }
+    if since >= until or until - since > MAX_WINDOW[period]:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Invalid time window'})
+        }
+    
+    conn = get_connection(dsn)
+    try:
+        watermark = get_watermark(conn)
+        # Без планировщика сводки подтягивает чтение: не чаще раза в ROLLUP_MAX_AGE
+        # и не больше ROLLUP_READ_BATCH_ROWS строк за вызов
+        if watermark['age_seconds'] is None or watermark['age_seconds'] > ROLLUP_MAX_AGE:
+            run_rollup(conn, ROLLUP_READ_BATCH_ROWS)
+            watermark = get_watermark(conn)
+        result = read_rollups(conn, period, since, until, params.get('tool'))
+    finally:
+        release_connection(dsn, conn)
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'isBase64Encoded': False,
+        'body': dumps({
+            'period': period,
+            'from': since.isoformat(),
+            'to': until.isoformat(),
+            'latency_buckets_ms': list(LATENCY_BUCKETS_MS),
+            'watermark': watermark_json(watermark),
+            **result
+        })
+    }
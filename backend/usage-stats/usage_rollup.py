@@ -0,0 +1,205 @@
+import os
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Sequence, Tuple
+
+ROLLUP_SOURCE = 'ai_tools_usage'
+ROLLUP_BATCH_ROWS = int(os.environ.get('ROLLUP_BATCH_ROWS', '50000'))
+
+# Границы корзин совпадают с описанием usage_rollup_* в V0031
+LATENCY_BUCKETS_MS = (100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+ROLLUP_TABLES = {'hour': 'usage_rollup_hourly', 'day': 'usage_rollup_daily'}
+
+def _histogram_sql() -> str:
+    bounds = (None,) + LATENCY_BUCKETS_MS + (None,)
+    buckets = []
+    for lower, upper in zip(bounds, bounds[1:]):
+        conditions = []
+        if lower is not None:
+            conditions.append(f'latency_ms >= {lower}')
+        if upper is not None:
+            conditions.append(f'latency_ms < {upper}')
+        buckets.append(f"count(*) FILTER (WHERE {' AND '.join(conditions)})")
+    return f"ARRAY[{', '.join(buckets)}]::BIGINT[]"
+
+def _rollup_sql(table: str) -> str:
+    return f"""
+        INSERT INTO {table} AS r (
+            bucket, tool_name, requests, input_tokens, output_tokens,
+            latency_sum_ms, latency_count, latency_histogram
+        )
+        SELECT date_trunc(%s, created_at), tool_name, count(*),
+               COALESCE(sum(input_tokens), 0), COALESCE(sum(output_tokens), 0),
+               COALESCE(sum(latency_ms), 0), count(latency_ms), {_histogram_sql()}
+        FROM ai_tools_usage
+        WHERE id > %s AND id <= %s
+        GROUP BY 1, 2
+        ON CONFLICT (bucket, tool_name) DO UPDATE SET
+            requests = r.requests + EXCLUDED.requests,
+            input_tokens = r.input_tokens + EXCLUDED.input_tokens,
+            output_tokens = r.output_tokens + EXCLUDED.output_tokens,
+            latency_sum_ms = r.latency_sum_ms + EXCLUDED.latency_sum_ms,
+            latency_count = r.latency_count + EXCLUDED.latency_count,
+            latency_histogram = ARRAY(
+                SELECT a + b
+                FROM unnest(r.latency_histogram, EXCLUDED.latency_histogram) WITH ORDINALITY AS h(a, b, n)
+                ORDER BY n
+            )
+    """
+
+def visible_horizon(conn: Any) -> Tuple[int, str, bool]:
+    # id выдаются до коммита, поэтому max(id) сам по себе может обогнать ещё
+    # не закоммиченную вставку, и водяной знак проскочит её навсегда.
+    # Вместе с max(id) берём xmax того же снимка; если в снимке нет идущих
+    # транзакций, всё до max(id) уже видно сразу. Запрос идёт первым в
+    # транзакции, пока у неё самой нет xid
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT (SELECT COALESCE(max(id), 0) FROM ai_tools_usage),
+                   pg_snapshot_xmax(s)::text, pg_snapshot_xmin(s) = pg_snapshot_xmax(s)
+            FROM pg_current_snapshot() AS s
+            """
+        )
+        max_id, xmax, quiet = cur.fetchone()
+        return max_id, xmax, bool(quiet)
+    finally:
+        cur.close()
+
+def run_rollup(conn: Any, max_rows: int = ROLLUP_BATCH_ROWS) -> Dict[str, Any]:
+    '''
+    Fold ai_tools_usage rows past the watermark (at most max_rows ids) into
+    the hourly and daily rollups and advance the watermark, all in one
+    transaction. Only ids up to the settled horizon are folded, so rows of
+    still-running inserts are never skipped; no lock is taken on
+    ai_tools_usage. Concurrent runs skip instead of double counting.
+    '''
+    max_id, xmax, quiet = visible_horizon(conn)
+    
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT last_id, safe_id, pending_id, pending_xmax::text,
+                   pending_xmax <= pg_snapshot_xmin(pg_current_snapshot())
+            FROM usage_rollup_state WHERE source = %s
+            FOR UPDATE SKIP LOCKED
+            """,
+            (ROLLUP_SOURCE,)
+        )
+        row = cur.fetchone()
+        if row is None:
+            conn.rollback()
+            return {'skipped': True, 'reason': 'in_progress'}
+        
+        last_id, safe_id, pending_id, pending_xmax, settled = row
+        if quiet:
+            safe_id, pending_id, pending_xmax = max(safe_id, max_id), None, None
+        elif settled:
+            safe_id, pending_id, pending_xmax = max(safe_id, pending_id), None, None
+        # Несозревший кандидат не перезаписываем, иначе под нагрузкой он не созреет никогда
+        if pending_id is None and max_id > safe_id:
+            pending_id, pending_xmax = max_id, xmax
+        
+        upper = min(safe_id, last_id + max_rows)
+        if upper > last_id:
+            for unit, table in ROLLUP_TABLES.items():
+                cur.execute(_rollup_sql(table), (unit, last_id, upper))
+        cur.execute(
+            """
+            UPDATE usage_rollup_state
+            SET last_id = %s, safe_id = %s, pending_id = %s, pending_xmax = %s::xid8, updated_at = NOW()
+            WHERE source = %s
+            """,
+            (upper, safe_id, pending_id, pending_xmax, ROLLUP_SOURCE)
+        )
+        conn.commit()
+        return {
+            'skipped': False,
+            'from_id': last_id,
+            'to_id': upper,
+            'pending_id': pending_id,
+            'caught_up': upper >= safe_id
+        }
+    finally:
+        cur.close()
+
+def get_watermark(conn: Any) -> Dict[str, Any]:
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT last_id, updated_at, EXTRACT(EPOCH FROM NOW() - updated_at) FROM usage_rollup_state WHERE source = %s",
+            (ROLLUP_SOURCE,)
+        )
+        row = cur.fetchone()
+    finally:
+        cur.close()
+    if row is None:
+        return {'last_id': 0, 'updated_at': None, 'age_seconds': None}
+    return {'last_id': row[0], 'updated_at': row[1], 'age_seconds': float(row[2]) if row[2] is not None else None}
+
+def histogram_percentile(histogram: Sequence[int], q: float) -> Optional[int]:
+    # Верхняя граница корзины, в которую попал q-й перцентиль; None — дольше последней границы
+    total = sum(histogram)
+    if not total:
+        return None
+    rank = q * total
+    seen = 0
+    for index, count in enumerate(histogram):
+        seen += count
+        if seen >= rank:
+            return LATENCY_BUCKETS_MS[index] if index < len(LATENCY_BUCKETS_MS) else None
+    return None
+
+def rollup_entry(tool_name: str, requests: int, input_tokens: int, output_tokens: int,
+                 latency_sum_ms: int, latency_count: int, histogram: List[int]) -> Dict[str, Any]:
+    return {
+        'tool_name': tool_name,
+        'requests': requests,
+        'input_tokens': input_tokens,
+        'output_tokens': output_tokens,
+        'avg_latency_ms': round(latency_sum_ms / latency_count) if latency_count else None,
+        'p50_ms': histogram_percentile(histogram, 0.5),
+        'p95_ms': histogram_percentile(histogram, 0.95),
+        'latency_histogram': histogram
+    }
+
+def read_rollups(conn: Any, period: str, since: datetime, until: datetime,
+                 tool_name: Optional[str] = None) -> Dict[str, Any]:
+    # Чтение идёт только по сводкам и первичному ключу (bucket, tool_name):
+    # стоимость зависит от окна, а не от размера ai_tools_usage
+    query = f"""
+        SELECT bucket, tool_name, requests, input_tokens, output_tokens,
+               latency_sum_ms, latency_count, latency_histogram
+        FROM {ROLLUP_TABLES[period]}
+        WHERE bucket >= %s AND bucket < %s
+    """
+    params: List[Any] = [since, until]
+    if tool_name:
+        query += " AND tool_name = %s"
+        params.append(tool_name)
+    query += " ORDER BY bucket, tool_name"
+    
+    cur = conn.cursor()
+    try:
+        cur.execute(query, params)
+        rows = cur.fetchall()
+    finally:
+        cur.close()
+    
+    series = []
+    totals: Dict[str, List[Any]] = {}
+    for bucket, name, requests, input_tokens, output_tokens, latency_sum, latency_count, histogram in rows:
+        histogram = list(histogram)
+        series.append({'bucket': bucket.isoformat(), **rollup_entry(
+            name, requests, input_tokens, output_tokens, latency_sum, latency_count, histogram
+        )})
+        total = totals.setdefault(name, [0, 0, 0, 0, 0, [0] * len(histogram)])
+        for index, value in enumerate((requests, input_tokens, output_tokens, latency_sum, latency_count)):
+            total[index] += value
+        total[5] = [a + b for a, b in zip(total[5], histogram)]
+    
+    return {
+        'series': series,
+        'totals': [rollup_entry(name, *total) for name, total in sorted(totals.items())]
+    }
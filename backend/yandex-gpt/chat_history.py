@@ -0,0 +1,115 @@
+import json
+import os
+from typing import Dict, Any, Iterable, Iterator, List
+
+import psycopg2
+
+from db import get_connection, release_connection
+
+CHAT_HISTORY_LIMIT = int(os.environ.get('CHAT_HISTORY_LIMIT', '20'))
+# Давность подгружаемых сообщений, секунд: ограничение по created_at отсекает
+# старые помесячные секции chat_messages, иначе запрос заглядывает в каждую
+CHAT_HISTORY_MAX_AGE = int(os.environ.get('CHAT_HISTORY_MAX_AGE', str(30 * 86400)))
+SESSION_ID_MAX_LENGTH = 255
+SESSION_TITLE_LENGTH = 100
+
+def valid_session_id(session_id: Any) -> bool:
+    return isinstance(session_id, str) and 0 < len(session_id) <= SESSION_ID_MAX_LENGTH
+
+def message_text(message: Dict[str, Any]) -> str:
+    return message.get('text', message.get('content', '')) or ''
+
+def load_history(conn: Any, session_id: str, limit: int = CHAT_HISTORY_LIMIT,
+                 max_age: int = CHAT_HISTORY_MAX_AGE) -> List[Dict[str, str]]:
+    # Последние limit сообщений за max_age секунд по индексу (session_id, id), без чтения всего диалога
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            SELECT role, content FROM (
+                SELECT id, role, content FROM chat_messages
+                WHERE session_id = %s AND created_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                ORDER BY id DESC
+                LIMIT %s
+            ) recent
+            ORDER BY id
+            """,
+            (session_id, max_age, limit)
+        )
+        return [{'role': role, 'text': content} for role, content in cur.fetchall()]
+    finally:
+        cur.close()
+
+def save_turns(conn: Any, session_id: str, model_id: str, turns: List[Dict[str, str]]) -> None:
+    '''
+    Append the turn's messages and bump chat_sessions.message_count in a
+    single statement: one batched INSERT feeding the session upsert.
+    '''
+    values = ', '.join(['(%s, %s, %s, %s)'] * len(turns))
+    params: List[Any] = []
+    for turn in turns:
+        params.extend([session_id, model_id, turn['role'], turn['text']])
+    title = next((turn['text'] for turn in turns if turn['role'] == 'user'), '')[:SESSION_TITLE_LENGTH]
+    
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            f"""
+            WITH inserted AS (
+                INSERT INTO chat_messages (session_id, model_id, role, content)
+                VALUES {values}
+                RETURNING 1
+            )
+            INSERT INTO chat_sessions (session_id, title, message_count)
+            VALUES (%s, %s, (SELECT count(*) FROM inserted))
+            ON CONFLICT (session_id) DO UPDATE
+            SET message_count = chat_sessions.message_count + EXCLUDED.message_count,
+                updated_at = NOW()
+            """,
+            params + [session_id, title or 'Новый диалог']
+        )
+        conn.commit()
+    finally:
+        cur.close()
+
+def log_history_error(operation: str, session_id: str, error: Exception) -> None:
+    line = {'type': 'chat_history_error', 'operation': operation, 'session_id': session_id, 'error': str(error).strip()}
+    print(json.dumps(line, ensure_ascii=False), flush=True)
+
+def get_history(dsn: str, session_id: str) -> List[Dict[str, str]]:
+    # Недоступная история не должна ломать чат: продолжаем с тем, что прислал клиент
+    conn = None
+    try:
+        conn = get_connection(dsn)
+        return load_history(conn, session_id)
+    except psycopg2.Error as e:
+        log_history_error('read', session_id, e)
+        return []
+    finally:
+        if conn is not None:
+            release_connection(dsn, conn)
+
+def put_turns(dsn: str, session_id: str, model_id: str,
+              new_messages: List[Dict[str, Any]], answer: str) -> None:
+    turns = [
+        {'role': msg['role'], 'text': message_text(msg)}
+        for msg in new_messages if msg.get('role') in ('user', 'assistant')
+    ]
+    turns.append({'role': 'assistant', 'text': answer})
+    
+    # Ответ уже получен: сбой записи только логируем, клиенту отдаём ответ
+    conn = None
+    try:
+        conn = get_connection(dsn)
+        save_turns(conn, session_id, model_id, turns)
+    except psycopg2.Error as e:
+        log_history_error('write', session_id, e)
+    finally:
+        if conn is not None:
+            release_connection(dsn, conn)
+
+def collect_text(deltas: Iterable[str], parts: List[str]) -> Iterator[str]:
+    # Потоковый ответ сохраняется целиком, когда поток дочитан
+    for delta in deltas:
+        parts.append(delta)
+        yield delta
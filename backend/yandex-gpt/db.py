@@ -0,0 +1,139 @@
+import os
+import threading
+import time
+import psycopg2
+import psycopg2.extensions
+from typing import Dict, Any, Callable, List, Tuple
+
+from timing import span
+
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', '5'))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', '10'))
+DB_PING_INTERVAL = float(os.environ.get('DB_PING_INTERVAL', '30'))
+
+class TimedCursor(psycopg2.extensions.cursor):
+    # Каждый запрос попадает в фазу query текущего вызова функции
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        with span('query'):
+            return super().execute(query, vars)
+    
+    def executemany(self, query: Any, vars_list: Any) -> Any:
+        with span('query'):
+            return super().executemany(query, vars_list)
+
+def connect(dsn: str) -> Any:
+    return psycopg2.connect(dsn, cursor_factory=TimedCursor)
+
+_connection_factory: Callable[[str], Any] = connect
+_pools_lock = threading.Lock()
+_pools: Dict[str, 'ConnectionPool'] = {}
+
+class ConnectionPool:
+    '''
+    Connection pool that survives warm invocations. Connections idle longer
+    than DB_PING_INTERVAL are checked with SELECT 1 and replaced if broken.
+    '''
+    
+    def __init__(self, dsn: str, maxconn: int, connect: Callable[[str], Any]):
+        self.dsn = dsn
+        self.maxconn = maxconn
+        self.connect = connect
+        self.idle: List[Tuple[Any, float]] = []
+        self.in_use = 0
+        self.cond = threading.Condition()
+    
+    def getconn(self) -> Any:
+        deadline = time.time() + DB_POOL_TIMEOUT
+        with self.cond:
+            while not self.idle and self.in_use >= self.maxconn:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise psycopg2.OperationalError('Connection pool exhausted')
+                self.cond.wait(remaining)
+            
+            conn, idle_since = self.idle.pop() if self.idle else (None, 0.0)
+            self.in_use += 1
+        
+        try:
+            if conn is not None and not self._is_alive(conn, idle_since):
+                self._close(conn)
+                conn = None
+            if conn is None:
+                conn = self.connect(self.dsn)
+            return conn
+        except Exception:
+            with self.cond:
+                self.in_use -= 1
+                self.cond.notify()
+            raise
+    
+    def putconn(self, conn: Any, discard: bool = False) -> None:
+        if not discard and not conn.closed:
+            try:
+                # Сбрасываем незавершённую транзакцию, чтобы следующий вызов начал с чистого листа
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+        
+        with self.cond:
+            self.in_use -= 1
+            if discard or conn.closed:
+                self._close(conn)
+            else:
+                self.idle.append((conn, time.time()))
+            self.cond.notify()
+    
+    def closeall(self) -> None:
+        with self.cond:
+            for conn, _ in self.idle:
+                self._close(conn)
+            self.idle = []
+    
+    def _is_alive(self, conn: Any, idle_since: float) -> bool:
+        if conn.closed:
+            return False
+        if time.time() - idle_since < DB_PING_INTERVAL:
+            return True
+        try:
+            cur = conn.cursor()
+            try:
+                cur.execute('SELECT 1')
+                cur.fetchone()
+            finally:
+                cur.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+    
+    @staticmethod
+    def _close(conn: Any) -> None:
+        try:
+            conn.close()
+        except psycopg2.Error:
+            pass
+
+def get_pool(dsn: str) -> ConnectionPool:
+    pool = _pools.get(dsn)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(dsn)
+            if pool is None:
+                pool = ConnectionPool(dsn, DB_POOL_MAX, _connection_factory)
+                _pools[dsn] = pool
+    return pool
+
+def get_connection(dsn: str) -> Any:
+    with span('db_connect'):
+        return get_pool(dsn).getconn()
+
+def release_connection(dsn: str, conn: Any) -> None:
+    get_pool(dsn).putconn(conn)
+
+def set_connection_factory(factory: Callable[[str], Any]) -> None:
+    global _connection_factory
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+        _connection_factory = factory
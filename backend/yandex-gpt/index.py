@@ -1,44 +1,23 @@
 import json
 import os
-import urllib.request
-import urllib.error
-import psycopg2
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Tuple
 
-def get_system_prompt(dsn: str) -> str:
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
-    try:
-        cur.execute(
-            "SELECT prompt_text FROM system_prompts WHERE ai_model = 'yandex-gpt' AND is_active = true ORDER BY created_at DESC LIMIT 1"
-        )
-        row = cur.fetchone()
-        return row[0] if row else "Ты - полезный ассистент."
-    finally:
-        cur.close()
-        conn.close()
-
-def get_knowledge_base(dsn: str) -> str:
-    conn = psycopg2.connect(dsn)
-    cur = conn.cursor()
-    try:
-        cur.execute("SELECT file_name, content FROM knowledge_base ORDER BY created_at DESC LIMIT 10")
-        rows = cur.fetchall()
-        if not rows:
-            return ""
-        
-        kb_text = "\n\nБаза знаний:\n"
-        for title, content in rows:
-            kb_text += f"\n## {title}\n{content}\n"
-        return kb_text
-    finally:
-        cur.close()
-        conn.close()
+from chat_history import collect_text, get_history, put_turns, valid_session_id
+from kb_search import estimate_tokens
+from llm_context import get_llm_contexts, last_user_text
+from llm_providers import Provider, failover_chain, with_failover, yandex_gpt_response, yandex_gpt_text
+from prompt_budget import assemble_prompt
+from provider_client import ProviderError
+from response_cache import cache_headers, cacheable_question, get_cache_version, get_cached_response, put_cached_response
+from streaming import STREAM_FORMATS, stream_response
+from timing import dumps, timed
+from usage_log import log_usage
 
+@timed('yandex-gpt')
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
     Business: YandexGPT API with system prompts and knowledge base
-    Args: event with httpMethod (POST, OPTIONS), body with messages array
+    Args: event with httpMethod (POST, OPTIONS), body with messages array, optional session_id (then only new messages), stream/stream_format
     Returns: YandexGPT response with assistant message
     '''
     method: str = event.get('httpMethod', 'GET')
@@ -74,51 +53,123 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     
     body_data = json.loads(event.get('body', '{}'))
     user_messages = body_data.get('messages', [])
+    stream = bool(body_data.get('stream'))
+    stream_format = body_data.get('stream_format', 'sse')
+    
+    if stream and stream_format not in STREAM_FORMATS:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Unsupported stream_format'})
+        }
+    
+    session_id = body_data.get('session_id')
+    if session_id is not None and not valid_session_id(session_id):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': 'Invalid session_id'})
+        }
     
-    system_prompt = get_system_prompt(dsn) if dsn else "Ты - полезный ассистент."
-    knowledge_base = get_knowledge_base(dsn) if dsn else ""
+    # С session_id клиент присылает только новое сообщение, историю читаем из БД
+    new_messages = user_messages
+    persist = bool(session_id and dsn)
+    if persist:
+        user_messages = get_history(dsn, session_id) + new_messages
     
-    messages = [
-        {'role': 'system', 'text': system_prompt + knowledge_base}
-    ] + user_messages
+    # Первый вопрос диалога ищем в кеше ответов; body.cache = false отключает кеш
+    question = cacheable_question(user_messages) if dsn and body_data.get('cache', True) else None
+    # Недоступная версия контекста (сбой БД) — отвечаем мимо кеша
+    context_version = get_cache_version(dsn, 'yandex-gpt') if question else None
+    if context_version is None:
+        question = None
+    cache_status = 'MISS' if question else 'BYPASS'
+    if question:
+        cached = get_cached_response(dsn, 'yandex-gpt', context_version, question)
+        if cached:
+            response_data, match = cached
+            if persist:
+                put_turns(dsn, session_id, 'yandex-gpt', new_messages, yandex_gpt_text(response_data))
+            log_usage(dsn, 'yandex-gpt', session_id, last_user_text(user_messages), yandex_gpt_text(response_data),
+                      {'requested': 'yandex-gpt', 'stream': stream, 'cache': 'HIT'})
+            if stream:
+                response = stream_response([yandex_gpt_text(response_data)], stream_format, {'cache': 'HIT'})
+            else:
+                response = {
+                    'statusCode': 200,
+                    'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                    'isBase64Encoded': False,
+                    'body': dumps(response_data)
+                }
+            response['headers'].update(cache_headers('HIT', match))
+            return response
     
-    request_payload = {
-        'modelUri': 'gpt://b1gfkd2baaso5298c7lt/yandexgpt-lite',
-        'completionOptions': {
-            'stream': False,
-            'temperature': 0.6,
-            'maxTokens': 2000
-        },
-        'messages': messages
-    }
+    query = last_user_text(user_messages)
+    # Если yandex-gpt недоступен (5xx, таймаут, открытый автомат), отвечает запасной провайдер
+    chain = failover_chain('yandex-gpt')
     
-    req = urllib.request.Request(
-        'https://llm.api.cloud.yandex.net/foundationModels/v1/completion',
-        data=json.dumps(request_payload).encode('utf-8'),
-        headers={
-            'Content-Type': 'application/json',
-            'Authorization': f'Api-Key {api_key}'
-        },
-        method='POST'
-    )
+    def prepare(provider: Provider) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        system_prompt, history, token_budget = assemble_prompt(provider.name, contexts[provider.name], user_messages)
+        return provider.payload(system_prompt, history, token_budget['max_tokens'], stream), token_budget
+    
+    def open_stream(provider: Provider) -> Tuple[Any, Dict[str, int]]:
+        request_payload, token_budget = prepare(provider)
+        return provider.open_stream(request_payload, provider.api_key()), token_budget
+    
+    def complete(provider: Provider) -> Tuple[Dict[str, Any], Dict[str, int]]:
+        request_payload, token_budget = prepare(provider)
+        return provider.complete(request_payload, provider.api_key()), token_budget
     
     try:
-        response = urllib.request.urlopen(req)
-        response_data = json.loads(response.read().decode('utf-8'))
+        # Контекст всей цепочки читается один раз до попыток: сбой БД не повод
+        # переключаться на запасного провайдера
+        contexts = get_llm_contexts(dsn, [provider.name for provider in chain], query)
+        if stream:
+            provider, (lines, token_budget) = with_failover(chain, open_stream)
+            parts: List[str] = []
+            response = stream_response(
+                collect_text(provider.deltas(lines), parts), stream_format,
+                {'token_budget': token_budget, 'provider': provider.name}
+            )
+            if persist:
+                put_turns(dsn, session_id, provider.name, new_messages, ''.join(parts))
+            log_usage(dsn, provider.name, session_id, query, ''.join(parts), {
+                'requested': 'yandex-gpt', 'stream': True, 'cache': cache_status, 'token_budget': token_budget
+            }, token_budget['prompt_tokens'], estimate_tokens(''.join(parts)))
+            response['headers'].update(cache_headers(cache_status))
+            return response
+        
+        provider, (response_data, token_budget) = with_failover(chain, complete)
+        answer = provider.text(response_data)
+        if provider.name != 'yandex-gpt':
+            # Ответ запасного провайдера приводим к привычному клиенту формату и не кешируем
+            response_data = yandex_gpt_response(answer)
+        elif question:
+            put_cached_response(dsn, 'yandex-gpt', context_version, question, response_data)
+        if persist:
+            put_turns(dsn, session_id, provider.name, new_messages, answer)
+        log_usage(dsn, provider.name, session_id, query, answer, {
+            'requested': 'yandex-gpt', 'stream': False, 'cache': cache_status, 'token_budget': token_budget
+        }, token_budget['prompt_tokens'], estimate_tokens(answer))
+        response_data['token_budget'] = token_budget
+        response_data['provider'] = provider.name
         
         return {
             'statusCode': 200,
             'headers': {
                 'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
+                'Access-Control-Allow-Origin': '*',
+                **cache_headers(cache_status)
             },
             'isBase64Encoded': False,
-            'body': json.dumps(response_data)
+            'body': dumps(response_data)
         }
-    except urllib.error.HTTPError as e:
-        error_body = e.read().decode('utf-8')
+    except ProviderError as e:
+        error_body = e.body
         return {
-            'statusCode': e.code,
+            'statusCode': e.status_code,
             'headers': {
                 'Content-Type': 'application/json',
                 'Access-Control-Allow-Origin': '*'
@@ -126,3 +177,13 @@ def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
             'isBase64Encoded': False,
             'body': json.dumps({'error': error_body})
         }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'headers': {
+                'Content-Type': 'application/json',
+                'Access-Control-Allow-Origin': '*'
+            },
+            'isBase64Encoded': False,
+            'body': json.dumps({'error': str(e)})
+        }
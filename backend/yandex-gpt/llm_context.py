@@ -0,0 +1,176 @@
+import hashlib
+import os
+import threading
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from db import get_connection, release_connection
+from kb_search import KnowledgeIndex, build_index, load_index
+from timing import span
+
+DEFAULT_SYSTEM_PROMPT = "Ты - полезный ассистент."
+CONTEXT_CACHE_TTL = float(os.environ.get('CONTEXT_CACHE_TTL', '60'))
+
+_context_lock = threading.Lock()
+_context_cache: Dict[str, Dict[str, Any]] = {}
+
+def get_context_version(conn: Any, ai_model: str) -> Tuple:
+    # Для промптов count ловит вставки, max(updated_at) — правки. Базу знаний
+    # описывает версия поискового индекса; пока полная переиндексация не
+    # выставила indexed, сверяем агрегаты по самой таблице
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            WITH state AS (
+                SELECT COALESCE((SELECT version FROM kb_index_state WHERE id = 1), 0) AS kb_version,
+                       COALESCE((SELECT indexed FROM kb_index_state WHERE id = 1), FALSE) AS kb_indexed
+            )
+            SELECT
+                (SELECT count(*) FROM system_prompts WHERE ai_model = %s),
+                (SELECT max(updated_at) FROM system_prompts WHERE ai_model = %s),
+                kb_version,
+                kb_indexed,
+                CASE WHEN kb_indexed THEN NULL
+                     ELSE (SELECT concat_ws('/', count(*), max(id), max(updated_at)) FROM knowledge_base)
+                END
+            FROM state
+            """,
+            (ai_model, ai_model)
+        )
+        return tuple(cur.fetchone())
+    finally:
+        cur.close()
+
+def load_context(conn: Any, ai_model: str, indexed: bool,
+                 with_kb: bool = True) -> Tuple[str, Optional[KnowledgeIndex]]:
+    # Активный промпт и фрагменты готового индекса (или сырые документы,
+    # если индекс ещё не построен) одним запросом; словарь индекса — вторым.
+    # with_kb=False читает только промпт, когда индекс уже загружен для другой модели
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            WITH prompt AS (
+                SELECT prompt_text FROM system_prompts
+                WHERE ai_model = %s AND is_active = true
+                ORDER BY created_at DESC LIMIT 1
+            )
+            SELECT 'prompt', NULL, NULL, NULL, prompt_text, NULL FROM prompt
+            UNION ALL
+            SELECT 'chunk', id, doc_id, title, chunk_text, term_count FROM kb_chunks WHERE %s
+            UNION ALL
+            SELECT 'doc', NULL, id, file_name, content, NULL FROM knowledge_base WHERE %s
+            """,
+            (ai_model, with_kb and indexed, with_kb and not indexed)
+        )
+        rows = cur.fetchall()
+        
+        postings = []
+        if with_kb and indexed:
+            cur.execute("SELECT term, chunk_id, tf FROM kb_postings")
+            postings = cur.fetchall()
+    finally:
+        cur.close()
+    
+    system_prompt = DEFAULT_SYSTEM_PROMPT
+    chunks = []
+    documents = []
+    for kind, chunk_id, doc_id, title, content, term_count in rows:
+        if kind == 'prompt':
+            system_prompt = content
+        elif kind == 'chunk':
+            chunks.append((chunk_id, doc_id, title, content, term_count))
+        else:
+            documents.append((doc_id, title, content))
+    
+    if not with_kb:
+        return system_prompt, None
+    index = load_index(chunks, postings) if indexed else build_index(documents)
+    return system_prompt, index
+
+def build_context_text(system_prompt: str, chunks: List[Dict[str, Any]]) -> str:
+    if not chunks:
+        return system_prompt
+    
+    kb_text = "\n\nБаза знаний:\n"
+    for chunk in chunks:
+        kb_text += f"\n## {chunk['title']}\n{chunk['text']}\n"
+    return system_prompt + kb_text
+
+def last_user_text(messages: List[Dict[str, Any]]) -> str:
+    for msg in reversed(messages):
+        if msg.get('role') == 'user':
+            return msg.get('text', msg.get('content', '')) or ''
+    return ''
+
+def _fresh_context(ai_model: str) -> Optional[Dict[str, Any]]:
+    entry = _context_cache.get(ai_model)
+    if entry and entry['checked_at'] + CONTEXT_CACHE_TTL > time.time():
+        return entry
+    return None
+
+def _shared_index(version: Tuple) -> Optional[KnowledgeIndex]:
+    # База знаний общая для всех моделей: если её версия совпадает с уже
+    # загруженной для другой модели, переиспользуем готовый индекс
+    for entry in _context_cache.values():
+        if entry['version'][2:] == version[2:]:
+            return entry['index']
+    return None
+
+def _refresh_context(conn: Any, ai_model: str) -> Dict[str, Any]:
+    version = get_context_version(conn, ai_model)
+    entry = _context_cache.get(ai_model)
+    if entry and entry['version'] == version:
+        entry['checked_at'] = time.time()
+        return entry
+    
+    index = _shared_index(version)
+    system_prompt, loaded = load_context(conn, ai_model, indexed=bool(version[3]), with_kb=index is None)
+    entry = {
+        'system_prompt': system_prompt,
+        'index': index or loaded,
+        'version': version,
+        'checked_at': time.time()
+    }
+    _context_cache[ai_model] = entry
+    return entry
+
+def _load_cached_contexts(dsn: str, ai_models: List[str]) -> List[Dict[str, Any]]:
+    # Внутри TTL тёплый инстанс не ходит в БД; после TTL сверяет версию
+    # и перечитывает строки, только если промпты или база знаний изменились.
+    # Все устаревшие модели проверяются на одном соединении из пула
+    if any(_fresh_context(ai_model) is None for ai_model in ai_models):
+        with _context_lock:
+            stale = [ai_model for ai_model in ai_models if _fresh_context(ai_model) is None]
+            if stale:
+                conn = get_connection(dsn)
+                try:
+                    for ai_model in stale:
+                        _refresh_context(conn, ai_model)
+                finally:
+                    release_connection(dsn, conn)
+    return [_context_cache[ai_model] for ai_model in ai_models]
+
+def get_llm_contexts(dsn: Optional[str], ai_models: List[str], query: str = '') -> Dict[str, str]:
+    if not dsn:
+        return {ai_model: DEFAULT_SYSTEM_PROMPT for ai_model in ai_models}
+    
+    # Фрагменты базы знаний ранжируются один раз на каждый различный индекс
+    selected: Dict[int, List[Dict[str, Any]]] = {}
+    contexts = {}
+    for ai_model, entry in zip(ai_models, _load_cached_contexts(dsn, ai_models)):
+        index: KnowledgeIndex = entry['index']
+        if id(index) not in selected:
+            with span('kb_search'):
+                selected[id(index)] = index.select_context(query)
+        contexts[ai_model] = build_context_text(entry['system_prompt'], selected[id(index)])
+    return contexts
+
+def get_context_version_key(dsn: str, ai_model: str) -> str:
+    # Короткий отпечаток версии промптов и базы знаний для ключа кеша ответов
+    entry = _load_cached_contexts(dsn, [ai_model])[0]
+    return hashlib.sha1(repr(entry['version']).encode('utf-8')).hexdigest()[:16]
+
+def get_llm_context(dsn: Optional[str], ai_model: str, query: str = '') -> str:
+    return get_llm_contexts(dsn, [ai_model], query)[ai_model]
@@ -0,0 +1,295 @@
+import asyncio
+import base64
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from provider_client import ProviderError, arequest, request, run, stream_lines
+from provider_health import aguarded, guarded, should_fail_over
+from timing import span
+
+YANDEX_GPT_URL = os.environ.get('YANDEX_GPT_URL', 'https://llm.api.cloud.yandex.net/foundationModels/v1/completion')
+YANDEX_GPT_MODEL_URI = os.environ.get('YANDEX_GPT_MODEL_URI', 'gpt://b1gfkd2baaso5298c7lt/yandexgpt-lite')
+GIGACHAT_OAUTH_URL = os.environ.get('GIGACHAT_OAUTH_URL', 'https://ngw.devices.sberbank.ru:9443/api/v2/oauth')
+GIGACHAT_API_URL = os.environ.get('GIGACHAT_API_URL', 'https://gigachat.devices.sberbank.ru/api/v1')
+
+TOKEN_REFRESH_MARGIN = 60
+TOKEN_DEFAULT_TTL = 1800
+
+_token_lock = threading.Lock()
+_token_cache: Dict[str, Any] = {'api_key': None, 'access_token': None, 'expires_at': 0.0}
+
+def yandex_gpt_payload(system_text: str, history: List[Dict[str, str]],
+                       max_tokens: int, stream: bool = False) -> Dict[str, Any]:
+    return {
+        'modelUri': YANDEX_GPT_MODEL_URI,
+        'completionOptions': {
+            'stream': stream,
+            'temperature': 0.6,
+            'maxTokens': max_tokens
+        },
+        'messages': [{'role': 'system', 'text': system_text}] + history
+    }
+
+def _yandex_headers(api_key: str) -> Dict[str, str]:
+    return {'Authorization': f'Api-Key {api_key}'}
+
+async def acall_yandex_gpt(request_payload: Dict[str, Any], api_key: str,
+                           timeout: Optional[float] = None) -> Dict[str, Any]:
+    response = await arequest(
+        'POST', YANDEX_GPT_URL, timeout=timeout, json=request_payload, headers=_yandex_headers(api_key)
+    )
+    if response.status_code != 200:
+        raise ProviderError(response.status_code, response.text)
+    return response.json()
+
+def call_yandex_gpt(request_payload: Dict[str, Any], api_key: str,
+                    timeout: Optional[float] = None) -> Dict[str, Any]:
+    return run(acall_yandex_gpt(request_payload, api_key, timeout))
+
+def stream_yandex_gpt(request_payload: Dict[str, Any], api_key: str,
+                      timeout: Optional[float] = None) -> Iterator[str]:
+    return stream_lines(
+        'POST', YANDEX_GPT_URL, timeout=timeout, json=request_payload, headers=_yandex_headers(api_key)
+    )
+
+def iter_yandex_deltas(lines: Iterable[str]) -> Iterator[str]:
+    # В потоковом режиме каждая строка содержит весь текст на текущий момент
+    sent = ''
+    for line in lines:
+        alternatives = json.loads(line).get('result', {}).get('alternatives') or []
+        if not alternatives:
+            continue
+        text = alternatives[0].get('message', {}).get('text', '')
+        if len(text) > len(sent) and text.startswith(sent):
+            yield text[len(sent):]
+            sent = text
+
+def yandex_gpt_text(response_data: Dict[str, Any]) -> str:
+    alternatives = response_data.get('result', {}).get('alternatives') or [{}]
+    return alternatives[0].get('message', {}).get('text', '')
+
+def fetch_gigachat_token(api_key: str) -> Tuple[str, float]:
+    auth_data = base64.b64encode(api_key.encode()).decode()
+    
+    with span('oauth'):
+        response = request(
+            'POST',
+            GIGACHAT_OAUTH_URL,
+            verify=False,
+            data={'scope': 'GIGACHAT_API_PERS'},
+            headers={
+                'Accept': 'application/json',
+                'RqUID': str(uuid.uuid4()),
+                'Authorization': f'Basic {auth_data}'
+            }
+        )
+    if response.status_code != 200:
+        raise ProviderError(response.status_code, response.text)
+    data = response.json()
+    
+    # expires_at приходит в миллисекундах с начала эпохи
+    expires_at = data.get('expires_at')
+    if expires_at:
+        expires_at = expires_at / 1000 if expires_at > 10 ** 11 else float(expires_at)
+    else:
+        expires_at = time.time() + TOKEN_DEFAULT_TTL
+    return data['access_token'], expires_at
+
+def _cached_token(api_key: str) -> Optional[str]:
+    if _token_cache['api_key'] != api_key or not _token_cache['access_token']:
+        return None
+    if _token_cache['expires_at'] - TOKEN_REFRESH_MARGIN <= time.time():
+        return None
+    return _token_cache['access_token']
+
+def get_gigachat_token(api_key: str) -> str:
+    token = _cached_token(api_key)
+    if token:
+        return token
+    
+    # Один поток обновляет токен, остальные ждут и берут результат из кеша
+    with _token_lock:
+        token = _cached_token(api_key)
+        if token:
+            return token
+        
+        token, expires_at = fetch_gigachat_token(api_key)
+        _token_cache.update({'api_key': api_key, 'access_token': token, 'expires_at': expires_at})
+        return token
+
+def invalidate_gigachat_token(access_token: str) -> None:
+    with _token_lock:
+        if _token_cache['access_token'] == access_token:
+            _token_cache.update({'access_token': None, 'expires_at': 0.0})
+
+async def _aget_gigachat_token(api_key: str) -> str:
+    # Получение токена блокирующее, поэтому уводим его из event loop в пул потоков;
+    # контекст копируем, чтобы время OAuth попало в замеры текущего запроса
+    return _cached_token(api_key) or await asyncio.get_running_loop().run_in_executor(
+        None, contextvars.copy_context().run, get_gigachat_token, api_key
+    )
+
+def gigachat_payload(system_text: str, history: List[Dict[str, str]],
+                     max_tokens: int, stream: bool = False) -> Dict[str, Any]:
+    messages = [{'role': 'system', 'content': system_text}]
+    for msg in history:
+        messages.append({'role': msg['role'], 'content': msg['text']})
+    return {
+        'model': 'GigaChat',
+        'messages': messages,
+        'temperature': 0.7,
+        'max_tokens': max_tokens,
+        'stream': stream
+    }
+
+def _gigachat_headers(access_token: str) -> Dict[str, str]:
+    return {'Accept': 'application/json', 'Authorization': f'Bearer {access_token}'}
+
+async def _apost_gigachat(request_payload: Dict[str, Any], access_token: str,
+                          timeout: Optional[float] = None) -> Any:
+    return await arequest(
+        'POST',
+        f'{GIGACHAT_API_URL}/chat/completions',
+        verify=False,
+        timeout=timeout,
+        json=request_payload,
+        headers=_gigachat_headers(access_token)
+    )
+
+async def acall_gigachat(request_payload: Dict[str, Any], api_key: str,
+                         timeout: Optional[float] = None) -> Dict[str, Any]:
+    # Протухший токен (401) сбрасываем и повторяем запрос один раз
+    access_token = await _aget_gigachat_token(api_key)
+    response = await _apost_gigachat(request_payload, access_token, timeout)
+    if response.status_code == 401:
+        invalidate_gigachat_token(access_token)
+        response = await _apost_gigachat(request_payload, await _aget_gigachat_token(api_key), timeout)
+    if response.status_code != 200:
+        raise ProviderError(response.status_code, response.text)
+    return response.json()
+
+def call_gigachat(request_payload: Dict[str, Any], api_key: str,
+                  timeout: Optional[float] = None) -> Dict[str, Any]:
+    return run(acall_gigachat(request_payload, api_key, timeout))
+
+def _open_gigachat_stream(request_payload: Dict[str, Any], access_token: str,
+                          timeout: Optional[float] = None) -> Iterator[str]:
+    return stream_lines(
+        'POST',
+        f'{GIGACHAT_API_URL}/chat/completions',
+        verify=False,
+        timeout=timeout,
+        json=request_payload,
+        headers=_gigachat_headers(access_token)
+    )
+
+def stream_gigachat(request_payload: Dict[str, Any], api_key: str,
+                    timeout: Optional[float] = None) -> Iterator[str]:
+    access_token = get_gigachat_token(api_key)
+    try:
+        return _open_gigachat_stream(request_payload, access_token, timeout)
+    except ProviderError as e:
+        if e.status_code != 401:
+            raise
+        invalidate_gigachat_token(access_token)
+        return _open_gigachat_stream(request_payload, get_gigachat_token(api_key), timeout)
+
+def iter_gigachat_deltas(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        if not line.startswith('data:'):
+            continue
+        payload = line[len('data:'):].strip()
+        if payload == '[DONE]':
+            break
+        for choice in json.loads(payload).get('choices', []):
+            content = choice.get('delta', {}).get('content')
+            if content:
+                yield content
+
+def gigachat_text(response_data: Dict[str, Any]) -> str:
+    choices = response_data.get('choices') or [{}]
+    return choices[0].get('message', {}).get('content', '')
+
+def yandex_gpt_response(text: str) -> Dict[str, Any]:
+    return {'result': {'alternatives': [{'message': {'role': 'assistant', 'text': text}, 'status': 'ALTERNATIVE_STATUS_FINAL'}]}}
+
+def gigachat_response(text: str) -> Dict[str, Any]:
+    return {'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}]}
+
+class Provider:
+    '''
+    Everything needed to run one completion against a provider: where its
+    key lives, how to build the request and how to read the answer back.
+    '''
+    
+    def __init__(self, name: str, api_key_env: str,
+                 payload: Callable[..., Dict[str, Any]],
+                 acall: Callable[..., Any],
+                 text: Callable[[Dict[str, Any]], str],
+                 stream: Callable[..., Iterator[str]],
+                 deltas: Callable[[Iterable[str]], Iterator[str]],
+                 response: Callable[[str], Dict[str, Any]]) -> None:
+        self.name = name
+        self.api_key_env = api_key_env
+        self.payload = payload
+        self.acall = acall
+        self.text = text
+        self.stream = stream
+        self.deltas = deltas
+        self.response = response
+    
+    def api_key(self) -> Optional[str]:
+        return os.environ.get(self.api_key_env)
+    
+    async def acomplete(self, request_payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        return await aguarded(self.name, lambda timeout: self.acall(request_payload, api_key, timeout))
+    
+    def complete(self, request_payload: Dict[str, Any], api_key: str) -> Dict[str, Any]:
+        return run(self.acomplete(request_payload, api_key))
+    
+    def open_stream(self, request_payload: Dict[str, Any], api_key: str) -> Iterator[str]:
+        # Время до первой строки потока не сравнимо с полным ответом,
+        # поэтому в статистику задержек оно не идёт
+        return guarded(
+            self.name, lambda timeout: self.stream(request_payload, api_key, timeout), sample=False
+        )
+
+PROVIDERS: Dict[str, Provider] = {
+    'yandex-gpt': Provider(
+        'yandex-gpt', 'YANDEX_GPT_API_KEY', yandex_gpt_payload, acall_yandex_gpt, yandex_gpt_text,
+        stream_yandex_gpt, iter_yandex_deltas, yandex_gpt_response
+    ),
+    'gigachat': Provider(
+        'gigachat', 'GIGACHAT_API_KEY', gigachat_payload, acall_gigachat, gigachat_text,
+        stream_gigachat, iter_gigachat_deltas, gigachat_response
+    ),
+}
+
+FAILOVER: Dict[str, str] = {'gigachat': 'yandex-gpt', 'yandex-gpt': 'gigachat'}
+
+def failover_chain(primary: str) -> List[Provider]:
+    # Запасной провайдер участвует, только если для него настроен ключ
+    chain = [PROVIDERS[primary]]
+    fallback = PROVIDERS.get(FAILOVER.get(primary, ''))
+    if fallback and fallback.api_key():
+        chain.append(fallback)
+    return chain
+
+def with_failover(chain: List[Provider], attempt: Callable[[Provider], Any]) -> Tuple[Provider, Any]:
+    '''
+    Run attempt(provider) down the chain until one succeeds. Moves on only
+    when the provider itself failed (5xx, 429, network, open circuit);
+    a rejected request or any other error is raised straight away.
+    '''
+    for index, provider in enumerate(chain):
+        try:
+            return provider, attempt(provider)
+        except Exception as e:
+            if index == len(chain) - 1 or not should_fail_over(e):
+                raise
+    raise ValueError('Empty provider chain')
@@ -0,0 +1,98 @@
+import os
+import re
+from typing import Dict, Any, List, Tuple
+
+from kb_search import estimate_tokens
+
+MODEL_CONTEXT_TOKENS = {
+    'yandex-gpt': int(os.environ.get('YANDEX_GPT_CONTEXT_TOKENS', '8000')),
+    'gigachat': int(os.environ.get('GIGACHAT_CONTEXT_TOKENS', '8000')),
+}
+COMPLETION_TOKENS = int(os.environ.get('COMPLETION_TOKENS', '2000'))
+MIN_COMPLETION_TOKENS = 256
+SUMMARY_TOKENS = int(os.environ.get('HISTORY_SUMMARY_TOKENS', '300'))
+SUMMARY_LINE_CHARS = 160
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_HEADER = "\n\nКраткое содержание начала диалога:\n"
+FIRST_SENTENCE_RE = re.compile(r'^(.+?[.!?…])(\s|$)', re.S)
+
+def normalize_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, str]]:
+    return [
+        {'role': msg.get('role', 'user'), 'text': msg.get('text', msg.get('content', '')) or ''}
+        for msg in messages
+        if msg.get('role') in ('user', 'assistant')
+    ]
+
+def _message_tokens(msg: Dict[str, str]) -> int:
+    return estimate_tokens(msg['text']) + MESSAGE_OVERHEAD_TOKENS
+
+def _fit_recent(turns: List[Dict[str, str]], budget: int) -> Tuple[List[Dict[str, str]], int]:
+    # Последнюю реплику оставляем всегда, более ранние — пока влезают в бюджет
+    kept: List[Dict[str, str]] = []
+    used = 0
+    for msg in reversed(turns):
+        tokens = _message_tokens(msg)
+        if kept and used + tokens > budget:
+            break
+        kept.append(msg)
+        used += tokens
+    kept.reverse()
+    return kept, used
+
+def summarize_turns(turns: List[Dict[str, str]], token_budget: int) -> str:
+    # Экстрактивная сводка без вызова LLM: первое предложение каждой реплики,
+    # от самых свежих к старым, пока помещается в бюджет
+    lines: List[str] = []
+    used = estimate_tokens(SUMMARY_HEADER)
+    for msg in reversed(turns):
+        text = ' '.join(msg['text'].split())
+        match = FIRST_SENTENCE_RE.match(text)
+        line = (match.group(1) if match else text)[:SUMMARY_LINE_CHARS]
+        if not line:
+            continue
+        line = f"{'Пользователь' if msg['role'] == 'user' else 'Ассистент'}: {line}"
+        tokens = estimate_tokens(line)
+        if used + tokens > token_budget:
+            break
+        lines.append(line)
+        used += tokens
+    if not lines:
+        return ''
+    return SUMMARY_HEADER + '\n'.join(reversed(lines))
+
+def assemble_prompt(ai_model: str, system_text: str,
+                    messages: List[Dict[str, Any]]) -> Tuple[str, List[Dict[str, str]], Dict[str, int]]:
+    '''
+    Fit system prompt, knowledge base and the most recent turns into the
+    model context window. Older turns that do not fit are folded into a short
+    extractive summary appended to the system text.
+    '''
+    context_tokens = MODEL_CONTEXT_TOKENS.get(ai_model, 8000)
+    turns = normalize_messages(messages)
+    system_tokens = estimate_tokens(system_text) + MESSAGE_OVERHEAD_TOKENS
+    history_budget = context_tokens - COMPLETION_TOKENS - system_tokens
+    
+    kept, history_tokens = _fit_recent(turns, history_budget)
+    if len(kept) < len(turns):
+        # Всё не влезло: оставляем место под сводку и подбираем хвост заново
+        kept, history_tokens = _fit_recent(turns, history_budget - SUMMARY_TOKENS)
+    
+    dropped = turns[:len(turns) - len(kept)]
+    summary = summarize_turns(dropped, SUMMARY_TOKENS) if dropped else ''
+    summary_tokens = estimate_tokens(summary) if summary else 0
+    
+    prompt_tokens = system_tokens + summary_tokens + history_tokens
+    max_tokens = max(MIN_COMPLETION_TOKENS, min(COMPLETION_TOKENS, context_tokens - prompt_tokens))
+    
+    accounting = {
+        'context_tokens': context_tokens,
+        'prompt_tokens': prompt_tokens,
+        'system_tokens': system_tokens,
+        'summary_tokens': summary_tokens,
+        'history_tokens': history_tokens,
+        'kept_messages': len(kept),
+        'dropped_messages': len(dropped),
+        'max_tokens': max_tokens,
+    }
+    return system_text + summary, kept, accounting
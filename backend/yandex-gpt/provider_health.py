@@ -0,0 +1,174 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Any, Awaitable, Callable, Deque, Optional, TypeVar
+
+import httpx
+
+from provider_client import PROVIDER_READ_TIMEOUT, ProviderError
+
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_COOLDOWN = float(os.environ.get('BREAKER_COOLDOWN', '30'))
+ADAPTIVE_TIMEOUT_FACTOR = float(os.environ.get('ADAPTIVE_TIMEOUT_FACTOR', '3'))
+ADAPTIVE_TIMEOUT_MIN = float(os.environ.get('ADAPTIVE_TIMEOUT_MIN', '5'))
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 10
+LATENCY_WINDOW = 50
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+T = TypeVar('T')
+
+class CircuitOpenError(ProviderError):
+    def __init__(self, provider: str, retry_after: float):
+        super().__init__(503, f'{provider} is unavailable, retry in {retry_after:.0f}s')
+        self.provider = provider
+        self.retry_after = retry_after
+
+def is_provider_failure(error: BaseException) -> bool:
+    # Ошибка запроса (4xx, кроме 429) говорит о нас, а не о здоровье провайдера;
+    # прочие исключения (БД, ошибки в нашем коде) запасной провайдер не исправит
+    if isinstance(error, ProviderError):
+        return error.status_code >= 500 or error.status_code == 429
+    return isinstance(error, httpx.TransportError)
+
+class ProviderHealth:
+    '''
+    Circuit breaker and latency tracker for one upstream. After
+    BREAKER_FAILURE_THRESHOLD consecutive failures the circuit opens and
+    calls fail fast; after BREAKER_COOLDOWN a single probe is let through
+    and its outcome closes or reopens the circuit.
+    '''
+    
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.latencies: Deque[float] = deque(maxlen=LATENCY_WINDOW)
+        self.stats: Dict[str, int] = {'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+        self.lock = threading.Lock()
+    
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + BREAKER_COOLDOWN - time.monotonic())
+    
+    def allow(self) -> bool:
+        with self.lock:
+            if self.state == OPEN and self.retry_after() <= 0:
+                self.state = HALF_OPEN
+            if self.state == HALF_OPEN and not self.probing:
+                self.probing = True
+                return True
+            if self.state == CLOSED:
+                return True
+            self.stats['rejected'] += 1
+            return False
+    
+    def timeout(self) -> float:
+        # Таймаут подстраивается под p95 последних ответов: зависший провайдер
+        # отваливается за секунды, а не держит слот до таймаута платформы
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+            return PROVIDER_READ_TIMEOUT
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return min(PROVIDER_READ_TIMEOUT, max(ADAPTIVE_TIMEOUT_MIN, p95 * ADAPTIVE_TIMEOUT_FACTOR))
+    
+    def record_success(self, latency: Optional[float]) -> None:
+        with self.lock:
+            if latency is not None:
+                self.latencies.append(latency)
+            self.state = CLOSED
+            self.failures = 0
+            self.probing = False
+            self.stats['successes'] += 1
+    
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.stats['failures'] += 1
+            if self.state == HALF_OPEN or self.failures >= BREAKER_FAILURE_THRESHOLD:
+                if self.state != OPEN:
+                    self.stats['opened'] += 1
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+            self.probing = False
+    
+    def release(self) -> None:
+        # Вызов отменён до результата: пробный слот освобождаем без вердикта
+        with self.lock:
+            self.probing = False
+    
+    def record(self, started: float, error: Optional[BaseException], sample: bool = True) -> None:
+        if error is None:
+            self.record_success(time.monotonic() - started if sample else None)
+        elif not isinstance(error, Exception):
+            self.release()
+        elif is_provider_failure(error):
+            self.record_failure()
+        else:
+            self.record_success(None)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self.lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.failures,
+                'retry_after': round(self.retry_after(), 1) if self.state == OPEN else 0,
+                'latency_samples': len(self.latencies),
+                **self.stats
+            }
+
+_health_lock = threading.Lock()
+_health: Dict[str, ProviderHealth] = {}
+
+def get_health(name: str) -> ProviderHealth:
+    with _health_lock:
+        health = _health.get(name)
+        if health is None:
+            health = _health[name] = ProviderHealth(name)
+        return health
+
+def get_health_snapshot() -> Dict[str, Dict[str, Any]]:
+    with _health_lock:
+        names = sorted(_health)
+    return {name: get_health(name).snapshot() for name in names}
+
+def guarded(name: str, call: Callable[[float], T], sample: bool = True) -> T:
+    '''
+    Run call(timeout) through the named provider's circuit breaker.
+    Raises CircuitOpenError without calling when the circuit is open.
+    sample=False records the outcome but not the latency.
+    '''
+    health = get_health(name)
+    if not health.allow():
+        raise CircuitOpenError(name, health.retry_after())
+    started = time.monotonic()
+    error: Optional[BaseException] = None
+    try:
+        return call(health.timeout())
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        health.record(started, error, sample)
+
+async def aguarded(name: str, call: Callable[[float], Awaitable[T]]) -> T:
+    health = get_health(name)
+    if not health.allow():
+        raise CircuitOpenError(name, health.retry_after())
+    started = time.monotonic()
+    error: Optional[BaseException] = None
+    try:
+        return await call(health.timeout())
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        health.record(started, error)
+
+def should_fail_over(error: BaseException) -> bool:
+    return isinstance(error, Exception) and is_provider_failure(error)
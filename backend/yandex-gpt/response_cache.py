@@ -0,0 +1,171 @@
+import hashlib
+import json
+import os
+import random
+from typing import Dict, Any, List, Optional, Tuple
+
+import psycopg2
+
+from db import get_connection, release_connection
+from kb_search import STOP_WORDS, WORD_RE, stem_russian, tokenize
+from llm_context import get_context_version_key
+
+RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', '86400'))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '5000'))
+RESPONSE_CACHE_SIMILARITY = float(os.environ.get('RESPONSE_CACHE_SIMILARITY', '0.8'))
+# Вытеснение запускается в среднем раз на RESPONSE_CACHE_EVICT_EVERY вставок
+RESPONSE_CACHE_EVICT_EVERY = int(os.environ.get('RESPONSE_CACHE_EVICT_EVERY', '20'))
+RESPONSE_CACHE_CANDIDATES = 20
+
+# Вопросительные слова и отрицания меняют смысл вопроса, хотя в поиске по базе знаний
+# это стоп-слова: «Можно оплатить картой?» и «Нельзя оплатить картой?» — разные вопросы
+QUESTION_WORDS = frozenset(
+    'когда где кто что как какой какая какое какие куда откуда зачем почему сколько чей '
+    'можно нельзя не нет ни никогда ничего'.split()
+)
+SHINGLE_STOP_WORDS = STOP_WORDS - QUESTION_WORDS
+QUESTION_MARKERS = frozenset(stem_russian(word) for word in QUESTION_WORDS)
+
+def normalize_question(text: str) -> str:
+    return ' '.join(WORD_RE.findall(text.lower()))
+
+def question_shingles(text: str) -> List[str]:
+    # Основы слов без служебных (вопросительные и отрицания остаются) плюс биграммы: «Сколько стоит консультация?»
+    # и «а сколько стоят консультации» дают одинаковый набор
+    terms = tokenize(text, SHINGLE_STOP_WORDS)
+    return sorted(set(terms) | {f'{a} {b}' for a, b in zip(terms, terms[1:])})
+
+def _hash(normalized: str) -> str:
+    return hashlib.sha256(normalized.encode('utf-8')).hexdigest()
+
+def _jaccard(a: List[str], b: List[str]) -> float:
+    a_set, b_set = set(a), set(b)
+    if not a_set or not b_set:
+        return 0.0
+    return len(a_set & b_set) / len(a_set | b_set)
+
+def _same_markers(a: List[str], b: List[str]) -> bool:
+    # В длинном вопросе одно отличающееся слово почти не снижает сходство,
+    # поэтому вопросительные слова и отрицания должны совпадать точно
+    return QUESTION_MARKERS.intersection(a) == QUESTION_MARKERS.intersection(b)
+
+def cacheable_question(messages: List[Dict[str, Any]]) -> Optional[str]:
+    # Кешируем только первый вопрос диалога: ответ на уточнение зависит от истории
+    turns = [msg for msg in messages if msg.get('role') in ('user', 'assistant')]
+    if len(turns) != 1 or turns[0].get('role') != 'user':
+        return None
+    text = turns[0].get('text', turns[0].get('content', '')) or ''
+    return text if normalize_question(text) else None
+
+def cache_headers(status: str, match: Optional[str] = None) -> Dict[str, str]:
+    headers = {'X-Cache': status, 'Access-Control-Expose-Headers': 'X-Cache, X-Cache-Match'}
+    if match:
+        headers['X-Cache-Match'] = match
+    return headers
+
+def lookup_response(conn: Any, ai_model: str, context_version: str,
+                    question: str) -> Optional[Tuple[Dict[str, Any], str]]:
+    question_hash = _hash(normalize_question(question))
+    shingles = question_shingles(question)
+    cur = conn.cursor()
+    try:
+        # Точное совпадение и кандидаты в почти-дубликаты одним запросом
+        cur.execute(
+            """
+            SELECT id, question_hash = %s, shingles, response FROM llm_response_cache
+            WHERE ai_model = %s AND context_version = %s AND expires_at > CURRENT_TIMESTAMP
+              AND (question_hash = %s OR shingles && %s::text[])
+            ORDER BY question_hash = %s DESC, last_hit_at DESC
+            LIMIT %s
+            """,
+            (question_hash, ai_model, context_version, question_hash, shingles,
+             question_hash, RESPONSE_CACHE_CANDIDATES)
+        )
+        best = None
+        for entry_id, exact, entry_shingles, response in cur.fetchall():
+            if exact:
+                best = (1.0, entry_id, response, 'exact')
+                break
+            if not _same_markers(shingles, entry_shingles):
+                continue
+            score = _jaccard(shingles, entry_shingles)
+            if score >= RESPONSE_CACHE_SIMILARITY and (best is None or score > best[0]):
+                best = (score, entry_id, response, 'near')
+        if best is None:
+            return None
+        
+        cur.execute(
+            "UPDATE llm_response_cache SET hit_count = hit_count + 1, last_hit_at = CURRENT_TIMESTAMP WHERE id = %s",
+            (best[1],)
+        )
+        conn.commit()
+    finally:
+        cur.close()
+    
+    response = best[2] if isinstance(best[2], dict) else json.loads(best[2])
+    return response, best[3]
+
+def store_response(conn: Any, ai_model: str, context_version: str,
+                   question: str, response: Dict[str, Any]) -> None:
+    normalized = normalize_question(question)
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            """
+            INSERT INTO llm_response_cache
+                (ai_model, context_version, question_hash, question, shingles, response, expires_at)
+            VALUES (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+            ON CONFLICT (ai_model, context_version, question_hash) DO UPDATE
+            SET response = EXCLUDED.response, expires_at = EXCLUDED.expires_at,
+                last_hit_at = CURRENT_TIMESTAMP
+            """,
+            (ai_model, context_version, _hash(normalized), normalized, question_shingles(question),
+             json.dumps(response, ensure_ascii=False), RESPONSE_CACHE_TTL)
+        )
+        # Вытесняем просроченные записи и давно не востребованные сверх лимита (LRU).
+        # Сортировка всей таблицы дорогая, поэтому только на выборке вставок:
+        # лимит превышается не больше чем на несколько десятков записей
+        if random.random() * RESPONSE_CACHE_EVICT_EVERY < 1:
+            cur.execute(
+                """
+                DELETE FROM llm_response_cache
+                WHERE expires_at <= CURRENT_TIMESTAMP
+                   OR id IN (SELECT id FROM llm_response_cache ORDER BY last_hit_at DESC OFFSET %s)
+                """,
+                (RESPONSE_CACHE_MAX_ENTRIES,)
+            )
+        conn.commit()
+    finally:
+        cur.close()
+
+def get_cache_version(dsn: str, ai_model: str) -> Optional[str]:
+    # None — версию контекста узнать не удалось, запрос идёт мимо кеша
+    try:
+        return get_context_version_key(dsn, ai_model)
+    except psycopg2.Error:
+        return None
+
+def get_cached_response(dsn: str, ai_model: str, context_version: str,
+                        question: str) -> Optional[Tuple[Dict[str, Any], str]]:
+    # Недоступный кеш не должен ломать чат: ошибка БД считается промахом
+    conn = None
+    try:
+        conn = get_connection(dsn)
+        return lookup_response(conn, ai_model, context_version, question)
+    except psycopg2.Error:
+        return None
+    finally:
+        if conn is not None:
+            release_connection(dsn, conn)
+
+def put_cached_response(dsn: str, ai_model: str, context_version: str,
+                        question: str, response: Dict[str, Any]) -> None:
+    conn = None
+    try:
+        conn = get_connection(dsn)
+        store_response(conn, ai_model, context_version, question, response)
+    except psycopg2.Error:
+        pass
+    finally:
+        if conn is not None:
+            release_connection(dsn, conn)
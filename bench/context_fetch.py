@@ -0,0 +1,157 @@
+'''
+Micro-benchmark: LLM context loading, old path vs single round-trip.
+
+Old path: get_system_prompt + get_knowledge_base, each with its own
+psycopg2.connect/query/close. New path: load_context on a pooled
+connection, one query.
+
+By default runs against fake connections with simulated network latency
+(--rtt-ms per round-trip, --connect-rtts round-trips per connect for
+TCP + TLS + auth). With --dsn it runs against a real Postgres.
+
+    python bench/context_fetch.py --iterations 200 --rtt-ms 2
+    python bench/context_fetch.py --dsn "$DATABASE_URL"
+'''
+import argparse
+import os
+import sys
+import time
+from typing import Any, Callable, Dict, List, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'backend', 'yandex-gpt'))
+
+import db  # noqa: E402
+import llm_context  # noqa: E402
+
+AI_MODEL = 'yandex-gpt'
+
+class Counter:
+    def __init__(self) -> None:
+        self.connects = 0
+        self.queries = 0
+
+class FakeCursor:
+    def __init__(self, counter: Counter, rtt: float):
+        self.counter = counter
+        self.rtt = rtt
+        self.rows: List[tuple] = []
+    
+    def execute(self, sql: str, params: Any = None) -> None:
+        self.counter.queries += 1
+        time.sleep(self.rtt)
+        if 'UNION ALL' in sql:
+            self.rows = [('prompt', None, None, None, 'Prompt', None)] + [('doc', None, i, f'Doc {i}', 'Text', None) for i in range(10)]
+        elif 'prompt_text' in sql:
+            self.rows = [('Prompt',)]
+        else:
+            self.rows = [(f'Doc {i}', 'Text') for i in range(10)]
+    
+    def fetchone(self) -> Any:
+        return self.rows[0] if self.rows else None
+    
+    def fetchall(self) -> List[tuple]:
+        return self.rows
+    
+    def close(self) -> None:
+        pass
+
+class FakeConnection:
+    closed = 0
+    
+    def __init__(self, counter: Counter, rtt: float, connect_rtts: int):
+        self.counter = counter
+        self.rtt = rtt
+        counter.connects += 1
+        time.sleep(rtt * connect_rtts)
+    
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self.counter, self.rtt)
+    
+    def rollback(self) -> None:
+        pass
+    
+    def close(self) -> None:
+        pass
+
+def legacy_fetch(connect: Callable[[str], Any], dsn: str) -> Tuple[str, List[tuple]]:
+    conn = connect(dsn)
+    cur = conn.cursor()
+    try:
+        cur.execute(
+            "SELECT prompt_text FROM system_prompts WHERE ai_model = %s AND is_active = true ORDER BY created_at DESC LIMIT 1",
+            (AI_MODEL,)
+        )
+        row = cur.fetchone()
+        system_prompt = row[0] if row else llm_context.DEFAULT_SYSTEM_PROMPT
+    finally:
+        cur.close()
+        conn.close()
+    
+    conn = connect(dsn)
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT file_name, content FROM knowledge_base ORDER BY created_at DESC LIMIT 10")
+        documents = cur.fetchall()
+    finally:
+        cur.close()
+        conn.close()
+    return system_prompt, documents
+
+def single_fetch(connect: Callable[[str], Any], dsn: str) -> Tuple[str, Any]:
+    conn = db.get_connection(dsn)
+    try:
+        return llm_context.load_context(conn, AI_MODEL, indexed=False)
+    finally:
+        db.release_connection(dsn, conn)
+
+def run(name: str, fn: Callable, connect: Callable[[str], Any], dsn: str,
+        iterations: int, counter: Counter) -> Dict[str, float]:
+    counter.connects = counter.queries = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        fn(connect, dsn)
+    elapsed = time.perf_counter() - started
+    return {
+        'name': name,
+        'ms_per_call': elapsed / iterations * 1000,
+        'connects_per_call': counter.connects / iterations,
+        'queries_per_call': counter.queries / iterations,
+    }
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--rtt-ms', type=float, default=2.0)
+    parser.add_argument('--connect-rtts', type=int, default=4)
+    parser.add_argument('--dsn', default=None)
+    args = parser.parse_args()
+    
+    counter = Counter()
+    if args.dsn:
+        import psycopg2
+        
+        def connect(dsn: str) -> Any:
+            counter.connects += 1
+            return psycopg2.connect(dsn)
+        dsn = args.dsn
+    else:
+        def connect(dsn: str) -> Any:
+            return FakeConnection(counter, args.rtt_ms / 1000, args.connect_rtts)
+        dsn = 'fake://bench'
+    
+    db.set_connection_factory(connect)
+    results = [
+        run('legacy (2 connects, 2 queries)', legacy_fetch, connect, dsn, args.iterations, counter),
+        run('load_context (pooled, 1 query)', single_fetch, connect, dsn, args.iterations, counter),
+    ]
+    
+    print(f"{'path':34} {'ms/call':>9} {'connects':>9} {'queries':>8}")
+    for r in results:
+        print(f"{r['name']:34} {r['ms_per_call']:9.2f} {r['connects_per_call']:9.2f} {r['queries_per_call']:8.2f}")
+    legacy, single = results
+    print(f"\nsaved per call: {legacy['ms_per_call'] - single['ms_per_call']:.2f} ms, "
+          f"{legacy['connects_per_call'] - single['connects_per_call']:.2f} connects, "
+          f"{legacy['queries_per_call'] - single['queries_per_call']:.2f} queries")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,476 @@
+'''
+Load test: drive every backend handler with synthetic events.
+
+Each function runs in its own worker process (the functions ship
+same-named modules: db, timing, provider_client, ...) and imports
+backend/<function>/index.py directly. Yandex and Sber endpoints are
+served by a local stub with injected latency and errors; Postgres is a
+fake connection with per-query latency, or a real one with --dsn.
+
+Reports req/s, p50/p95/p99 latency and peak allocation per request for
+each scenario. --save stores the results as a baseline, --baseline
+compares against one and exits with 1 on a regression over --threshold.
+
+    python bench/handlers.py --requests 200 --concurrency 8
+    python bench/handlers.py --only gigachat,speech --latency-ms 80 --error-rate 0.05
+    python bench/handlers.py --save bench/baseline.json
+    python bench/handlers.py --baseline bench/baseline.json --threshold 0.15
+'''
+import argparse
+import base64
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+BACKEND = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+FAKE_DSN = 'fake://bench'
+
+CHAT_MESSAGES = [{'role': 'user', 'text': 'Сколько стоит консультация и как записаться?'}]
+
+class StubHandler(BaseHTTPRequestHandler):
+    '''
+    Yandex Cloud / Sber endpoints: OAuth, GigaChat and YandexGPT
+    completions (plain and streaming), STT and TTS.
+    '''
+    protocol_version = 'HTTP/1.1'
+    latency = 0.0
+    jitter = 0.0
+    error_rate = 0.0
+    
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+    
+    def do_POST(self) -> None:
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(max(0.0, random.uniform(self.latency - self.jitter, self.latency + self.jitter)))
+        
+        if 'oauth' in self.path:
+            self.reply(200, {'access_token': 'bench-token', 'expires_at': int(time.time() * 1000) + 1800000})
+            return
+        if random.random() < self.error_rate:
+            self.reply(503, {'error': 'injected failure'})
+            return
+        
+        if 'chat/completions' in self.path:
+            if json.loads(body).get('stream'):
+                events = [{'choices': [{'delta': {'content': word + ' '}}]} for word in 'Консультация стоит 2000 рублей'.split()]
+                self.reply_raw(200, ''.join(f'data: {json.dumps(e)}\n\n' for e in events) + 'data: [DONE]\n\n', 'text/event-stream')
+            else:
+                self.reply(200, {'choices': [{'message': {'role': 'assistant', 'content': 'Консультация стоит 2000 рублей'}}]})
+        elif 'completion' in self.path:
+            text = 'Консультация стоит 2000 рублей'
+            if json.loads(body)['completionOptions'].get('stream'):
+                words = text.split()
+                lines = [
+                    json.dumps({'result': {'alternatives': [{'message': {'text': ' '.join(words[:i])}}]}})
+                    for i in range(1, len(words) + 1)
+                ]
+                self.reply_raw(200, '\n'.join(lines) + '\n', 'application/json')
+            else:
+                self.reply(200, {'result': {'alternatives': [{'message': {'role': 'assistant', 'text': text}}]}})
+        elif 'recognize' in self.path:
+            self.reply(200, {'result': ['распознанный текст'] if 'speech:' in self.path else 'распознанный текст'})
+        else:
+            self.reply_raw(200, b'\0' * 4096, 'audio/ogg')
+    
+    def reply(self, status: int, data: Any) -> None:
+        self.reply_raw(status, json.dumps(data), 'application/json')
+    
+    def reply_raw(self, status: int, body: Any, content_type: str) -> None:
+        payload = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+def start_stub(latency_ms: float, jitter_ms: float, error_rate: float) -> str:
+    StubHandler.latency = latency_ms / 1000
+    StubHandler.jitter = jitter_ms / 1000
+    StubHandler.error_rate = error_rate
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_address[1]}'
+
+# Кеш ответов LLM живёт в памяти воркера, чтобы повторный вопрос давал HIT
+_response_cache: Dict[str, str] = {}
+_response_cache_lock = threading.Lock()
+# Состояние фейковой БД, которое переключают сценарии
+fake_state: Dict[str, Any] = {'kb_indexed': False}
+_kb_index_rows: Dict[int, Tuple[List[tuple], List[tuple]]] = {}
+
+def doc_text(doc_id: int) -> str:
+    return f'Консультация юриста стоит {1000 + doc_id * 100} рублей. ' * 20
+
+def fake_kb_index(docs: int) -> Tuple[List[tuple], List[tuple]]:
+    # Фрагменты и словарь готового индекса режет тот же анализатор, что и kb_index.py
+    if docs not in _kb_index_rows:
+        from kb_search import analyze_document
+        chunks: List[tuple] = []
+        postings: List[tuple] = []
+        for doc_id in range(docs):
+            for text, terms in analyze_document(f'Документ {doc_id}', doc_text(doc_id)):
+                chunk_id = len(chunks) + 1
+                chunks.append(('chunk', chunk_id, doc_id, f'Документ {doc_id}', text, sum(terms.values())))
+                postings.extend((term, chunk_id, tf) for term, tf in terms.items())
+        _kb_index_rows[docs] = (chunks, postings)
+    return _kb_index_rows[docs]
+
+def fake_partitions(parent: str) -> List[tuple]:
+    # Секции с прошлого года по квартал вперёд: часть из них старше срока хранения
+    today = date.today()
+    rows = []
+    for offset in range(-14, 4):
+        index = today.year * 12 + today.month - 1 + offset
+        rows.append((f'{parent}_p{index // 12}_{index % 12 + 1:02d}', 1000, 8192 * 128))
+    return rows
+
+def fake_rows(sql: str, params: Any, docs: int) -> List[tuple]:
+    now = datetime(2024, 1, 1)
+    kb_indexed = fake_state['kb_indexed']
+    if 'INSERT INTO llm_response_cache' in sql:
+        with _response_cache_lock:
+            _response_cache[params[2]] = params[5]
+        return []
+    if 'FROM llm_response_cache' in sql and sql.lstrip().startswith('SELECT'):
+        with _response_cache_lock:
+            response = _response_cache.get(params[0])
+        return [(1, True, [], response)] if response else []
+    if 'FROM state' in sql:
+        return [(1, now, 1, True, None)] if kb_indexed else [(1, now, 0, False, f'{docs}/{docs}/{now}')]
+    if "SELECT 'prompt'" in sql:
+        rows = [('prompt', None, None, None, 'Ты — консультант юридической компании.', None)]
+        if params[1]:
+            rows += fake_kb_index(docs)[0]
+        if params[2]:
+            rows += [('doc', None, i, f'Документ {i}', doc_text(i), None) for i in range(docs)]
+        return rows
+    if 'FROM kb_postings' in sql:
+        return fake_kb_index(docs)[1]
+    if 'FROM chat_messages' in sql:
+        return [('user' if i % 2 == 0 else 'assistant', f'Реплика {i} из истории диалога') for i in range(min(params[-1], 10))]
+    if 'FOR UPDATE SKIP LOCKED' in sql:
+        return [(0, 0, None, None, None)]
+    if 'pg_current_snapshot' in sql:
+        return [(10000, '1000', True)]
+    if 'FROM usage_rollup_state' in sql:
+        return [(10000, now, 5.0)]
+    if 'FROM usage_rollup_hourly' in sql or 'FROM usage_rollup_daily' in sql:
+        return [
+            (now, tool, 50, 5000, 2000, 60000, 50, [5, 10, 10, 10, 5, 5, 3, 2, 0])
+            for _ in range(24) for tool in ('gigachat', 'yandex-gpt', 'speech')
+        ]
+    if 'FROM pg_inherits' in sql:
+        return fake_partitions(params[0])
+    if 'FROM system_prompts ORDER BY' in sql or 'FROM system_prompts WHERE ai_model' in sql:
+        return [(i, f'Промпт {i}', 'Ты — консультант.', True, 'yandex-gpt', now) for i in range(3)]
+    if 'ts_headline' in sql:
+        return [(i, f'Документ {i}', 'general', now, now, 0.5, 'консультация <b>юриста</b>') for i in range(10)]
+    if 'FROM knowledge_base ORDER BY created_at DESC, id DESC' in sql.replace('\n', ' '):
+        columns = sql.split('SELECT created_at, id,', 1)[1].split(' FROM ', 1)[0].count(',') + 1
+        return [(now, i, *([f'Значение {i}'] * columns)) for i in range(docs, 0, -1)]
+    return []
+
+class FakeCursor:
+    def __init__(self, connection: 'FakeConnection'):
+        self.connection = connection
+        self.rows: List[tuple] = []
+        self.rowcount = 0
+    
+    def mogrify(self, sql: str, params: Any = None) -> bytes:
+        return sql.encode()
+    
+    def execute(self, sql: Any, params: Any = None) -> None:
+        # execute_values склеивает запрос из mogrify и передаёт его байтами
+        sql = sql.decode() if isinstance(sql, bytes) else sql
+        time.sleep(self.connection.rtt)
+        self.rows = fake_rows(sql, params, self.connection.docs)
+        self.rowcount = len(self.rows)
+    
+    def executemany(self, sql: str, params_list: Any) -> None:
+        self.execute(sql)
+    
+    def fetchone(self) -> Any:
+        return self.rows[0] if self.rows else None
+    
+    def fetchall(self) -> List[tuple]:
+        return self.rows
+    
+    def close(self) -> None:
+        pass
+
+class FakeConnection:
+    closed = 0
+    
+    def __init__(self, rtt: float, connect_rtts: int, docs: int):
+        self.rtt = rtt
+        self.docs = docs
+        time.sleep(rtt * connect_rtts)
+    
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+    
+    def commit(self) -> None:
+        pass
+    
+    def rollback(self) -> None:
+        pass
+    
+    def close(self) -> None:
+        self.closed = 1
+
+def bench_ogg(seconds: int) -> bytes:
+    from ogg_opus import OGG_BOS, OGG_EOS, OPUS_SAMPLE_RATE, build_page
+    pages = [
+        build_page(OGG_BOS, 0, 1, 0, bytes([19]), b'OpusHead' + bytes(11)),
+        build_page(0, 0, 1, 1, bytes([16]), b'OpusTags' + bytes(8)),
+    ]
+    for i in range(seconds):
+        flags = OGG_EOS if i == seconds - 1 else 0
+        pages.append(build_page(flags, (i + 1) * OPUS_SAMPLE_RATE, 1, i + 2, bytes([200]), bytes(200)))
+    return b''.join(pages)
+
+def post(body: Dict[str, Any], params: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    return {
+        'httpMethod': 'POST',
+        'headers': {'Content-Type': 'application/json'},
+        'queryStringParameters': params or {},
+        'body': json.dumps(body),
+        'isBase64Encoded': False
+    }
+
+def get(params: Dict[str, str]) -> Dict[str, Any]:
+    return {'httpMethod': 'GET', 'headers': {}, 'queryStringParameters': params, 'body': '', 'isBase64Encoded': False}
+
+def scenarios(function: str) -> Dict[str, Callable[[int], Dict[str, Any]]]:
+    # Вопросы различаются номером запроса, иначе всё отвечал бы кеш ответов
+    def chat(tag: str, **extra: Any) -> Callable[[int], Dict[str, Any]]:
+        return lambda i: post({'messages': [{'role': 'user', 'text': f'Вопрос {tag} {i}: сколько стоит консультация?'}], **extra})
+    
+    if function in ('gigachat', 'yandex-gpt'):
+        return {
+            'chat': chat('plain'),
+            'chat_stream': chat('stream', stream=True),
+            'chat_cached': lambda i: post({'messages': CHAT_MESSAGES}),
+            # История из chat_messages по session_id; запись реплик идёт тем же запросом
+            'chat_session': lambda i: post({
+                'session_id': f'bench-{i % 16}',
+                'messages': [{'role': 'user', 'text': f'Уточнение {i}: а сколько стоит выезд юриста?'}]
+            }),
+            'chat_indexed': chat('indexed'),
+        }
+    if function == 'llm-fanout':
+        return {'race': chat('race', mode='race'), 'compare': chat('compare', mode='compare')}
+    if function == 'speech':
+        short, long = bench_ogg(3), bench_ogg(60)
+        
+        def stt(audio: bytes) -> Callable[[int], Dict[str, Any]]:
+            return lambda i: {
+                'httpMethod': 'POST',
+                'headers': {'Content-Type': 'audio/ogg'},
+                'queryStringParameters': {'action': 'stt', 'provider': 'yandex'},
+                'body': base64.b64encode(audio).decode('ascii'),
+                'isBase64Encoded': True
+            }
+        return {
+            'stt': stt(short),
+            'stt_long': stt(long),
+            'tts': lambda i: post({'action': 'tts', 'provider': 'yandex', 'text': f'Фраза номер {i}. ' * 30, 'binary': True}),
+        }
+    if function == 'knowledge-base':
+        return {'list': lambda i: get({'limit': '20'}), 'search': lambda i: get({'q': 'консультация юриста'})}
+    if function == 'prompts':
+        return {'list': lambda i: get({}), 'active': lambda i: get({'model': 'yandex-gpt'})}
+    if function == 'usage-stats':
+        return {
+            'hourly': lambda i: get({'period': 'hour'}),
+            'daily': lambda i: get({'period': 'day', 'tool': 'gigachat'}),
+            'rollup': lambda i: post({}, {'action': 'rollup'}),
+        }
+    if function == 'db-maintenance':
+        return {
+            'status': lambda i: get({}),
+            'maintain': lambda i: {**post({}, {'action': 'maintain'}), 'headers': {'X-Maintenance-Token': 'bench'}},
+        }
+    return {}
+
+# Сценарии, которые читают базу знаний из готового индекса kb_chunks
+INDEXED_SCENARIOS = {'chat_indexed'}
+
+FUNCTIONS = ['gigachat', 'yandex-gpt', 'llm-fanout', 'speech', 'knowledge-base', 'prompts', 'usage-stats', 'db-maintenance']
+
+def percentile(samples: List[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))] if ordered else 0.0
+
+def measure(handler: Callable, make_event: Callable[[int], Dict[str, Any]],
+            requests: int, concurrency: int, alloc_samples: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    statuses: Dict[str, int] = {}
+    cache: Dict[str, int] = {}
+    lock = threading.Lock()
+    
+    def one(i: int) -> None:
+        started = time.perf_counter()
+        response = handler(make_event(i), None)
+        elapsed = (time.perf_counter() - started) * 1000
+        status = str(response.get('statusCode'))
+        cache_status = (response.get('headers') or {}).get('X-Cache')
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+            if cache_status:
+                cache[cache_status] = cache.get(cache_status, 0) + 1
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    wall = time.perf_counter() - started
+    
+    # Аллокации меряем отдельным последовательным прогоном: tracemalloc
+    # замедляет код и исказил бы задержки
+    allocations = []
+    tracemalloc.start()
+    try:
+        for i in range(alloc_samples):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            handler(make_event(requests + i), None)
+            allocations.append((tracemalloc.get_traced_memory()[1] - before) / 1024)
+    finally:
+        tracemalloc.stop()
+    
+    errors = sum(count for status, count in statuses.items() if not status.startswith('2'))
+    return {
+        'requests': requests,
+        'errors': errors,
+        'statuses': statuses,
+        'cache': cache,
+        'rps': round(requests / wall, 1),
+        'p50_ms': round(percentile(latencies, 0.50), 2),
+        'p95_ms': round(percentile(latencies, 0.95), 2),
+        'p99_ms': round(percentile(latencies, 0.99), 2),
+        'alloc_kb': round(percentile(allocations, 0.50), 1),
+    }
+
+def run_worker(args: argparse.Namespace) -> Dict[str, Any]:
+    function = args.worker
+    base = start_stub(args.latency_ms, args.jitter_ms, args.error_rate)
+    os.environ.update({
+        'TIMING_LOG': '0',
+        'DATABASE_URL': args.dsn or FAKE_DSN,
+        'YANDEX_GPT_API_KEY': 'bench', 'GIGACHAT_API_KEY': 'bench', 'YANDEX_SPEECH_API_KEY': 'bench',
+        'SBER_CLIENT_ID': 'bench', 'SBER_CLIENT_SECRET': 'bench',
+        'YANDEX_GPT_URL': f'{base}/foundationModels/v1/completion',
+        'GIGACHAT_OAUTH_URL': f'{base}/oauth', 'GIGACHAT_API_URL': f'{base}/gigachat',
+        'SBER_OAUTH_URL': f'{base}/oauth', 'SBER_SPEECH_URL': f'{base}/sber',
+        'YANDEX_STT_URL': f'{base}/speech/v1/stt:recognize', 'YANDEX_TTS_URL': f'{base}/tts',
+        'MAINTENANCE_TOKEN': 'bench',
+    })
+    sys.path.insert(0, os.path.join(BACKEND, function))
+    
+    import db
+    import index
+    if not args.dsn:
+        db.set_connection_factory(
+            lambda dsn: FakeConnection(args.db_rtt_ms / 1000, args.connect_rtts, args.docs)
+        )
+    
+    results = {}
+    for name, make_event in scenarios(function).items():
+        if args.scenarios and name not in args.scenarios.split(','):
+            continue
+        fake_state['kb_indexed'] = name in INDEXED_SCENARIOS
+        # Контекст прошлого сценария мог быть загружен из другого состояния базы знаний
+        if 'llm_context' in sys.modules:
+            sys.modules['llm_context']._context_cache.clear()
+        for i in range(args.warmup):
+            index.handler(make_event(-1 - i), None)
+        results[f'{function}/{name}'] = measure(
+            index.handler, make_event, args.requests, args.concurrency, args.alloc_samples
+        )
+    return results
+
+def compare(results: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    regressions = []
+    print(f"\n{'scenario':28} {'req/s':>14} {'p50 ms':>14} {'p95 ms':>14} {'alloc KB':>14}")
+    for key, current in results.items():
+        old = baseline.get(key)
+        if not old:
+            print(f'{key:28} (no baseline)')
+            continue
+        
+        def delta(metric: str) -> float:
+            return (current[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+        
+        cells = [f'{delta(metric):+13.0%}' for metric in ('rps', 'p50_ms', 'p95_ms', 'alloc_kb')]
+        # Пропускная способность хуже, если падает; остальное — если растёт
+        worse = -delta('rps') > threshold or delta('p95_ms') > threshold or delta('alloc_kb') > threshold
+        print(f"{key:28} {' '.join(cells)}{'  REGRESSION' if worse else ''}")
+        if worse:
+            regressions.append(key)
+    return regressions
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--only', default='', help='comma-separated functions, default: all')
+    parser.add_argument('--scenarios', default='', help='comma-separated scenario names, default: all')
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--warmup', type=int, default=5)
+    parser.add_argument('--alloc-samples', type=int, default=10)
+    parser.add_argument('--latency-ms', type=float, default=30.0, help='stub upstream latency')
+    parser.add_argument('--jitter-ms', type=float, default=10.0)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of upstream calls answered with 503')
+    parser.add_argument('--db-rtt-ms', type=float, default=1.0, help='fake Postgres latency per query')
+    parser.add_argument('--connect-rtts', type=int, default=4)
+    parser.add_argument('--docs', type=int, default=20, help='knowledge-base documents in the fake database')
+    parser.add_argument('--dsn', default=None, help='run against a real Postgres instead of the fake one')
+    parser.add_argument('--save', default=None, help='write results as a baseline JSON file')
+    parser.add_argument('--baseline', default=None, help='compare with a baseline JSON file')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--worker', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+    
+    functions = [f for f in args.only.split(',') if f] or FUNCTIONS
+    results: Dict[str, Any] = {}
+    for function in functions:
+        worker = subprocess.run(
+            [sys.executable, __file__, '--worker', function] + sys.argv[1:],
+            capture_output=True, text=True
+        )
+        if worker.returncode != 0:
+            print(f'{function}: worker failed\n{worker.stderr}', file=sys.stderr)
+            continue
+        results.update(json.loads(worker.stdout.strip().splitlines()[-1]))
+    
+    print(f"{'scenario':28} {'reqs':>6} {'errors':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'alloc KB':>9}")
+    for key, r in results.items():
+        print(f"{key:28} {r['requests']:6} {r['errors']:7} {r['rps']:8.1f} "
+              f"{r['p50_ms']:8.2f} {r['p95_ms']:8.2f} {r['p99_ms']:8.2f} {r['alloc_kb']:9.1f}")
+    
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+'''
+ConnectionPool liveness and reconnection against a fake connection
+factory, without Postgres:
+
+    python -m unittest discover -s bench -p 'test_*.py'
+'''
+import os
+import sys
+import unittest
+from typing import Any, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'prompts'))
+
+import psycopg2
+
+import db
+
+class FakeCursor:
+    def __init__(self, connection: 'FakeConnection'):
+        self.connection = connection
+    
+    def execute(self, sql: str, params: Any = None) -> None:
+        self.connection.pings += 1
+        if not self.connection.alive:
+            raise psycopg2.OperationalError('server closed the connection unexpectedly')
+    
+    def fetchone(self) -> Any:
+        return (1,)
+    
+    def close(self) -> None:
+        pass
+
+class FakeConnection:
+    def __init__(self) -> None:
+        self.alive = True
+        self.closed = 0
+        self.pings = 0
+    
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+    
+    def rollback(self) -> None:
+        if not self.alive:
+            raise psycopg2.InterfaceError('connection already closed')
+    
+    def close(self) -> None:
+        self.closed = 1
+
+class ConnectionPoolTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.connections: List[FakeConnection] = []
+        self.ping_interval = db.DB_PING_INTERVAL
+        self.pool_timeout = db.DB_POOL_TIMEOUT
+    
+    def tearDown(self) -> None:
+        db.DB_PING_INTERVAL = self.ping_interval
+        db.DB_POOL_TIMEOUT = self.pool_timeout
+    
+    def connect(self, dsn: str) -> FakeConnection:
+        conn = FakeConnection()
+        self.connections.append(conn)
+        return conn
+    
+    def pool(self, maxconn: int = 2) -> db.ConnectionPool:
+        return db.ConnectionPool('fake://test', maxconn, self.connect)
+    
+    def test_idle_connection_reused_without_ping(self) -> None:
+        pool = self.pool()
+        conn = pool.getconn()
+        pool.putconn(conn)
+        
+        self.assertIs(pool.getconn(), conn)
+        self.assertEqual(conn.pings, 0)
+        self.assertEqual(len(self.connections), 1)
+    
+    def test_live_connection_pinged_after_interval(self) -> None:
+        db.DB_PING_INTERVAL = 0
+        pool = self.pool()
+        conn = pool.getconn()
+        pool.putconn(conn)
+        
+        self.assertIs(pool.getconn(), conn)
+        self.assertEqual(conn.pings, 1)
+    
+    def test_dead_connection_replaced_after_interval(self) -> None:
+        db.DB_PING_INTERVAL = 0
+        pool = self.pool()
+        stale = pool.getconn()
+        pool.putconn(stale)
+        stale.alive = False
+        
+        fresh = pool.getconn()
+        self.assertIsNot(fresh, stale)
+        self.assertTrue(stale.closed)
+        self.assertEqual(len(self.connections), 2)
+        self.assertEqual(pool.in_use, 1)
+    
+    def test_closed_connection_replaced_without_ping(self) -> None:
+        pool = self.pool()
+        conn = pool.getconn()
+        pool.putconn(conn)
+        conn.closed = 1
+        
+        self.assertIsNot(pool.getconn(), conn)
+        self.assertEqual(conn.pings, 0)
+    
+    def test_putconn_discards_broken_connection(self) -> None:
+        pool = self.pool()
+        broken = pool.getconn()
+        broken.alive = False
+        pool.putconn(broken)
+        
+        self.assertTrue(broken.closed)
+        self.assertEqual(pool.idle, [])
+        self.assertEqual(pool.in_use, 0)
+        self.assertIsNot(pool.getconn(), broken)
+    
+    def test_exhausted_pool_times_out(self) -> None:
+        db.DB_POOL_TIMEOUT = 0.05
+        pool = self.pool(maxconn=1)
+        pool.getconn()
+        
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.getconn()
+    
+    def test_failed_connect_frees_slot(self) -> None:
+        def refuse(dsn: str) -> Any:
+            raise psycopg2.OperationalError('could not connect to server')
+        
+        pool = db.ConnectionPool('fake://test', 1, refuse)
+        with self.assertRaises(psycopg2.OperationalError):
+            pool.getconn()
+        self.assertEqual(pool.in_use, 0)
+
+if __name__ == '__main__':
+    unittest.main()
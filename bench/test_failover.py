@@ -0,0 +1,50 @@
+'''
+Provider failover decisions, without network access:
+
+    python -m unittest discover -s bench -p 'test_*.py'
+'''
+import os
+import sys
+import unittest
+from typing import Any, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'gigachat'))
+
+import httpx
+
+from llm_providers import with_failover
+from provider_client import ProviderError
+from provider_health import is_provider_failure
+
+class Upstream:
+    def __init__(self, name: str, error: Any = None):
+        self.name = name
+        self.error = error
+
+def attempt(provider: Upstream) -> str:
+    if provider.error is not None:
+        raise provider.error
+    return provider.name
+
+def chain(error: BaseException) -> List[Upstream]:
+    return [Upstream('primary', error), Upstream('fallback')]
+
+class FailoverTest(unittest.TestCase):
+    def test_provider_failure_fails_over(self) -> None:
+        for error in (ProviderError(503, 'down'), ProviderError(429, 'busy'),
+                      httpx.ConnectError('refused'), httpx.ReadTimeout('slow')):
+            provider, result = with_failover(chain(error), attempt)
+            self.assertEqual(result, 'fallback')
+    
+    def test_rejected_request_is_raised(self) -> None:
+        with self.assertRaises(ProviderError):
+            with_failover(chain(ProviderError(400, 'bad request')), attempt)
+    
+    def test_other_errors_are_raised(self) -> None:
+        for error in (ValueError('bad payload'), KeyError('text'), RuntimeError('pool exhausted')):
+            with self.assertRaises(type(error)):
+                with_failover(chain(error), attempt)
+            self.assertFalse(is_provider_failure(error))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+'''
+Knowledge-base indexing against a fake connection, without Postgres:
+
+    python -m unittest discover -s bench -p 'test_*.py'
+'''
+import json
+import os
+import sys
+import unittest
+from typing import Any, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'knowledge-base'))
+
+import psycopg2
+
+import db
+import index
+from kb_search import TERM_MAX_LENGTH, analyze_document, tokenize
+
+class FakeCursor:
+    def __init__(self, connection: 'FakeConnection'):
+        self.connection = connection
+        self.rows: List[tuple] = []
+        self.rowcount = 0
+    
+    def mogrify(self, sql: Any, params: Any = None) -> bytes:
+        return sql if isinstance(sql, bytes) else sql.encode()
+    
+    def execute(self, sql: Any, params: Any = None) -> None:
+        sql = sql.decode() if isinstance(sql, bytes) else sql
+        self.connection.queries.append(sql)
+        if 'INSERT INTO kb_postings' in sql and self.connection.fail_postings:
+            raise psycopg2.DataError('value too long for type character varying(100)')
+        if 'RETURNING id' in sql:
+            self.rows = [(1,)]
+        elif 'SELECT indexed' in sql:
+            self.rows = [(True,)]
+        else:
+            self.rows = []
+        self.rowcount = max(len(self.rows), 1)
+    
+    def fetchone(self) -> Any:
+        return self.rows[0] if self.rows else None
+    
+    def fetchall(self) -> List[tuple]:
+        return self.rows
+    
+    def close(self) -> None:
+        pass
+
+class FakeConnection:
+    closed = 0
+    encoding = 'UTF8'
+    
+    def __init__(self) -> None:
+        self.queries: List[str] = []
+        self.fail_postings = False
+        self.rolled_back = False
+    
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+    
+    def commit(self) -> None:
+        pass
+    
+    def rollback(self) -> None:
+        self.rolled_back = True
+    
+    def close(self) -> None:
+        self.closed = 1
+
+class KnowledgeIndexTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.conn = FakeConnection()
+        db.set_connection_factory(lambda dsn: self.conn)
+        os.environ['DATABASE_URL'] = 'fake://test'
+        os.environ['TIMING_LOG'] = '0'
+    
+    def create(self, content: str) -> dict:
+        return index.handler({
+            'httpMethod': 'POST',
+            'body': json.dumps({'title': 'Реквизиты', 'content': content, 'category': 'Test'})
+        }, None)
+    
+    def test_overlong_words_are_not_indexed(self) -> None:
+        blob = 'a' * (TERM_MAX_LENGTH + 50)
+        self.assertEqual(tokenize(f'оплата {blob} картой'), tokenize('оплата картой'))
+        for _, terms in analyze_document('Реквизиты', f'Ключ {blob}. Оплата по счёту.'):
+            self.assertTrue(all(len(term) <= TERM_MAX_LENGTH for term in terms))
+    
+    def test_document_with_overlong_words_is_created(self) -> None:
+        response = self.create('Подпись: ' + 'QUJD' * 60 + '. Оплата по счёту.')
+        self.assertEqual(response['statusCode'], 201)
+    
+    def test_index_failure_returns_json_error(self) -> None:
+        self.conn.fail_postings = True
+        response = self.create('Оплата по счёту.')
+        
+        self.assertEqual(response['statusCode'], 500)
+        self.assertEqual(response['headers']['Access-Control-Allow-Origin'], '*')
+        self.assertIn('value too long', json.loads(response['body'])['error'])
+        self.assertTrue(self.conn.rolled_back)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+'''
+Near-duplicate matching of the LLM response cache against a fake connection:
+
+    python -m unittest discover -s bench -p 'test_*.py'
+'''
+import json
+import os
+import sys
+import unittest
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'gigachat'))
+
+from response_cache import _hash, lookup_response, normalize_question, question_shingles
+
+class FakeCursor:
+    def __init__(self, connection: 'FakeConnection'):
+        self.connection = connection
+        self.rows: List[tuple] = []
+    
+    def execute(self, sql: str, params: Any = None) -> None:
+        if sql.lstrip().startswith('SELECT'):
+            question_hash = params[0]
+            self.rows = [
+                (entry_id, entry['hash'] == question_hash, entry['shingles'], entry['response'])
+                for entry_id, entry in enumerate(self.connection.entries)
+            ]
+        else:
+            self.rows = []
+    
+    def fetchall(self) -> List[tuple]:
+        return self.rows
+    
+    def close(self) -> None:
+        pass
+
+class FakeConnection:
+    def __init__(self, questions: List[str]):
+        self.entries: List[Dict[str, Any]] = [
+            {
+                'hash': _hash(normalize_question(question)),
+                'shingles': question_shingles(question),
+                'response': json.dumps({'text': question})
+            }
+            for question in questions
+        ]
+    
+    def cursor(self) -> FakeCursor:
+        return FakeCursor(self)
+    
+    def commit(self) -> None:
+        pass
+
+def lookup(cached: str, question: str) -> Any:
+    return lookup_response(FakeConnection([cached]), 'gigachat', 'v1', question)
+
+class NearDuplicateTest(unittest.TestCase):
+    def test_rephrased_question_is_near_hit(self) -> None:
+        response, match = lookup('Сколько стоит консультация?', 'а сколько стоят консультации')
+        self.assertEqual(match, 'near')
+        self.assertEqual(response, {'text': 'Сколько стоит консультация?'})
+    
+    def test_exact_question_is_exact_hit(self) -> None:
+        self.assertEqual(lookup('Где вы находитесь?', 'где ВЫ находитесь')[1], 'exact')
+    
+    def test_different_question_words_miss(self) -> None:
+        self.assertIsNone(lookup('Когда вы работаете?', 'Где вы работаете?'))
+        self.assertIsNone(lookup('Кто ваш директор?', 'Где ваш директор?'))
+    
+    def test_negation_misses(self) -> None:
+        self.assertIsNone(lookup('Можно оплатить картой?', 'Нельзя оплатить картой?'))
+        self.assertIsNone(lookup('Вы работаете в субботу?', 'Вы не работаете в субботу?'))
+    
+    def test_long_question_with_negation_misses(self) -> None:
+        cached = 'Можно ли оплатить консультацию юриста банковской картой прямо в офисе компании на Тверской улице'
+        self.assertIsNone(lookup(cached, cached.replace('Можно', 'Нельзя')))
+
+if __name__ == '__main__':
+    unittest.main()
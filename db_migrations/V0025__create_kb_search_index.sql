@@ -0,0 +1,30 @@
+-- Поисковый индекс базы знаний: фрагменты документов, инвертированный индекс и статистика для BM25
+CREATE TABLE IF NOT EXISTS kb_chunks (
+    id SERIAL PRIMARY KEY,
+    doc_id INTEGER NOT NULL,
+    title VARCHAR(255),
+    chunk_text TEXT NOT NULL,
+    term_count INTEGER NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS idx_kb_chunks_doc_id ON kb_chunks(doc_id);
+
+CREATE TABLE IF NOT EXISTS kb_postings (
+    term VARCHAR(100) NOT NULL,
+    chunk_id INTEGER NOT NULL REFERENCES kb_chunks(id) ON DELETE CASCADE,
+    tf INTEGER NOT NULL,
+    PRIMARY KEY (term, chunk_id)
+);
+
+CREATE INDEX IF NOT EXISTS idx_kb_postings_chunk_id ON kb_postings(chunk_id);
+
+-- Одна строка: версия индекса растёт при каждом изменении документа
+CREATE TABLE IF NOT EXISTS kb_index_state (
+    id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+    version BIGINT NOT NULL DEFAULT 0,
+    chunk_count INTEGER NOT NULL DEFAULT 0,
+    total_length BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO kb_index_state (id) VALUES (1) ON CONFLICT (id) DO NOTHING;
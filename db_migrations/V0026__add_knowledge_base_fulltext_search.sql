@@ -0,0 +1,9 @@
+-- Полнотекстовый поиск по базе знаний: заголовок весит больше содержимого
+ALTER TABLE knowledge_base
+ADD COLUMN IF NOT EXISTS search_vector tsvector
+GENERATED ALWAYS AS (
+    setweight(to_tsvector('russian', coalesce(file_name, '')), 'A') ||
+    setweight(to_tsvector('russian', coalesce(content, '')), 'B')
+) STORED;
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_base_search ON knowledge_base USING GIN (search_vector);
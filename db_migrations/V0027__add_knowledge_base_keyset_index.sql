@@ -0,0 +1,2 @@
+-- Индекс под keyset-пагинацию списка документов: ORDER BY created_at DESC, id DESC
+CREATE INDEX IF NOT EXISTS idx_knowledge_base_created_id ON knowledge_base(created_at DESC, id DESC);
@@ -0,0 +1,19 @@
+-- Кеш ответов LLM на повторяющиеся вопросы: точное совпадение по хешу
+-- нормализованного вопроса и поиск почти-дубликатов по шинглам
+CREATE TABLE IF NOT EXISTS llm_response_cache (
+    id SERIAL PRIMARY KEY,
+    ai_model VARCHAR(50) NOT NULL,
+    context_version VARCHAR(64) NOT NULL,
+    question_hash VARCHAR(64) NOT NULL,
+    question TEXT NOT NULL,
+    shingles TEXT[] NOT NULL,
+    response JSONB NOT NULL,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    expires_at TIMESTAMP NOT NULL,
+    UNIQUE (ai_model, context_version, question_hash)
+);
+
+CREATE INDEX IF NOT EXISTS idx_llm_response_cache_shingles ON llm_response_cache USING GIN (shingles);
+CREATE INDEX IF NOT EXISTS idx_llm_response_cache_last_hit ON llm_response_cache(last_hit_at DESC);
@@ -0,0 +1,14 @@
+-- Кеш синтезированной речи: ключ — sha256 от (провайдер, голос, формат, текст)
+CREATE TABLE IF NOT EXISTS tts_audio_cache (
+    cache_key VARCHAR(64) PRIMARY KEY,
+    provider VARCHAR(20) NOT NULL,
+    voice VARCHAR(50) NOT NULL,
+    audio_format VARCHAR(20) NOT NULL,
+    audio BYTEA NOT NULL,
+    size_bytes INTEGER NOT NULL,
+    hit_count INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_hit_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_tts_audio_cache_last_hit ON tts_audio_cache(last_hit_at DESC);
@@ -0,0 +1,7 @@
+-- Последние сообщения диалога читаются по (session_id, id) без сортировки
+-- всей истории сессии. Индекс покрывает и поиск по одному session_id,
+-- поэтому прежние одиночные индексы только замедляют вставку
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_recent ON chat_messages(session_id, id DESC);
+
+DROP INDEX IF EXISTS idx_session;
+DROP INDEX IF EXISTS idx_chat_messages_session_id;
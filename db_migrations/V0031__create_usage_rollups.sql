@@ -0,0 +1,41 @@
+-- Метрики запроса пишутся колонками, чтобы сводки считались без разбора JSONB
+ALTER TABLE ai_tools_usage ADD COLUMN IF NOT EXISTS latency_ms INTEGER;
+ALTER TABLE ai_tools_usage ADD COLUMN IF NOT EXISTS input_tokens INTEGER;
+ALTER TABLE ai_tools_usage ADD COLUMN IF NOT EXISTS output_tokens INTEGER;
+
+-- Почасовые и посуточные сводки по ai_tools_usage. Гистограмма задержек
+-- хранит число запросов в корзинах с границами 100, 250, 500, 1000, 2500,
+-- 5000, 10000, 30000 мс; последняя корзина — всё, что дольше
+CREATE TABLE IF NOT EXISTS usage_rollup_hourly (
+    bucket TIMESTAMP NOT NULL,
+    tool_name VARCHAR(100) NOT NULL,
+    requests BIGINT NOT NULL DEFAULT 0,
+    input_tokens BIGINT NOT NULL DEFAULT 0,
+    output_tokens BIGINT NOT NULL DEFAULT 0,
+    latency_sum_ms BIGINT NOT NULL DEFAULT 0,
+    latency_count BIGINT NOT NULL DEFAULT 0,
+    latency_histogram BIGINT[] NOT NULL,
+    PRIMARY KEY (bucket, tool_name)
+);
+
+CREATE TABLE IF NOT EXISTS usage_rollup_daily (
+    bucket TIMESTAMP NOT NULL,
+    tool_name VARCHAR(100) NOT NULL,
+    requests BIGINT NOT NULL DEFAULT 0,
+    input_tokens BIGINT NOT NULL DEFAULT 0,
+    output_tokens BIGINT NOT NULL DEFAULT 0,
+    latency_sum_ms BIGINT NOT NULL DEFAULT 0,
+    latency_count BIGINT NOT NULL DEFAULT 0,
+    latency_histogram BIGINT[] NOT NULL,
+    PRIMARY KEY (bucket, tool_name)
+);
+
+-- Водяной знак: последний id ai_tools_usage, уже учтённый в сводках
+CREATE TABLE IF NOT EXISTS usage_rollup_state (
+    source VARCHAR(100) PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO usage_rollup_state (source, last_id) VALUES ('ai_tools_usage', 0)
+ON CONFLICT (source) DO NOTHING;
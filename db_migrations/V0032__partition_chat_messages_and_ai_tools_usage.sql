@@ -0,0 +1,101 @@
+-- chat_messages и ai_tools_usage делятся на помесячные секции по created_at:
+-- запросы за свежий период читают только горячие секции, а устаревшие месяцы
+-- удаляются DROP/DETACH секции вместо DELETE по всей таблице.
+-- Ключ секционирования обязан входить в первичный ключ, поэтому PK — (id, created_at).
+-- Секции на будущие месяцы заранее создаёт функция db-maintenance; DEFAULT-секция
+-- страхует вставку, если обслуживание не запускалось
+
+-- chat_messages
+ALTER TABLE chat_messages RENAME TO chat_messages_unpartitioned;
+ALTER INDEX chat_messages_pkey RENAME TO chat_messages_unpartitioned_pkey;
+
+CREATE TABLE chat_messages (
+    id INTEGER NOT NULL DEFAULT nextval('chat_messages_id_seq'),
+    session_id VARCHAR(255) NOT NULL,
+    model_id VARCHAR(50) NOT NULL,
+    role VARCHAR(20) NOT NULL,
+    content TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE chat_messages_id_seq OWNED BY chat_messages.id;
+
+DO $$
+DECLARE
+    part_month DATE;
+    last_month DATE := date_trunc('month', CURRENT_DATE) + INTERVAL '3 months';
+BEGIN
+    SELECT COALESCE(date_trunc('month', min(created_at)), date_trunc('month', CURRENT_DATE))
+    INTO part_month FROM chat_messages_unpartitioned;
+    WHILE part_month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF chat_messages FOR VALUES FROM (%L) TO (%L)',
+            'chat_messages_p' || to_char(part_month, 'YYYY_MM'), part_month, (part_month + INTERVAL '1 month')::DATE
+        );
+        part_month := part_month + INTERVAL '1 month';
+    END LOOP;
+END $$;
+
+CREATE TABLE IF NOT EXISTS chat_messages_default PARTITION OF chat_messages DEFAULT;
+
+INSERT INTO chat_messages (id, session_id, model_id, role, content, created_at)
+SELECT id, session_id, model_id, role, content, COALESCE(created_at, CURRENT_TIMESTAMP)
+FROM chat_messages_unpartitioned;
+
+DROP TABLE chat_messages_unpartitioned;
+
+-- Индексы по created_at заменяет отсечение секций
+CREATE INDEX IF NOT EXISTS idx_chat_messages_session_recent ON chat_messages(session_id, id DESC);
+CREATE INDEX IF NOT EXISTS idx_chat_messages_model_id ON chat_messages(model_id);
+
+-- ai_tools_usage
+ALTER TABLE ai_tools_usage RENAME TO ai_tools_usage_unpartitioned;
+ALTER INDEX ai_tools_usage_pkey RENAME TO ai_tools_usage_unpartitioned_pkey;
+
+CREATE TABLE ai_tools_usage (
+    id INTEGER NOT NULL DEFAULT nextval('ai_tools_usage_id_seq'),
+    tool_name VARCHAR(100) NOT NULL,
+    session_id VARCHAR(255),
+    input_text TEXT,
+    output_text TEXT,
+    parameters JSONB,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    latency_ms INTEGER,
+    input_tokens INTEGER,
+    output_tokens INTEGER,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+ALTER SEQUENCE ai_tools_usage_id_seq OWNED BY ai_tools_usage.id;
+
+DO $$
+DECLARE
+    part_month DATE;
+    last_month DATE := date_trunc('month', CURRENT_DATE) + INTERVAL '3 months';
+BEGIN
+    SELECT COALESCE(date_trunc('month', min(created_at)), date_trunc('month', CURRENT_DATE))
+    INTO part_month FROM ai_tools_usage_unpartitioned;
+    WHILE part_month <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF ai_tools_usage FOR VALUES FROM (%L) TO (%L)',
+            'ai_tools_usage_p' || to_char(part_month, 'YYYY_MM'), part_month, (part_month + INTERVAL '1 month')::DATE
+        );
+        part_month := part_month + INTERVAL '1 month';
+    END LOOP;
+END $$;
+
+CREATE TABLE IF NOT EXISTS ai_tools_usage_default PARTITION OF ai_tools_usage DEFAULT;
+
+-- id сохраняются: водяной знак сводок usage_rollup_state остаётся верным
+INSERT INTO ai_tools_usage (
+    id, tool_name, session_id, input_text, output_text, parameters, created_at,
+    latency_ms, input_tokens, output_tokens
+)
+SELECT id, tool_name, session_id, input_text, output_text, parameters, COALESCE(created_at, CURRENT_TIMESTAMP),
+       latency_ms, input_tokens, output_tokens
+FROM ai_tools_usage_unpartitioned;
+
+DROP TABLE ai_tools_usage_unpartitioned;
+
+CREATE INDEX IF NOT EXISTS idx_ai_tools_session ON ai_tools_usage(session_id);
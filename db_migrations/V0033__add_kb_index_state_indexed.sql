@@ -0,0 +1,4 @@
+-- Признак того, что kb_chunks построен по всей базе знаний. Выставляет только
+-- полная переиндексация; до неё LLM-функции читают документы из knowledge_base,
+-- а первая запись в базу знаний строит индекс целиком
+ALTER TABLE kb_index_state ADD COLUMN IF NOT EXISTS indexed BOOLEAN NOT NULL DEFAULT FALSE;
@@ -0,0 +1,10 @@
+-- Граница сводок без блокировки ai_tools_usage: safe_id — id, до которого все
+-- вставки уже завершились. Кандидат pending_id запоминается вместе с xmax
+-- снимка и становится safe_id, когда xmin нового снимка дорастёт до pending_xmax,
+-- то есть закончатся все транзакции, шедшие в момент замера
+ALTER TABLE usage_rollup_state ADD COLUMN IF NOT EXISTS safe_id BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE usage_rollup_state ADD COLUMN IF NOT EXISTS pending_id BIGINT;
+ALTER TABLE usage_rollup_state ADD COLUMN IF NOT EXISTS pending_xmax xid8;
+
+-- Всё до водяного знака уже учтено под прежней SHARE-блокировкой
+UPDATE usage_rollup_state SET safe_id = last_id WHERE safe_id < last_id;
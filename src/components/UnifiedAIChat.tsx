@@ -53,6 +53,8 @@ const UnifiedAIChat = ({ isOpen, onClose }: UnifiedAIChatProps) => {
   const mediaRecorderRef = useRef<MediaRecorder | null>(null);
   const audioChunksRef = useRef<Blob[]>([]);
   const audioRef = useRef<HTMLAudioElement | null>(null);
+  // История диалога хранится на сервере: шлём id сессии и только новое сообщение
+  const sessionIdRef = useRef<string>(crypto.randomUUID());
 
   const currentConfig = AI_CONFIGS[selectedModel];
 
@@ -60,6 +62,7 @@ const UnifiedAIChat = ({ isOpen, onClose }: UnifiedAIChatProps) => {
     if (!isOpen) {
       setMessages([]);
       setInputText('');
+      sessionIdRef.current = crypto.randomUUID();
     }
   }, [isOpen]);
 
@@ -78,14 +81,8 @@ const UnifiedAIChat = ({ isOpen, onClose }: UnifiedAIChatProps) => {
           'Content-Type': 'application/json'
         },
         body: JSON.stringify({
-          messages: [
-            ...messages.map(m => ({ 
-              role: m.role, 
-              text: m.content,
-              content: m.content 
-            })),
-            { role: 'user', text: inputText, content: inputText }
-          ]
+          session_id: sessionIdRef.current,
+          messages: [{ role: 'user', text: inputText, content: inputText }]
         })
       });
 
@@ -128,6 +125,7 @@ const UnifiedAIChat = ({ isOpen, onClose }: UnifiedAIChatProps) => {
   const handleModelChange = (newModel: AIModel) => {
     setSelectedModel(newModel);
     setMessages([]);
+    sessionIdRef.current = crypto.randomUUID();
     toast.success(`Переключено на ${AI_CONFIGS[newModel].name}`);
   };
 
@@ -171,37 +169,26 @@ const UnifiedAIChat = ({ isOpen, onClose }: UnifiedAIChatProps) => {
   const processAudio = async (audioBlob: Blob) => {
     setIsLoading(true);
     try {
-      const reader = new FileReader();
-      reader.readAsDataURL(audioBlob);
+      const provider = selectedModel === 'yandex-gpt' ? 'yandex' : 'sber';
+      const response = await fetch(`${SPEECH_API_URL}?action=stt&provider=${provider}`, {
+        method: 'POST',
+        headers: { 'Content-Type': audioBlob.type || 'audio/ogg' },
+        body: audioBlob
+      });
       
-      reader.onloadend = async () => {
-        const base64Audio = (reader.result as string).split(',')[1];
-        
-        const provider = selectedModel === 'yandex-gpt' ? 'yandex' : 'sber';
-        const response = await fetch(SPEECH_API_URL, {
-          method: 'POST',
-          headers: { 'Content-Type': 'application/json' },
-          body: JSON.stringify({
-            action: 'stt',
-            provider,
-            audio: base64Audio
-          })
-        });
-        
-        if (!response.ok) {
-          throw new Error('Ошибка распознавания речи');
-        }
-        
-        const data = await response.json();
-        const recognizedText = data.result || data.text || '';
-        
-        if (recognizedText) {
-          setInputText(recognizedText);
-          toast.success('Текст распознан!');
-        } else {
-          toast.error('Не удалось распознать речь');
-        }
-      };
+      if (!response.ok) {
+        throw new Error('Ошибка распознавания речи');
+      }
+      
+      const data = await response.json();
+      const recognizedText = data.result || data.text || '';
+      
+      if (recognizedText) {
+        setInputText(recognizedText);
+        toast.success('Текст распознан!');
+      } else {
+        toast.error('Не удалось распознать речь');
+      }
     } catch (error) {
       toast.error('Ошибка при распознавании речи');
       console.error(error);
@@ -222,7 +209,8 @@ const UnifiedAIChat = ({ isOpen, onClose }: UnifiedAIChatProps) => {
         body: JSON.stringify({
           action: 'tts',
           provider,
-          text
+          text,
+          binary: true
         })
       });
       
@@ -230,11 +218,9 @@ const UnifiedAIChat = ({ isOpen, onClose }: UnifiedAIChatProps) => {
         throw new Error('Ошибка синтеза речи');
       }
       
-      const data = await response.json();
-      const audioBase64 = data.audio;
+      const audioBlob = await response.blob();
       
-      if (audioBase64) {
-        const audioBlob = base64ToBlob(audioBase64, 'audio/ogg');
+      if (audioBlob.size > 0) {
         const audioUrl = URL.createObjectURL(audioBlob);
         
         if (audioRef.current) {
@@ -257,16 +243,6 @@ const UnifiedAIChat = ({ isOpen, onClose }: UnifiedAIChatProps) => {
     }
   };
 
-  const base64ToBlob = (base64: string, mimeType: string): Blob => {
-    const byteCharacters = atob(base64);
-    const byteNumbers = new Array(byteCharacters.length);
-    for (let i = 0; i < byteCharacters.length; i++) {
-      byteNumbers[i] = byteCharacters.charCodeAt(i);
-    }
-    const byteArray = new Uint8Array(byteNumbers);
-    return new Blob([byteArray], { type: mimeType });
-  };
-
   const stopAudio = () => {
     if (audioRef.current) {
       audioRef.current.pause();
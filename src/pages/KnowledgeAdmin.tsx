@@ -10,7 +10,8 @@ import { toast } from 'sonner';
 interface KnowledgeDoc {
   id: number;
   title: string;
-  content: string;
+  content?: string;
+  preview?: string;
   category: string;
 }
 
@@ -28,6 +29,7 @@ const PROMPT_API = 'https://functions.poehali.dev/4cf138a9-29d9-4e15-9cb0-37d986
 const KnowledgeAdmin = () => {
   const [activeTab, setActiveTab] = useState<'knowledge' | 'prompts'>('knowledge');
   const [docs, setDocs] = useState<KnowledgeDoc[]>([]);
+  const [docsCursor, setDocsCursor] = useState<string | null>(null);
   const [prompts, setPrompts] = useState<SystemPrompt[]>([]);
   
   const [editDoc, setEditDoc] = useState<KnowledgeDoc | null>(null);
@@ -41,10 +43,18 @@ const KnowledgeAdmin = () => {
     loadPrompts();
   }, []);
 
-  const loadDocs = async () => {
-    const res = await fetch(KB_API);
+  const loadDocs = async (cursor?: string) => {
+    const res = await fetch(cursor ? `${KB_API}?cursor=${encodeURIComponent(cursor)}` : KB_API);
     const data = await res.json();
-    setDocs(data);
+    setDocs(prev => (cursor ? [...prev, ...data.items] : data.items));
+    setDocsCursor(data.has_more ? data.next_cursor : null);
+  };
+
+  const openDoc = async (id: number) => {
+    const res = await fetch(`${KB_API}?id=${id}`);
+    const data = await res.json();
+    setEditDoc(data);
+    setShowDocForm(true);
   };
 
   const loadPrompts = async () => {
@@ -175,13 +185,13 @@ const KnowledgeAdmin = () => {
                       <div className="flex-1">
                         <h3 className="text-lg font-semibold text-white">{doc.title}</h3>
                         <p className="text-sm text-slate-400 mt-1">{doc.category}</p>
-                        <p className="text-slate-300 mt-2 line-clamp-2">{doc.content}</p>
+                        <p className="text-slate-300 mt-2 line-clamp-2">{doc.preview}</p>
                       </div>
                       <div className="flex gap-2">
                         <Button
                           variant="ghost"
                           size="icon"
-                          onClick={() => { setEditDoc(doc); setShowDocForm(true); }}
+                          onClick={() => openDoc(doc.id)}
                           className="text-slate-300 hover:text-white"
                         >
                           <Icon name="Edit" size={18} />
@@ -200,6 +210,12 @@ const KnowledgeAdmin = () => {
                 </Card>
               ))}
             </div>
+
+            {docsCursor && (
+              <Button onClick={() => loadDocs(docsCursor)} variant="outline" className="w-full border-slate-600 text-slate-300">
+                Показать ещё
+              </Button>
+            )}
           </div>
         )}
 